@@ -12,6 +12,7 @@ from datetime import datetime
 from typing import List, Dict, Any, Optional, Tuple
 import chardet
 from fastapi import HTTPException
+from categorization_service import CategorizationService, DEFAULT_CATEGORY
 
 
 class BankStatementParser:
@@ -20,9 +21,11 @@ class BankStatementParser:
     Supports major Indian banks like SBI, ICICI, HDFC, Axis, etc.
     """
     
-    def __init__(self):
+    def __init__(self, categorizer: Optional[CategorizationService] = None):
         self.supported_formats = ['.csv', '.pdf']
         self.bank_patterns = self._get_bank_patterns()
+        # Without a shared service, categories come from the merchant cache and keyword rules only
+        self.categorizer = categorizer or CategorizationService()
         
     def _get_bank_patterns(self) -> Dict[str, Dict]:
         """Define parsing patterns for different banks"""
@@ -110,9 +113,11 @@ class BankStatementParser:
         
         try:
             if file_extension == 'csv':
-                return self._parse_csv(file_content, filename)
-            elif file_extension == 'pdf':
-                return self._parse_pdf(file_content, filename)
+                result = self._parse_csv(file_content, filename)
+            else:
+                result = self._parse_pdf(file_content, filename)
+            self._refine_categories(result['transactions'])
+            return result
         except Exception as e:
             raise HTTPException(
                 status_code=422,
@@ -418,28 +423,21 @@ class BankStatementParser:
             return 0.0
     
     def _categorize_transaction(self, description: str) -> str:
-        """Automatically categorize transactions based on description"""
-        description_lower = description.lower()
-        
-        category_keywords = {
-            'food': ['restaurant', 'cafe', 'food', 'zomato', 'swiggy', 'dominos', 'pizza', 'mcdonald', 'kfc', 'grocery', 'supermarket'],
-            'transport': ['uber', 'ola', 'metro', 'bus', 'taxi', 'fuel', 'petrol', 'diesel', 'gas station', 'parking'],
-            'bills': ['electricity', 'water', 'gas', 'internet', 'mobile', 'phone', 'broadband', 'cable', 'dth'],
-            'shopping': ['amazon', 'flipkart', 'myntra', 'ajio', 'shopping', 'mall', 'store', 'market'],
-            'entertainment': ['movie', 'cinema', 'netflix', 'spotify', 'game', 'entertainment'],
-            'healthcare': ['hospital', 'doctor', 'medical', 'pharmacy', 'medicine', 'health'],
-            'education': ['school', 'college', 'university', 'course', 'book', 'education'],
-            'investment': ['mutual fund', 'sip', 'fd', 'rd', 'investment', 'shares', 'stocks'],
-            'transfer': ['neft', 'imps', 'upi', 'transfer', 'payment'],
-            'atm': ['atm', 'cash withdrawal', 'cash'],
-            'salary': ['salary', 'wages', 'income']
-        }
-        
-        for category, keywords in category_keywords.items():
-            if any(keyword in description_lower for keyword in keywords):
-                return category
-        
-        return 'miscellaneous'
+        """Automatically categorize transactions based on description (merchant cache and keyword rules)"""
+        return self.categorizer.categorize(description, use_model=False)[0]
+    
+    def _refine_categories(self, transactions: List[Dict]):
+        """
+        Rows the keyword rules left at the default go through the full cascade,
+        with the model run once over all of them
+        """
+        pending = [t for t in transactions if t.get('category') == DEFAULT_CATEGORY]
+        if not pending:
+            return
+        categories, _, _ = self.categorizer.categorize_batch(
+            [t.get('description', '') for t in pending], [t.get('amount') for t in pending])
+        for transaction, category in zip(pending, categories):
+            transaction['category'] = category
     
     def _extract_transactions_from_pdf_tables(self, tables: List, bank_type: str) -> List[Dict]:
         """Extract transactions from PDF tables"""
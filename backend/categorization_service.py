@@ -0,0 +1,309 @@
+"""
+One categorization cascade for every place that assigns an expense category.
+
+Tiers, cheapest first; the first tier with an answer wins:
+    override          the user's own correction (OnlineExpenseClassifier overrides)
+    high_value_rules  amount-dependent keyword rules for large payments
+    merchant_cache    result already computed for the same normalized merchant
+    rules             compiled keyword rules
+    model             online model once it is ready, else the static classifier,
+                      accepted at MIN_MODEL_CONFIDENCE or above
+    rail_rules        payment-rail keywords
+    default           DEFAULT_CATEGORY
+
+Each tier keeps its own row/hit counters, so every row is counted at most once per
+tier. Results of all three rule tiers carry the source "rules".
+
+Every result is mapped onto CANONICAL_CATEGORIES, and canonicalize_category() is
+applied wherever stored categories are aggregated, so "Food", "dining" and "food"
+are one category downstream.
+"""
+
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from merchant_normalizer import MerchantCategoryCache, merchant_key
+
+# Frontend categories (TransactionEntry.js) plus the bank-statement ones
+CANONICAL_CATEGORIES = (
+    'food', 'transport', 'shopping', 'entertainment', 'bills', 'healthcare', 'education', 'travel',
+    'personal', 'investment', 'transfer', 'atm', 'salary', 'miscellaneous'
+)
+DEFAULT_CATEGORY = 'miscellaneous'
+
+# Names produced by older categorizers, the classifier's training labels and frontend labels
+CATEGORY_ALIASES = {
+    'dining': 'food', 'restaurant': 'food', 'restaurants': 'food', 'groceries': 'food', 'grocery': 'food',
+    'food & dining': 'food',
+    'transportation': 'transport', 'fuel': 'transport', 'taxi': 'transport',
+    'clothing': 'shopping', 'electronics': 'shopping',
+    'discretionary': 'entertainment',
+    'utilities': 'bills', 'rent': 'bills', 'housing': 'bills', 'bills & utilities': 'bills',
+    'medical': 'healthcare', 'health': 'healthcare',
+    'personal care': 'personal',
+    'investments': 'investment', 'mutual funds': 'investment', 'stocks': 'investment',
+    'cash': 'atm', 'cash withdrawal': 'atm',
+    'income': 'salary', 'wages': 'salary',
+    'misc': 'miscellaneous', 'other': 'miscellaneous', 'others': 'miscellaneous', 'uncategorized': 'miscellaneous',
+}
+
+# Keyword rules in priority order (first matching category wins), from the statement parser.
+# Keywords of three letters or fewer only match whole words ('rd' is not 'card', 'ola' is not 'cola').
+KEYWORD_RULES = (
+    ('food', ('restaurant', 'cafe', 'food', 'zomato', 'swiggy', 'dominos', 'pizza', 'mcdonald', 'kfc', 'grocery', 'supermarket')),
+    ('transport', ('uber', 'ola', 'metro', 'bus', 'taxi', 'fuel', 'petrol', 'diesel', 'gas station', 'parking')),
+    ('bills', ('electricity', 'water', 'gas', 'internet', 'mobile', 'phone', 'broadband', 'cable', 'dth')),
+    ('shopping', ('amazon', 'flipkart', 'myntra', 'ajio', 'shopping', 'mall', 'store', 'market')),
+    ('entertainment', ('movie', 'cinema', 'netflix', 'spotify', 'game', 'entertainment')),
+    ('healthcare', ('hospital', 'doctor', 'medical', 'pharmacy', 'medicine', 'health')),
+    ('education', ('school', 'college', 'university', 'course', 'book', 'education')),
+    ('investment', ('mutual fund', 'sip', 'fd', 'rd', 'investment', 'shares', 'stocks')),
+    ('atm', ('atm', 'cash withdrawal', 'cash')),
+    ('salary', ('salary', 'wages', 'income')),
+)
+# Payment-rail words only say how money moved, not what it paid for, so they are tried
+# after the model: NEFT-SWIGGY is food, UPI-RAHUL KUMAR is a transfer
+RAIL_RULES = (
+    ('transfer', ('neft', 'imps', 'upi', 'transfer', 'payment')),
+)
+# Large payments: rent, hospital and travel bookings outrank the generic rules
+HIGH_VALUE_AMOUNT = 10000
+HIGH_VALUE_RULES = (
+    ('bills', ('rent', 'housing', 'apartment')),
+    ('healthcare', ('hospital', 'doctor', 'pharmacy')),
+    ('travel', ('flight', 'hotel', 'booking')),
+)
+RULE_CONFIDENCE = 0.9
+HIGH_VALUE_CONFIDENCE = 0.95
+MIN_MODEL_CONFIDENCE = 0.4
+
+# Amount-based suggestions shown next to the chosen category
+AMOUNT_SUGGESTIONS = (
+    (100, ('food', 'transport', 'bills')),
+    (1000, ('shopping', 'entertainment', 'food')),
+    (5000, ('shopping', 'personal', 'food')),
+    (float('inf'), ('bills', 'travel', 'healthcare', 'education')),
+)
+
+TIERS = ('override', 'high_value_rules', 'merchant_cache', 'rules', 'model', 'rail_rules', 'default')
+
+
+def canonicalize_category(category: Optional[str]) -> str:
+    """Canonical name for any category label; unknown or empty labels become DEFAULT_CATEGORY"""
+    name = str(category or '').strip().lower()
+    if name in CANONICAL_CATEGORIES:
+        return name
+    return CATEGORY_ALIASES.get(name, DEFAULT_CATEGORY)
+
+
+class KeywordRules:
+    """Keyword lists compiled to one regex per category, searched in priority order"""
+
+    def __init__(self, rules: Sequence[Tuple[str, Iterable[str]]]):
+        self._patterns = [(category, re.compile('|'.join(self._keyword_pattern(k) for k in keywords)))
+                          for category, keywords in rules]
+
+    @staticmethod
+    def _keyword_pattern(keyword: str) -> str:
+        return rf"\b{re.escape(keyword)}\b" if len(keyword) <= 3 else re.escape(keyword)
+
+    def match(self, description: str) -> Optional[str]:
+        text = description.lower()
+        for category, pattern in self._patterns:
+            if pattern.search(text):
+                return category
+        return None
+
+
+class CategorizationService:
+    """
+    Tiered categorization with per-tier row/hit counters and latency.
+
+    classify_batch: static classifier, descriptions -> (categories, confidences)
+    model_version: returns the static classifier's version (merchant cache namespace)
+    online_classifier: OnlineExpenseClassifier for user overrides and the online model
+    Without a classifier the cascade ends at the rules.
+    """
+
+    def __init__(self, classify_batch: Optional[Callable[[List[str]], Tuple[List[str], np.ndarray]]] = None,
+                 model_version: Optional[Callable[[], Any]] = None, online_classifier=None,
+                 merchant_cache: Optional[MerchantCategoryCache] = None,
+                 min_model_confidence: float = MIN_MODEL_CONFIDENCE):
+        self.classify_batch = classify_batch
+        self.model_version = model_version
+        self.online_classifier = online_classifier
+        self.merchant_cache = merchant_cache or MerchantCategoryCache()
+        self.min_model_confidence = min_model_confidence
+        self.rules = KeywordRules(KEYWORD_RULES)
+        self.high_value_rules = KeywordRules(HIGH_VALUE_RULES)
+        self.rail_rules = KeywordRules(RAIL_RULES)
+        self._lock = threading.Lock()
+        self._rows = dict.fromkeys(TIERS, 0)
+        self._hits = dict.fromkeys(TIERS, 0)
+        self._seconds = dict.fromkeys(TIERS, 0.0)
+
+    def _record(self, tier: str, rows: int, hits: int, seconds: float):
+        with self._lock:
+            self._rows[tier] += rows
+            self._hits[tier] += hits
+            self._seconds[tier] += seconds
+
+    def _model(self) -> Tuple[Optional[Callable], str, str]:
+        """(classify, source, merchant cache namespace) of the model that serves right now"""
+        online = self.online_classifier
+        if online is not None and online.is_ready:
+            return online.predict_batch, "online_model", f"online:{online.examples_seen}"
+        if self.classify_batch is not None:
+            version = self.model_version() if self.model_version else None
+            return self.classify_batch, "model", f"model:{version}"
+        return None, "model", "rules"
+
+    def categorize(self, description: str, amount: Optional[float] = None, user_id: Optional[str] = None,
+                   use_model: bool = True) -> Tuple[str, float, str]:
+        """(category, confidence, source) for one description"""
+        categories, confidences, sources = self.categorize_batch(
+            [description], None if amount is None else [amount], user_id, use_model)
+        return categories[0], float(confidences[0]), sources[0]
+
+    def categorize_batch(self, descriptions: List[str], amounts: Optional[Sequence[float]] = None,
+                         user_id: Optional[str] = None, use_model: bool = True) -> Tuple[List[str], np.ndarray, List[str]]:
+        """
+        (categories, confidences, sources) for many descriptions, in request order.
+        Each tier only sees the rows the tiers before it left open; past the merchant
+        cache that is one row per merchant, and the model runs once over all of them.
+        use_model=False stops after the keyword rules (e.g. per-row
+        parsing); rows left at the default are then not cached, so a later pass with
+        the model can still categorize them.
+        """
+        n = len(descriptions)
+        categories: List[Optional[str]] = [None] * n
+        confidences = np.zeros(n)
+        sources: List[Optional[str]] = [None] * n
+        descriptions = [str(d or '') for d in descriptions]
+
+        def resolve(i: int, category: str, confidence: float, source: str):
+            categories[i], confidences[i], sources[i] = canonicalize_category(category), confidence, source
+
+        # Tier 1: the user's own corrections
+        open_rows = list(range(n))
+        if user_id and self.online_classifier is not None:
+            started = time.perf_counter()
+            overrides = self.online_classifier.lookup_overrides(user_id, descriptions)
+            for i, category in enumerate(overrides):
+                if category is not None:
+                    resolve(i, category, 1.0, "override")
+            open_rows = [i for i in open_rows if categories[i] is None]
+            self._record("override", n, n - len(open_rows), time.perf_counter() - started)
+
+        # Amount-dependent rules cannot be cached per merchant, so they run before the cache
+        if amounts is not None and open_rows:
+            started = time.perf_counter()
+            matched, checked = 0, len(open_rows)
+            for i in open_rows:
+                if amounts[i] is not None and amounts[i] > HIGH_VALUE_AMOUNT:
+                    category = self.high_value_rules.match(descriptions[i])
+                    if category is not None:
+                        resolve(i, category, HIGH_VALUE_CONFIDENCE, "rules")
+                        matched += 1
+            if matched:
+                open_rows = [i for i in open_rows if categories[i] is None]
+            self._record("high_value_rules", checked, matched, time.perf_counter() - started)
+
+        # The namespace follows the serving model even without use_model, so rule results are shared
+        classify, model_source, namespace = self._model()
+        if not use_model:
+            classify = None
+
+        # Tier 2: merchant cache. Rows of one merchant within the batch are decided once
+        # (by their first row), so repeats count as cache hits too
+        started = time.perf_counter()
+        groups: Dict[str, List[int]] = {}
+        hits: Dict[str, Tuple[str, float, str]] = {}
+        cached_rows = 0
+        for i in open_rows:
+            key = merchant_key(descriptions[i])
+            cached = hits.get(key)
+            if cached is None and key and key not in groups:
+                cached = self.merchant_cache.get(key, namespace)
+                if cached is not None:
+                    hits[key] = cached
+            if cached is not None:
+                categories[i], confidences[i], sources[i] = cached
+                cached_rows += 1
+            else:
+                groups.setdefault(key or f"#{i}", []).append(i)
+        open_rows = [rows[0] for rows in groups.values()]
+        checked = cached_rows + sum(len(rows) for rows in groups.values())
+        self._record("merchant_cache", checked, checked - len(open_rows), time.perf_counter() - started)
+
+        # Tier 3: keyword rules
+        started = time.perf_counter()
+        for i in open_rows:
+            category = self.rules.match(descriptions[i])
+            if category is not None:
+                resolve(i, category, RULE_CONFIDENCE, "rules")
+        checked = len(open_rows)
+        open_rows = [i for i in open_rows if categories[i] is None]
+        self._record("rules", checked, checked - len(open_rows), time.perf_counter() - started)
+
+        # Tier 4: model, one call over every merchant still open
+        if classify is not None and open_rows:
+            started = time.perf_counter()
+            predicted, probabilities = classify([descriptions[i] for i in open_rows])
+            for i, category, probability in zip(open_rows, predicted, probabilities):
+                if probability >= self.min_model_confidence:
+                    resolve(i, category, float(probability), model_source)
+            checked = len(open_rows)
+            open_rows = [i for i in open_rows if categories[i] is None]
+            self._record("model", checked, checked - len(open_rows), time.perf_counter() - started)
+
+        # Rail rules, once the model had its say
+        if use_model and open_rows:
+            started = time.perf_counter()
+            for i in open_rows:
+                category = self.rail_rules.match(descriptions[i])
+                if category is not None:
+                    resolve(i, category, RULE_CONFIDENCE, "rules")
+            checked = len(open_rows)
+            open_rows = [i for i in open_rows if categories[i] is None]
+            self._record("rail_rules", checked, checked - len(open_rows), time.perf_counter() - started)
+
+        # Tier 5: default. A rules-only pass leaves these uncached, the model may still improve them
+        undecided = set(open_rows) if not use_model else set()
+        for i in open_rows:
+            resolve(i, DEFAULT_CATEGORY, 0.0, "default")
+        self._record("default", len(open_rows), len(open_rows), 0.0)
+
+        for key, rows in groups.items():
+            result = (categories[rows[0]], confidences[rows[0]], sources[rows[0]])
+            for i in rows[1:]:
+                categories[i], confidences[i], sources[i] = result
+            if not key.startswith("#") and rows[0] not in undecided:
+                self.merchant_cache.put(key, result, namespace)
+        return categories, confidences, sources
+
+    def suggest(self, description: str, amount: float) -> List[str]:
+        """Likely categories for a description: the rule match first, then amount-based ones"""
+        suggestions = list(next(categories for limit, categories in AMOUNT_SUGGESTIONS if amount < limit))
+        matched = self.rules.match(str(description or ''))
+        if matched is not None:
+            suggestions.insert(0, matched)
+        return list(dict.fromkeys(suggestions))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {
+                tier: {
+                    "rows": self._rows[tier],
+                    "hits": self._hits[tier],
+                    "hit_rate": round(self._hits[tier] / self._rows[tier], 4) if self._rows[tier] else None,
+                    "total_ms": round(self._seconds[tier] * 1000, 2),
+                    "avg_us_per_row": round(self._seconds[tier] * 1e6 / self._rows[tier], 2) if self._rows[tier] else None
+                }
+                for tier in TIERS
+            }
+        return {"tiers": tiers, "merchant_cache": self.merchant_cache.stats()}
@@ -0,0 +1,228 @@
+"""
+Daily-resolution expense forecaster with calendar features.
+
+The monthly model has one training row per month, so a few months of history are
+not enough to fit it. This engine trains on one row per day instead: day of week,
+day of month, days to month end, payday and holiday flags, plus trailing spend
+windows computed for every day at once from a cumulative sum. Daily predictions
+are made recursively (each predicted day feeds the windows of the next) and summed
+into calendar months, so a few weeks of transactions already give a forecast.
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+
+from expense_predictor_model import CustomExpenseForecaster
+
+logger = logging.getLogger(__name__)
+
+# Fixed-date national holidays (month, day); movable festivals can be passed as extra_holidays
+FIXED_HOLIDAYS = ((1, 1), (1, 26), (8, 15), (10, 2), (12, 25))
+# Salary typically lands on the 1st; spending is elevated for the first few days after it
+PAYDAY_DAYS = (1,)
+PAYDAY_WINDOW = 3
+TRAILING_WINDOWS = (7, 28)
+MIN_HISTORY_DAYS = 14
+
+FEATURES = ['day_of_week', 'day_of_month', 'days_to_month_end', 'is_payday', 'is_holiday',
+            'lag_1', 'lag_7', 'mean_7', 'mean_28']
+
+
+def daily_series(historical_expenses: List[Dict], as_of: Optional[datetime] = None) -> pd.Series:
+    """Zero-filled daily totals from the first transaction day up to as_of (default: last transaction day)"""
+    df = pd.DataFrame(historical_expenses)
+    days = pd.to_datetime(df['timestamp']).dt.normalize()
+    totals = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0).groupby(days.values).sum()
+    end = pd.Timestamp(as_of).normalize() if as_of is not None else totals.index.max()
+    return totals.reindex(pd.date_range(totals.index.min(), end, freq='D'), fill_value=0.0)
+
+
+def calendar_features(dates: pd.DatetimeIndex, extra_holidays: Iterable = ()) -> Dict[str, np.ndarray]:
+    """Calendar columns for every date at once"""
+    day_of_month = dates.day.to_numpy()
+    payday_offsets = np.stack([day_of_month - day for day in PAYDAY_DAYS])
+    holidays = set(FIXED_HOLIDAYS)
+    extra = {pd.Timestamp(day).normalize() for day in extra_holidays}
+    is_holiday = np.array([(d.month, d.day) in holidays or d in extra for d in dates], dtype=float)
+    return {
+        'day_of_week': dates.dayofweek.to_numpy(dtype=float),
+        'day_of_month': day_of_month.astype(float),
+        'days_to_month_end': (dates.days_in_month.to_numpy() - day_of_month).astype(float),
+        'is_payday': ((payday_offsets >= 0) & (payday_offsets < PAYDAY_WINDOW)).any(axis=0).astype(float),
+        'is_holiday': is_holiday,
+    }
+
+
+def window_features(y: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Lag and trailing-mean columns for every day, using only the days before it.
+    All windows come from one cumulative sum instead of a rolling() per window.
+    """
+    n = len(y)
+    cumulative = np.concatenate(([0.0], np.cumsum(y)))
+    t = np.arange(n)
+    columns = {}
+    for window in TRAILING_WINDOWS:
+        start = np.maximum(t - window, 0)
+        count = t - start
+        columns[f'mean_{window}'] = np.divide(cumulative[t] - cumulative[start], count,
+                                              out=np.zeros(n), where=count > 0)
+    columns['lag_1'] = np.concatenate(([0.0], y[:-1]))[:n]
+    # Before a week of history exists, the same weekday is unknown: use the trailing mean
+    columns['lag_7'] = np.where(t >= 7, np.concatenate((np.zeros(7), y))[:n], columns['mean_28'])
+    return columns
+
+
+class DailyExpenseForecaster:
+    """
+    Gradient boosting over daily spend, aggregated to monthly forecasts.
+    fit() / refresh_features() / predict_from_fitted() mirror CustomExpenseForecaster so
+    fitted bundles can be kept in forecast_model_store.ForecastModelStore.
+    """
+
+    def __init__(self, extra_holidays: Iterable = ()):
+        self.extra_holidays = tuple(extra_holidays)
+
+    def _feature_matrix(self, series: pd.Series) -> np.ndarray:
+        columns = {**calendar_features(series.index, self.extra_holidays), **window_features(series.to_numpy())}
+        return np.column_stack([columns[name] for name in FEATURES])
+
+    def fit(self, historical_expenses: List[Dict], as_of: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        """
+        Fits on daily totals up to as_of. Accuracy is measured on the last 20% of days
+        (scored as weekly totals), then the model is refitted on every day.
+        Returns None when the history spans fewer than MIN_HISTORY_DAYS days.
+        """
+        if not historical_expenses or len(historical_expenses) < 5:
+            logger.warning("Insufficient historical data for daily model.")
+            return None
+
+        series = daily_series(historical_expenses, as_of)
+        if len(series) < MIN_HISTORY_DAYS:
+            logger.warning(f"Only {len(series)} days of history, daily model needs {MIN_HISTORY_DAYS}.")
+            return None
+
+        X = self._feature_matrix(series)
+        y = series.to_numpy(dtype=float)
+        # Day 0 has no history behind its window features
+        X, y = X[1:], y[1:]
+
+        n_test = max(7, int(round(len(y) * 0.2)))
+        model = GradientBoostingRegressor(n_estimators=100, learning_rate=0.1, max_depth=3, random_state=42)
+        if len(y) - n_test >= MIN_HISTORY_DAYS:
+            model.fit(X[:-n_test], y[:-n_test])
+            model_accuracy = self._weekly_accuracy(y[-n_test:], model.predict(X[-n_test:]))
+            logger.info(f"Daily model accuracy on last {n_test} days: {model_accuracy:.2f}")
+        else:
+            model_accuracy = None
+
+        model.fit(X, y)
+        if model_accuracy is None:
+            model_accuracy = self._weekly_accuracy(y, model.predict(X))
+            logger.info(f"Daily model accuracy in-sample (short history): {model_accuracy:.2f}")
+
+        return {
+            "model": model,
+            "features": FEATURES,
+            "daily_series": series,
+            "model_accuracy": float(model_accuracy),
+            "fast_predict_base": CustomExpenseForecaster._fast_predict_base(model, X),
+            "resolution": "daily"
+        }
+
+    @staticmethod
+    def _weekly_accuracy(actual: np.ndarray, predicted: np.ndarray) -> float:
+        """1 - MAE / mean over 7-day totals (counted back from the last day); daily spend is too spiky to score"""
+        n_weeks = max(1, len(actual) // 7)
+        size = min(len(actual), n_weeks * 7)
+        weekly_actual = actual[-size:].reshape(n_weeks, -1).sum(axis=1)
+        weekly_predicted = predicted[-size:].reshape(n_weeks, -1).sum(axis=1)
+        mean_actual = weekly_actual.mean()
+        if mean_actual <= 0:
+            return 1.0
+        return float(max(0.0, 1.0 - np.abs(weekly_actual - weekly_predicted).mean() / mean_actual))
+
+    def refresh_features(self, fitted: Dict[str, Any], historical_expenses: List[Dict]) -> Dict[str, Any]:
+        """Rebuilds the daily series from newer data while keeping the fitted model"""
+        return {**fitted, "daily_series": daily_series(historical_expenses)}
+
+    def _predict_days(self, fitted: Dict[str, Any], n_days: int) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+        """
+        Recursive daily forecast on a preallocated buffer: calendar columns are filled for all
+        days up front, and the window columns of each day come from a running cumulative sum
+        that already includes the predictions before it.
+        """
+        series = fitted["daily_series"]
+        history = series.to_numpy(dtype=float)
+        n_history = len(history)
+        dates = pd.date_range(series.index[-1] + pd.Timedelta(days=1), periods=n_days, freq='D')
+
+        features = fitted["features"]
+        column = {name: i for i, name in enumerate(features)}
+        X = np.zeros((n_days, len(features)))
+        for name, values in calendar_features(dates, self.extra_holidays).items():
+            X[:, column[name]] = values
+
+        values = np.concatenate((history, np.zeros(n_days)))
+        cumulative = np.concatenate(([0.0], np.cumsum(values)))
+        predictions = np.empty(n_days)
+        for i in range(n_days):
+            t = n_history + i
+            row = X[i:i + 1]
+            for window in TRAILING_WINDOWS:
+                start = max(t - window, 0)
+                row[0, column[f'mean_{window}']] = (cumulative[t] - cumulative[start]) / (t - start)
+            row[0, column['lag_1']] = values[t - 1]
+            row[0, column['lag_7']] = values[t - 7] if t >= 7 else row[0, column['mean_28']]
+
+            predicted = max(float(CustomExpenseForecaster._fast_predict(fitted, row)[0]), 0.0)
+            predictions[i] = predicted
+            values[t] = predicted
+            cumulative[t + 1] = cumulative[t] + predicted
+        return dates, predictions
+
+    def predict_from_fitted(self, fitted: Dict[str, Any], timeframe: int) -> Dict[str, Any]:
+        """
+        Forecasts the `timeframe` calendar months after the last history month.
+        The rest of the last history month is predicted too and reported as
+        "current_month": observed spend so far plus the predicted remainder.
+        Returns: {"forecast": [...], "current_month": {...}, "model_accuracy": float}
+        """
+        series = fitted["daily_series"]
+        last_day = series.index[-1]
+        current_month = last_day.to_period('M')
+        end = (current_month + timeframe).end_time.normalize()
+        dates, predictions = self._predict_days(fitted, (end - last_day).days)
+
+        monthly = pd.Series(predictions, index=dates).groupby(dates.to_period('M')).sum()
+        observed = float(series[series.index.to_period('M') == current_month].sum())
+        remainder = float(monthly.get(current_month, 0.0))
+
+        forecast_data = [
+            {
+                "date": period.start_time.strftime("%Y-%m-%d"),
+                "period": period.strftime("%Y-%m"),
+                "predicted_amount": round(float(monthly[period]), 2),
+                "category": "all"
+            }
+            for period in (current_month + i for i in range(1, timeframe + 1))
+        ]
+        return {
+            "forecast": forecast_data,
+            "current_month": {
+                "period": current_month.strftime("%Y-%m"),
+                "observed_amount": round(observed, 2),
+                "predicted_amount": round(observed + remainder, 2)
+            },
+            "model_accuracy": round(fitted["model_accuracy"], 3)
+        }
+
+    def train_and_predict(self, historical_expenses: List[Dict], timeframe: int) -> Optional[Dict[str, Any]]:
+        """Fit and forecast in one call; None when the history is too short for the daily model"""
+        fitted = self.fit(historical_expenses)
+        return self.predict_from_fitted(fitted, timeframe) if fitted is not None else None
@@ -1,3 +1,10 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 from datetime import datetime
 try:
@@ -6,40 +13,225 @@ except ImportError:
     Prophet = None
 from statsmodels.tsa.arima.model import ARIMA
 
+# Seconds a single category fit may take before its forecast is reported as None
+DEFAULT_FIT_TIMEOUT = 30.0
+
+# Warm-start parameters from the previous fit of each (cache_key, category, method)
+_WARM_START_CACHE_SIZE = 1024
+_warm_start_params = OrderedDict()
+_warm_start_lock = threading.Lock()
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers=None):
+    """
+    Process pool shared across calls (spawned workers: statsmodels/Stan are not fork-safe under threads).
+    A call asking for a different pool size replaces the pool; fits already queued on the old one still finish.
+    """
+    global _executor, _executor_workers
+    workers = max_workers or os.cpu_count() or 1
+    with _executor_lock:
+        if _executor is not None and _executor_workers != workers:
+            _executor.shutdown(wait=False)
+            _executor = None
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _executor_workers = workers
+        return _executor
+
+
+def _warm_up_worker():
+    """No-op task: unpickling it makes a new worker import this module (pandas, statsmodels, Prophet)"""
+    return os.getpid()
+
+
+def warm_up_pool(max_workers=None):
+    """
+    Start the shared pool's workers ahead of the first forecast. Spawned workers re-import
+    pandas/statsmodels/Prophet, several seconds per cold pool (about 8 s for the first pooled
+    call against 0.3 s for 8 categories fitted serially), and that start-up would otherwise
+    count against the first call's fit timeouts.
+    """
+    workers = max_workers or os.cpu_count() or 1
+    executor = _get_executor(workers)
+    # Workers are spawned on demand, one per submission while none is idle
+    wait([executor.submit(_warm_up_worker) for _ in range(workers)])
+
+
+def _recycle_executor(executor):
+    """
+    Replace the shared pool and kill its workers. A fit that is already running cannot be
+    cancelled, so this is the only way to get a hung Prophet/ARIMA fit's worker back;
+    fits of other callers running on the same pool are lost and come back as None.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def _category_month_matrix(df):
+    """
+    One groupby to a month x category matrix of totals.
+    Each category keeps the span between its first and last month, zero-filled inside.
+    """
+    matrix = df.groupby([pd.Grouper(key='date', freq='MS'), 'category'])['amount'].sum().unstack('category')
+    matrix = matrix.reindex(pd.date_range(matrix.index.min(), matrix.index.max(), freq='MS'))
+    series = {}
+    for cat in matrix.columns:
+        column = matrix[cat]
+        series[cat] = column.loc[column.first_valid_index():column.last_valid_index()].fillna(0.0)
+    return series
+
+
+def _fit_category(cat, ds, y, method, start_params=None):
+    """
+    Fit one category and forecast next month. Runs in a worker process.
+    Returns (category, prediction or None, parameters for warm-starting the next fit).
+    """
+    if method == "prophet" and Prophet is not None:
+        cat_df = pd.DataFrame({'ds': ds, 'y': y})
+        model = Prophet(yearly_seasonality=False, daily_seasonality=False, weekly_seasonality=False)
+        if start_params:
+            model.fit(cat_df, init=start_params)
+        else:
+            model.fit(cat_df)
+        future = model.make_future_dataframe(periods=1, freq='MS')
+        forecast = model.predict(future)
+        next_month = forecast.iloc[-1]['yhat']
+        # Prophet's documented warm-start initialisation
+        params = {name: model.params[name][0][0] for name in ['k', 'm', 'sigma_obs']}
+        params.update({name: model.params[name][0] for name in ['delta', 'beta']})
+        return cat, round(next_month, 2), params
+    # ARIMA fallback
+    try:
+        model = ARIMA(pd.Series(y), order=(1,1,1))
+        fit = model.fit(start_params=start_params) if start_params is not None else model.fit()
+        pred = fit.forecast(steps=1)
+        return cat, round(float(pred.iloc[0]), 2), fit.params.to_numpy()
+    except Exception:
+        return cat, None, None
+
+
+def _fit_in_pool(jobs, workers, fit_timeout, results):
+    """
+    Fan category fits out to the process pool, at most `workers` at a time so each fit's
+    timeout runs from its own submission. A fit that overruns is recorded as None in results,
+    and its worker stays lost until the pool is recycled: immediately once no worker is left
+    for this call's remaining fits, otherwise when the call is done.
+    """
+    global _executor
+    pending = list(jobs)
+    running = {}  # future -> (job, deadline)
+    outcomes = []
+    hung = 0
+    executor = _get_executor(workers)
+    while pending or running:
+        while pending and len(running) < workers - hung:
+            job = pending[0]
+            try:
+                future = executor.submit(_fit_category, *job)
+            except BrokenProcessPool:
+                # A worker died earlier (e.g. OOM); start a fresh pool next time and fit the rest serially now
+                with _executor_lock:
+                    _executor = None
+                outcomes.extend(_fit_category(*job) for job, _ in running.values())
+                outcomes.extend(_fit_category(*job) for job in pending)
+                return outcomes
+            pending.pop(0)
+            running[future] = (job, time.monotonic() + fit_timeout)
+
+        next_deadline = min(deadline for _, deadline in running.values())
+        done, _ = wait(running, timeout=max(0.0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        for future in done:
+            job, _ = running.pop(future)
+            try:
+                outcomes.append(future.result())
+            except Exception:
+                outcomes.append((job[0], None, None))
+
+        now = time.monotonic()
+        for future, (job, deadline) in list(running.items()):
+            if deadline <= now:
+                del running[future]
+                results[job[0]] = None
+                hung += 1
+        if hung and hung >= workers:
+            # Every worker is stuck on an overrun fit; nothing else of this call is running
+            _recycle_executor(executor)
+            executor, hung = _get_executor(workers), 0
+
+    if hung:
+        _recycle_executor(executor)
+    return outcomes
+
+
+def _cached_start_params(key):
+    with _warm_start_lock:
+        return _warm_start_params.get(key)
+
+
+def _store_start_params(key, params):
+    with _warm_start_lock:
+        _warm_start_params[key] = params
+        _warm_start_params.move_to_end(key)
+        while len(_warm_start_params) > _WARM_START_CACHE_SIZE:
+            _warm_start_params.popitem(last=False)
+
+
 # Example function: forecast next month's spending per category
-def forecast_expense_trend(expense_data, method="prophet"):
+def forecast_expense_trend(expense_data, method="prophet", cache_key=None, max_workers=None,
+                           fit_timeout=DEFAULT_FIT_TIMEOUT):
     """
     expense_data: list of dicts with keys ['date', 'amount', 'category']
     method: 'prophet' or 'arima'
+    cache_key: identifies the data owner (e.g. user id) so each category's next fit
+               starts from the parameters of its previous one
+    max_workers: process pool size; 1 fits serially in this process
+    fit_timeout: seconds per category fit from its submission; categories that do not
+                 finish get None, and the workers running them are replaced. Enforced
+                 by running fits in the pool, even a single one; with max_workers=1 or
+                 fit_timeout=None fits run inline and cannot be interrupted.
+                 The pool's first use pays the spawn start-up (see warm_up_pool).
     Returns: dict {category: predicted_amount}
     """
     df = pd.DataFrame(expense_data)
     df['date'] = pd.to_datetime(df['date'])
+    method = method if method == "prophet" and Prophet is not None else "arima"
+
     results = {}
-    for cat in df['category'].unique():
-        cat_df = df[df['category'] == cat].copy()
-        cat_df = cat_df.groupby(pd.Grouper(key='date', freq='M')).sum().reset_index()
-        cat_df = cat_df.rename(columns={'date': 'ds', 'amount': 'y'})
-        if len(cat_df) < 3:
+    jobs = []
+    for cat, series in _category_month_matrix(df).items():
+        if len(series) < 3:
             results[cat] = None  # Not enough data
             continue
-        if method == "prophet" and Prophet is not None:
-            model = Prophet(yearly_seasonality=False, daily_seasonality=False, weekly_seasonality=False)
-            model.fit(cat_df)
-            future = model.make_future_dataframe(periods=1, freq='M')
-            forecast = model.predict(future)
-            next_month = forecast.iloc[-1]['yhat']
-            results[cat] = round(next_month, 2)
-        else:
-            # ARIMA fallback
-            try:
-                model = ARIMA(cat_df['y'], order=(1,1,1))
-                fit = model.fit()
-                pred = fit.forecast(steps=1)
-                results[cat] = round(float(pred.iloc[0]), 2)
-            except Exception:
-                results[cat] = None
-    return results
+        params_key = (cache_key, cat, method)
+        jobs.append((cat, series.index, series.to_numpy(), method,
+                     _cached_start_params(params_key) if cache_key is not None else None))
+
+    workers = max_workers or os.cpu_count() or 1
+    if not jobs:
+        outcomes = []
+    elif workers == 1 or fit_timeout is None:
+        outcomes = [_fit_category(*job) for job in jobs]
+    else:
+        outcomes = _fit_in_pool(jobs, workers, fit_timeout, results)
+
+    for cat, prediction, params in outcomes:
+        results[cat] = prediction
+        if cache_key is not None and params is not None:
+            _store_start_params((cache_key, cat, method), params)
+    return {cat: results.get(cat) for cat in df['category'].unique()}
 
 # Example usage:
 # expense_data = [
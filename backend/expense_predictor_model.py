@@ -1,3 +1,4 @@
+import hashlib
 import pandas as pd
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
@@ -7,11 +8,34 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error
 import logging
 
+try:
+    # Cython routine behind GradientBoostingRegressor.predict; calling it directly skips
+    # per-call input validation, which dominates the cost of one-row predictions
+    from sklearn.ensemble._gradient_boosting import predict_stages
+except ImportError:  # pragma: no cover - depends on the installed scikit-learn
+    predict_stages = None
+
 logger = logging.getLogger(__name__)
 
+FORECAST_STRATEGIES = ("recursive", "direct")
+
+
+def stable_seed(*parts) -> int:
+    """Random seed derived from the given values; unlike hash(), identical across processes and restarts"""
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def future_month_starts(periods: int, reference: datetime = None) -> pd.DatetimeIndex:
+    """The `periods` month starts following the month of `reference` (default: now)"""
+    current_month = pd.Timestamp(reference or datetime.now()).normalize().replace(day=1)
+    return pd.date_range(current_month, periods=periods + 1, freq='MS')[1:]
+
+
 class CustomExpenseForecaster:
     """A service for custom ML-based expense forecasting.
-    This version trains a model on-the-fly for a given user's historical data.
+    fit() and predict_from_fitted() are separate so fitted models can be reused
+    across requests (see forecast_model_store.ForecastModelStore).
     """
     def __init__(self):
         pass # No complex initialization needed for on-the-fly training
@@ -27,8 +51,8 @@ class CustomExpenseForecaster:
         df['timestamp'] = pd.to_datetime(df['timestamp'])
         df = df.set_index('timestamp')
         
-        # Resample to monthly totals
-        monthly_df = df.resample('M')['amount'].sum().reset_index()
+        # Resample to monthly totals (month-start labels, valid across pandas versions)
+        monthly_df = df.resample('MS')['amount'].sum().reset_index()
         monthly_df.rename(columns={'timestamp': 'date', 'amount': 'total_expense'}, inplace=True)
         
         # Feature Engineering
@@ -47,7 +71,7 @@ class CustomExpenseForecaster:
         # For simplicity, fill with median of the column or 0
         for col in ['lag_1', 'lag_2', 'rolling_mean_3']:
             if col in monthly_df.columns: # Check if column exists before trying to fill
-                monthly_df[col].fillna(monthly_df[col].median() if not monthly_df[col].empty else 0, inplace=True)
+                monthly_df[col] = monthly_df[col].fillna(monthly_df[col].median() if not monthly_df[col].empty else 0)
 
         # Drop the first few rows that have NaNs due to lagging/rolling if desired, or handle them in training.
         # For on-the-fly training, simpler to just keep and let model handle NaNs or fill more aggressively.
@@ -55,21 +79,35 @@ class CustomExpenseForecaster:
 
         return monthly_df
 
-    def train_and_predict(self, historical_expenses: List[Dict], timeframe: int) -> Dict[str, Any]:
+    def train_and_predict(self, historical_expenses: List[Dict], timeframe: int,
+                          strategy: str = "recursive") -> Dict[str, Any]:
         """
         Trains a custom ML model on historical data and predicts future expenses.
         Returns: {"forecast": [...], "model_accuracy": float}
         """
+        fitted = self.fit(historical_expenses, strategy=strategy, max_horizon=timeframe)
+        if fitted is None:
+            return self._basic_fallback_forecast(historical_expenses, timeframe)
+        return self.predict_from_fitted(fitted, timeframe, strategy=strategy)
+
+    def fit(self, historical_expenses: List[Dict], strategy: str = "recursive",
+            max_horizon: int = 24) -> Optional[Dict[str, Any]]:
+        """
+        Fits the model on historical data.
+        Returns a fitted bundle {"model", "features", "monthly_frame", "model_accuracy"},
+        or None when there is not enough data for the ML model.
+        With strategy="direct" the bundle also holds one model per horizon up to max_horizon.
+        """
         if not historical_expenses or len(historical_expenses) < 5: # Increased minimum data for meaningful ML
             logger.warning("Insufficient historical data for custom ML model, falling back to basic forecasting.")
-            return self._basic_fallback_forecast(historical_expenses, timeframe)
+            return None
         
         df = self._prepare_data_for_training(historical_expenses)
 
         # If after aggregation, we still don't have enough monthly points
         if len(df) < 3: 
             logger.warning("Insufficient monthly aggregated data for custom ML model, falling back to basic forecasting.")
-            return self._basic_fallback_forecast(historical_expenses, timeframe)
+            return None
 
         # Define features (X) and target (y)
         features = ['month', 'quarter', 'year', 'lag_1', 'lag_2', 'rolling_mean_3']
@@ -79,7 +117,7 @@ class CustomExpenseForecaster:
         available_features = [f for f in features if f in df.columns]
         if not available_features or len(df) < 2: # Need at least 2 data points for training a regression model
              logger.warning(f"Not enough features or data points after preparation ({len(df)}), falling back.")
-             return self._basic_fallback_forecast(historical_expenses, timeframe)
+             return None
 
         X = df[available_features]
         y = df[target]
@@ -110,46 +148,382 @@ class CustomExpenseForecaster:
             model_accuracy = 1.0 - (mae / y_train.mean()) if y_train.mean() > 0 else 1.0
             logger.info(f"Model MAE on train set (no test): {mae:.2f}, Accuracy: {model_accuracy:.2f}")
 
+        # Residual pool for prediction intervals: held-out errors when there are enough of them,
+        # otherwise in-sample errors (optimistic for boosted trees, so intervals come out narrower)
+        if len(y_test) >= 3:
+            residuals = y_test.to_numpy(dtype=float) - y_pred_test
+        else:
+            residuals = y.to_numpy(dtype=float) - model.predict(X)
+
+        fitted = {
+            "model": model,
+            "features": available_features,
+            "monthly_frame": df,
+            "model_accuracy": float(model_accuracy),
+            "fast_predict_base": self._fast_predict_base(model, X.to_numpy(dtype=float)),
+            "residuals": residuals
+        }
+        if strategy == "direct":
+            fitted["direct_models"] = self._fit_direct_models(df, available_features, max_horizon)
+        return fitted
+
+    def _fit_direct_models(self, df: pd.DataFrame, features: List[str], max_horizon: int) -> List[Dict[str, Any]]:
+        """
+        Direct multi-horizon models: model h maps the features of month t to the total of month t+h.
+        Horizons that the history is too short to train reuse the longest trainable one.
+        """
+        X = df[features].to_numpy(dtype=float)
+        y = df['total_expense'].to_numpy(dtype=float)
+        direct_models = []
+        for h in range(1, min(max_horizon, len(df) - 2) + 1):
+            model = GradientBoostingRegressor(n_estimators=100, learning_rate=0.1, max_depth=3, random_state=42)
+            model.fit(X[:-h], y[h:])
+            direct_models.append({"model": model, "fast_predict_base": self._fast_predict_base(model, X)})
+        return direct_models
+
+    @staticmethod
+    def _fast_predict_base(model, X: np.ndarray) -> Optional[float]:
+        """
+        Init prediction for the stage-sum fast path, or None when the fast path does not
+        reproduce model.predict (other loss/init, or a scikit-learn without predict_stages).
+        """
+        if predict_stages is None or not isinstance(model, GradientBoostingRegressor):
+            return None
+        try:
+            if model.init_ == "zero":
+                base = 0.0
+            else:
+                base = float(np.ravel(model.init_.predict(X[:1]))[0])
+            expected = model.predict(pd.DataFrame(X, columns=getattr(model, "feature_names_in_", None)))
+            fast = CustomExpenseForecaster._fast_predict({"model": model, "fast_predict_base": base}, X)
+            return base if np.allclose(fast, expected) else None
+        except Exception as e:
+            logger.warning(f"Fast predict path disabled: {e}")
+            return None
+
+    @staticmethod
+    def _fast_predict(fitted: Dict[str, Any], X: np.ndarray) -> np.ndarray:
+        """Predict rows of a float feature matrix, skipping sklearn validation when possible"""
+        model = fitted["model"]
+        base = fitted.get("fast_predict_base")
+        if base is None:
+            return model.predict(pd.DataFrame(X, columns=getattr(model, "feature_names_in_", None)))
+        out = np.full((X.shape[0], 1), base, dtype=np.float64)
+        predict_stages(model.estimators_, np.ascontiguousarray(X, dtype=np.float32), model.learning_rate, out)
+        return out[:, 0]
+
+    @staticmethod
+    def _calendar_buffer(features: List[str], future_dates: List[pd.Timestamp], rows_per_date: int = 1) -> np.ndarray:
+        """
+        Preallocated feature matrix for all future months, calendar columns filled in.
+        Row block i (rows_per_date rows) belongs to future_dates[i]; lag columns are left at 0.
+        """
+        X = np.zeros((len(future_dates) * rows_per_date, len(features)), dtype=float)
+        calendar = {
+            'month': [d.month for d in future_dates],
+            'quarter': [d.quarter for d in future_dates],
+            'year': [d.year for d in future_dates],
+        }
+        for name, values in calendar.items():
+            if name in features:
+                X[:, features.index(name)] = np.repeat(values, rows_per_date)
+        return X
+
+    def refresh_features(self, fitted: Dict[str, Any], historical_expenses: List[Dict]) -> Dict[str, Any]:
+        """
+        Rebuilds the monthly feature frame from newer data while keeping the fitted model,
+        so forecasts start from the latest months without retraining.
+        """
+        return {**fitted, "monthly_frame": self._prepare_data_for_training(historical_expenses)}
+
+    def predict_from_fitted(self, fitted: Dict[str, Any], timeframe: int,
+                            strategy: str = "recursive", quantiles: Optional[List[float]] = None,
+                            n_paths: int = 500, seed: int = 0) -> Dict[str, Any]:
+        """
+        Predicts future monthly expenses from a fitted bundle returned by fit().
+        strategy="direct" uses the per-horizon models (if the bundle has them) instead of
+        feeding predictions back as lags.
+        With quantiles (e.g. [0.1, 0.5, 0.9]) every month also gets "quantiles",
+        "lower_bound" and "upper_bound" from a residual bootstrap over n_paths sample paths.
+        Returns: {"forecast": [...], "model_accuracy": float}
+        """
+        df = fitted["monthly_frame"]
+
         # Generate future dates for prediction
         last_date = df['date'].max()
         future_dates = [last_date + pd.DateOffset(months=i) for i in range(1, timeframe + 1)]
 
-        forecast_data = []
-        current_lag1 = df['total_expense'].iloc[-1] if not df.empty else 0
-        current_lag2 = df['total_expense'].iloc[-2] if len(df) >= 2 else 0
-        current_rolling_mean = df['rolling_mean_3'].iloc[-1] if not df.empty else 0
-
-        for i, future_date in enumerate(future_dates):
-            # Prepare features for the future month
-            future_features = pd.DataFrame({
-                'month': [future_date.month],
-                'quarter': [future_date.quarter],
-                'year': [future_date.year],
-                'lag_1': [current_lag1],
-                'lag_2': [current_lag2],
-                'rolling_mean_3': [current_rolling_mean]
-            })
-            # Ensure columns are in the same order as training data
-            future_features = future_features[available_features]
-
-            predicted_amount = model.predict(future_features)[0]
-            predicted_amount = max(0, predicted_amount) # Ensure non-negative predictions
+        direct = strategy == "direct" and bool(fitted.get("direct_models"))
+        if direct:
+            predictions = self._predict_direct(fitted, timeframe)
+        else:
+            predictions = self._predict_recursive(fitted, future_dates)
 
-            forecast_data.append({
+        forecast_data = [
+            {
                 "date": future_date.strftime("%Y-%m-%d"),
                 "period": future_date.strftime("%Y-%m"),
-                "predicted_amount": round(float(predicted_amount), 2),
+                "predicted_amount": round(float(amount), 2),
                 "category": "all" # This model predicts total, category breakdown is handled elsewhere
-            })
+            }
+            for future_date, amount in zip(future_dates, predictions)
+        ]
+
+        if quantiles:
+            quantiles = sorted(quantiles)
+            bounds = self._bootstrap_quantiles(fitted, future_dates, predictions, direct, quantiles, n_paths, seed)
+            for i, item in enumerate(forecast_data):
+                item["quantiles"] = {f"p{q * 100:g}": round(float(bounds[j, i]), 2) for j, q in enumerate(quantiles)}
+                item["lower_bound"] = round(float(bounds[0, i]), 2)
+                item["upper_bound"] = round(float(bounds[-1, i]), 2)
+
+        return {"forecast": forecast_data, "model_accuracy": round(fitted["model_accuracy"], 3)}
+
+    def _residual_pool(self, fitted: Dict[str, Any]) -> np.ndarray:
+        """One-step errors to resample; bundles stored before intervals existed fall back to in-sample errors"""
+        residuals = fitted.get("residuals")
+        if residuals is None or len(residuals) == 0:
+            df = fitted["monthly_frame"]
+            X = df[fitted["features"]].to_numpy(dtype=float)
+            residuals = df['total_expense'].to_numpy(dtype=float) - self._fast_predict(fitted, X)
+        residuals = np.asarray(residuals, dtype=float)
+        # Centre the pool: the bootstrap should add spread, not the holdout period's bias
+        return residuals - residuals.mean()
+
+    def _bootstrap_quantiles(self, fitted: Dict[str, Any], future_dates: List[pd.Timestamp],
+                             predictions: np.ndarray, direct: bool, quantiles: List[float],
+                             n_paths: int, seed: int) -> np.ndarray:
+        """
+        Quantiles (len(quantiles), horizon) from a residual bootstrap with a fixed seed.
+        Recursive: every path adds a resampled residual each month, and the noisy value feeds
+        that path's lags, so all paths advance together as one batched predict per month.
+        Direct: horizon h adds the sum of h resampled one-step residuals to the point forecast.
+        """
+        rng = np.random.default_rng(seed)
+        residuals = self._residual_pool(fitted)
+        horizon = len(future_dates)
+        draws = residuals[rng.integers(0, len(residuals), size=(horizon, n_paths))]
+
+        if direct:
+            paths = np.maximum(predictions[:, None] + np.cumsum(draws, axis=0), 0)
+        else:
+            paths = self._predict_recursive(fitted, future_dates, noise=draws)
+        return np.quantile(paths, quantiles, axis=1)
+
+    def _predict_recursive(self, fitted: Dict[str, Any], future_dates: List[pd.Timestamp],
+                           noise: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Recursive forecast on a preallocated feature buffer; predictions feed the next month's lags.
+        With noise of shape (horizon, n_paths) all paths are simulated at once and the result
+        has that shape; otherwise a single point path of shape (horizon,) is returned.
+        """
+        df = fitted["monthly_frame"]
+        features = fitted["features"]
+        n_paths = 1 if noise is None else noise.shape[1]
+        X = self._calendar_buffer(features, future_dates, rows_per_date=n_paths)
+        column = {name: i for i, name in enumerate(features)}
+
+        lag_1 = np.full(n_paths, df['total_expense'].iloc[-1] if not df.empty else 0, dtype=float)
+        lag_2 = np.full(n_paths, df['total_expense'].iloc[-2] if len(df) >= 2 else 0, dtype=float)
+        rolling_mean = np.full(n_paths, df['rolling_mean_3'].iloc[-1] if not df.empty else 0, dtype=float)
+
+        predictions = np.empty((len(future_dates), n_paths))
+        for i in range(len(future_dates)):
+            block = X[i * n_paths:(i + 1) * n_paths]
+            for name, value in (('lag_1', lag_1), ('lag_2', lag_2), ('rolling_mean_3', rolling_mean)):
+                if name in column:
+                    block[:, column[name]] = value
+            predicted_amount = self._fast_predict(fitted, block)
+            if noise is not None:
+                predicted_amount = predicted_amount + noise[i]
+            predicted_amount = np.maximum(predicted_amount, 0) # Ensure non-negative predictions
+            predictions[i] = predicted_amount
 
             # Update lags for the next prediction step
-            current_lag2 = current_lag1
-            current_lag1 = predicted_amount
-            # Recalculate rolling mean for next step (simplified for rolling prediction)
-            current_rolling_mean = (current_rolling_mean * 2 + predicted_amount) / 3 if len(df) >= 2 else predicted_amount # Simple update, better to keep track of last 3 actual/predicted
+            lag_2, lag_1 = lag_1, predicted_amount
+            # Simplified rolling update (same as the original per-step DataFrame loop)
+            rolling_mean = (rolling_mean * 2 + predicted_amount) / 3 if len(df) >= 2 else predicted_amount
+        return predictions[:, 0] if noise is None else predictions
+
+    def _predict_direct(self, fitted: Dict[str, Any], timeframe: int) -> np.ndarray:
+        """Direct forecast: every horizon model scores the same latest feature row"""
+        direct_models = fitted["direct_models"]
+        x_last = fitted["monthly_frame"][fitted["features"]].to_numpy(dtype=float)[-1:]
+        predictions = np.array([
+            self._fast_predict(direct_models[min(h, len(direct_models)) - 1], x_last)[0]
+            for h in range(1, timeframe + 1)
+        ])
+        return np.maximum(predictions, 0)
+
+    def _prepare_multi_category_frame(self, historical_expenses: List[Dict],
+                                      categories: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Builds one long-format monthly frame (one row per category and month) with the same
+        time features as _prepare_data_for_training plus an integer category code.
+        Months without spend in a category are zero-filled so every series shares one calendar.
+        """
+        df = pd.DataFrame(historical_expenses)
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df['category'] = df['category'].fillna('uncategorized').astype(str).str.lower()
+        if categories is None:
+            categories = sorted(df['category'].unique())
+        df = df[df['category'].isin(categories)]
+
+        df['date'] = df['timestamp'].dt.to_period('M').dt.to_timestamp()
+        months = pd.date_range(df['date'].min(), df['date'].max(), freq='MS')
+        wide = (df.pivot_table(index='date', columns='category', values='amount', aggfunc='sum')
+                  .reindex(index=months, columns=categories)
+                  .fillna(0.0))
+        wide.index.name = 'date'
+        wide.columns.name = 'category'
+
+        long_df = wide.stack().rename('total_expense').reset_index()
+        long_df = long_df.sort_values(['category', 'date']).reset_index(drop=True)
+        long_df['category_code'] = long_df['category'].map({c: i for i, c in enumerate(categories)})
+
+        long_df['month'] = long_df['date'].dt.month
+        long_df['quarter'] = long_df['date'].dt.quarter
+        long_df['year'] = long_df['date'].dt.year
+
+        grouped = long_df.groupby('category')['total_expense']
+        long_df['lag_1'] = grouped.shift(1)
+        long_df['lag_2'] = grouped.shift(2)
+        long_df['rolling_mean_3'] = grouped.transform(lambda s: s.rolling(window=3, min_periods=1).mean())
+
+        # Same NaN handling as the single-series frame, but per category
+        for col in ['lag_1', 'lag_2', 'rolling_mean_3']:
+            long_df[col] = long_df[col].fillna(long_df.groupby('category')[col].transform('median')).fillna(0)
+
+        return long_df
+
+    def fit_multi(self, historical_expenses: List[Dict]) -> Optional[Dict[str, Any]]:
+        """
+        Fits a single model over all categories at once (category code is a feature).
+        Accuracy is measured on the last 20% of months, overall and per category.
+        Returns None when there is not enough data.
+        """
+        if not historical_expenses or len(historical_expenses) < 5:
+            logger.warning("Insufficient historical data for multi-category model.")
+            return None
+
+        df = self._prepare_multi_category_frame(historical_expenses)
+        months = np.sort(df['date'].unique())
+        if len(months) < 3:
+            logger.warning("Insufficient monthly aggregated data for multi-category model.")
+            return None
+
+        features = ['category_code', 'month', 'quarter', 'year', 'lag_1', 'lag_2', 'rolling_mean_3']
+        target = 'total_expense'
+
+        # Time-based split shared by all categories (same as shuffle=False in the single model)
+        n_test_months = max(1, int(round(len(months) * 0.2)))
+        is_test = df['date'] >= months[-n_test_months]
+        train_df, test_df = df[~is_test], df[is_test]
+
+        model = GradientBoostingRegressor(n_estimators=100, learning_rate=0.1, max_depth=3, random_state=42)
+        model.fit(train_df[features], train_df[target])
+
+        test_df = test_df.assign(predicted=model.predict(test_df[features]))
+        category_accuracy = {}
+        for category, group in test_df.groupby('category'):
+            mean_actual = group[target].mean()
+            mae = mean_absolute_error(group[target], group['predicted'])
+            category_accuracy[category] = round(float(1.0 - mae / mean_actual) if mean_actual > 0 else 1.0, 3)
+
+        monthly_actual = test_df.groupby('date')[[target, 'predicted']].sum()
+        mae = mean_absolute_error(monthly_actual[target], monthly_actual['predicted'])
+        model_accuracy = 1.0 - (mae / monthly_actual[target].mean()) if monthly_actual[target].mean() > 0 else 1.0
+        logger.info(f"Multi-category model MAE on test months: {mae:.2f}, Accuracy: {model_accuracy:.2f}")
+
+        return {
+            "model": model,
+            "features": features,
+            "fast_predict_base": self._fast_predict_base(model, train_df[features].to_numpy(dtype=float)),
+            "categories": sorted(df['category'].unique()),
+            "monthly_frame": df,
+            "model_accuracy": float(model_accuracy),
+            "category_accuracy": category_accuracy,
+            "multi_category": True
+        }
+
+    def refresh_features_multi(self, fitted: Dict[str, Any], historical_expenses: List[Dict]) -> Dict[str, Any]:
+        """Rebuilds the long frame for the categories the model was fitted on"""
+        frame = self._prepare_multi_category_frame(historical_expenses, categories=fitted["categories"])
+        return {**fitted, "monthly_frame": frame}
+
+    def predict_multi_from_fitted(self, fitted: Dict[str, Any], timeframe: int) -> Dict[str, Any]:
+        """
+        Recursive forecast for every category; each future month is one batched predict over
+        all categories. Returns per-category forecasts, their sum as the total forecast and
+        per-category accuracy.
+        """
+        model = fitted["model"]
+        features = fitted["features"]
+        categories = fitted["categories"]
+        df = fitted["monthly_frame"]
+
+        # All categories share one zero-filled calendar, so the last two months are plain slices
+        months = np.sort(df['date'].unique())
+        latest = df[df['date'] == months[-1]].set_index('category').reindex(categories)
+        previous = df[df['date'] == months[max(len(months) - 2, 0)]].set_index('category').reindex(categories)
+
+        lag_1 = latest['total_expense'].fillna(0).to_numpy(dtype=float)
+        lag_2 = previous['total_expense'].fillna(0).to_numpy(dtype=float)
+        rolling = latest['rolling_mean_3'].fillna(0).to_numpy(dtype=float)
+        codes = latest['category_code'].fillna(-1).to_numpy(dtype=float)
+
+        last_date = df['date'].max()
+        future_dates = [last_date + pd.DateOffset(months=i) for i in range(1, timeframe + 1)]
+        n_categories = len(categories)
+
+        # One preallocated block of rows per future month; only the lag columns change per step
+        X = self._calendar_buffer(features, future_dates, rows_per_date=n_categories)
+        column = {name: i for i, name in enumerate(features)}
+        X[:, column['category_code']] = np.tile(codes, timeframe)
+        predictions = np.empty((timeframe, n_categories))
+        for i in range(timeframe):
+            block = X[i * n_categories:(i + 1) * n_categories]
+            block[:, column['lag_1']] = lag_1
+            block[:, column['lag_2']] = lag_2
+            block[:, column['rolling_mean_3']] = rolling
+            predicted = np.maximum(self._fast_predict(fitted, block), 0)
+            predictions[i] = predicted
+
+            lag_2, lag_1 = lag_1, predicted
+            rolling = (rolling * 2 + predicted) / 3
+
+        dates = [d.strftime("%Y-%m-%d") for d in future_dates]
+        periods = [d.strftime("%Y-%m") for d in future_dates]
+        category_forecasts = {
+            category: [
+                {"date": date, "period": period, "predicted_amount": round(float(amount), 2), "category": category}
+                for date, period, amount in zip(dates, periods, predictions[:, j])
+            ]
+            for j, category in enumerate(categories)
+        }
+        total_forecast = [
+            {"date": date, "period": period, "predicted_amount": round(float(amount), 2), "category": "all"}
+            for date, period, amount in zip(dates, periods, predictions.sum(axis=1))
+        ]
+
+        return {
+            "forecast": total_forecast,
+            "category_forecasts": category_forecasts,
+            "model_accuracy": round(fitted["model_accuracy"], 3),
+            "category_accuracy": fitted["category_accuracy"]
+        }
+
+    def train_and_predict_multi(self, historical_expenses: List[Dict], timeframe: int) -> Dict[str, Any]:
+        """
+        Forecasts all categories and their total with one model fit.
+        Returns: {"forecast": [...], "category_forecasts": {...}, "model_accuracy": float, "category_accuracy": {...}}
+        """
+        fitted = self.fit_multi(historical_expenses)
+        if fitted is None:
+            fallback = self._basic_fallback_forecast(historical_expenses, timeframe)
+            return {**fallback, "category_forecasts": {}, "category_accuracy": {}}
+        return self.predict_multi_from_fitted(fitted, timeframe)
 
-        return {"forecast": forecast_data, "model_accuracy": round(model_accuracy, 3)}
-    
     def _basic_fallback_forecast(self, historical_expenses: List[Dict], timeframe: int) -> Dict[str, Any]:
         """
         Provides a basic forecast using average historical expenses as a fallback.
@@ -164,22 +538,25 @@ class CustomExpenseForecaster:
             df_hist_recent = df_hist[df_hist['timestamp'] >= one_year_ago]
             
             if not df_hist_recent.empty:
-                monthly_agg = df_hist_recent.resample('M', on='timestamp')['amount'].sum()
+                monthly_agg = df_hist_recent.resample('MS', on='timestamp')['amount'].sum()
                 base_amount = monthly_agg.mean() if not monthly_agg.empty else 1500
             else:
                 base_amount = 1500
         else:
             base_amount = 1500 # Default if no history
 
+        # Seeded from the inputs so the same history always gets the same forecast
+        rng = np.random.default_rng(stable_seed(round(float(base_amount), 2), timeframe))
+        variations = rng.uniform(0.9, 1.1, size=timeframe)
+        future_dates = future_month_starts(timeframe)
         forecast_data = []
-        for i in range(timeframe):
-            future_date = datetime.now() + timedelta(days=30 * (i + 1))
-            # Apply a small random variation for realism, but keep it basic
-            predicted_amount = base_amount * np.random.uniform(0.9, 1.1)
+        for future_date, variation in zip(future_dates, variations):
+            # Apply a small variation for realism, but keep it basic
+            predicted_amount = base_amount * variation
             forecast_data.append({
                 "date": future_date.strftime("%Y-%m-%d"),
                 "period": future_date.strftime("%Y-%m"),
-                "predicted_amount": round(predicted_amount, 2),
+                "predicted_amount": round(float(predicted_amount), 2),
                 "category": "all"
             })
         
@@ -5,6 +5,7 @@ from typing import List, Dict, Optional
 from google.cloud.firestore import FieldFilter
 from dotenv import load_dotenv
 import calendar
+from categorization_service import canonicalize_category
 
 # Load environment variables
 load_dotenv()
@@ -192,7 +193,7 @@ class FirestoreService:
                 category_breakdown = {}
                 
                 for exp in expenses:
-                    category = exp.get('category', 'uncategorized')
+                    category = canonicalize_category(exp.get('category'))
                     category_breakdown[category] = category_breakdown.get(category, 0) + exp['amount']
                 
                 summary = {
@@ -0,0 +1,491 @@
+"""
+Rolling-origin backtest of the expense forecasters.
+
+Every history (seeded synthetic profiles and anonymized fixture files) is
+cut at successive month boundaries. Each engine is fitted on the transactions before
+the cut and scored on the monthly totals that follow, which gives MAE/MAPE per
+horizon plus fit and predict timings.
+
+Usage:
+    python forecast_backtest.py --horizon 3 --min-train 6
+    python forecast_backtest.py --fixtures fixtures/forecast_histories.json my_export.json --output report.json
+
+Fixture files hold a JSON list of {"date", "amount", "category"} transactions (or an
+object mapping history names to such lists); every other field is ignored. The
+histories in fixtures/forecast_histories.json are included by default.
+"""
+
+import argparse
+import json
+from abc import ABC, abstractmethod
+import logging
+import os
+import sys
+import time
+import warnings
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from daily_forecaster import DailyExpenseForecaster
+from expense_forecast import Prophet, forecast_expense_trend, warm_up_pool
+from expense_predictor_model import CustomExpenseForecaster
+from global_forecaster import GlobalExpenseForecaster
+from statistical_forecaster import DampedTrendForecaster
+
+
+# ---------------------------------------------------------------------------
+# Histories
+# ---------------------------------------------------------------------------
+
+SYNTHETIC_PROFILES = ("stable", "trending", "seasonal", "volatile", "sparse")
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "forecast_histories.json")
+
+
+def synthetic_history(profile: str, months: int = 30, seed: int = 0,
+                      start: str = "2023-01-01") -> List[Dict]:
+    """Seeded transaction-level history whose monthly totals follow the given profile"""
+    rng = np.random.default_rng(seed)
+    month_starts = pd.date_range(start, periods=months, freq='MS')
+    t = np.arange(months)
+
+    level = {
+        "stable": np.full(months, 30000.0),
+        "trending": 20000.0 + 600.0 * t,
+        "seasonal": 30000.0 * (1 + 0.25 * np.sin(2 * np.pi * t / 12)),
+        "volatile": 30000.0 * rng.lognormal(0.0, 0.35, months),
+        "sparse": np.full(months, 8000.0),
+    }[profile]
+    tx_per_month = 6 if profile == "sparse" else 40
+    categories = np.array(["food", "transport", "bills", "shopping", "entertainment"])
+
+    transactions = []
+    for month_start, target in zip(month_starts, level):
+        count = max(1, rng.poisson(tx_per_month))
+        weights = rng.dirichlet(np.ones(count))
+        days = rng.integers(0, month_start.days_in_month, count)
+        for day, weight in zip(days, weights):
+            timestamp = month_start + pd.Timedelta(days=int(day))
+            transactions.append({
+                "date": timestamp.strftime("%Y-%m-%d"),
+                "amount": round(float(target * weight), 2),
+                "category": str(rng.choice(categories)),
+            })
+    return transactions
+
+
+def load_fixture_histories(paths: List[str]) -> Dict[str, List[Dict]]:
+    """Load fixture files, keeping only date/amount/category of each transaction"""
+    histories = {}
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        named = data if isinstance(data, dict) else {os.path.splitext(os.path.basename(path))[0]: data}
+        for name, rows in named.items():
+            histories[name] = [
+                {"date": str(row["date"])[:10], "amount": float(row["amount"]),
+                 "category": row.get("category", "uncategorized")}
+                for row in rows if row.get("date") and row.get("amount") is not None
+            ]
+    return histories
+
+
+def monthly_totals(transactions: List[Dict]) -> pd.Series:
+    """Zero-filled monthly totals indexed by month start"""
+    df = pd.DataFrame(transactions)
+    months = pd.to_datetime(df['date']).dt.to_period('M').dt.to_timestamp()
+    totals = df['amount'].groupby(months).sum()
+    return totals.reindex(pd.date_range(totals.index.min(), totals.index.max(), freq='MS'), fill_value=0.0)
+
+
+# ---------------------------------------------------------------------------
+# Engines: fit(transactions) then predict(horizon) -> monthly totals
+# ---------------------------------------------------------------------------
+
+class BacktestEngine(ABC):
+    """
+    Base engine; max_horizon limits engines that only produce one-step forecasts.
+    Engines that produce prediction intervals set interval_bounds = (lower, upper) in predict().
+    """
+    name = "engine"
+    max_horizon: Optional[int] = None
+    interval_bounds: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @abstractmethod
+    def fit(self, transactions: List[Dict]):
+        ...
+
+    @abstractmethod
+    def predict(self, horizon: int) -> np.ndarray:
+        ...
+
+
+class NaiveEngine(BacktestEngine):
+    name = "naive"
+
+    def fit(self, transactions):
+        self.history = monthly_totals(transactions).to_numpy()
+
+    def predict(self, horizon):
+        return np.full(horizon, self.history[-1])
+
+
+class SeasonalNaiveEngine(BacktestEngine):
+    """Same month last year; falls back to the naive forecast on histories shorter than a year"""
+    name = "seasonal_naive"
+
+    def fit(self, transactions):
+        self.history = monthly_totals(transactions).to_numpy()
+
+    def predict(self, horizon):
+        n = len(self.history)
+        if n < 12:
+            return np.full(horizon, self.history[-1])
+        return np.array([self.history[n - 12 + (h % 12)] for h in range(horizon)])
+
+
+class CustomModelEngine(BacktestEngine):
+    """CustomExpenseForecaster exactly as /forecast-expenses uses it"""
+
+    def __init__(self, strategy: str = "recursive", max_horizon: int = 24,
+                 interval_quantiles: Optional[List[float]] = None):
+        self.strategy = strategy
+        self.name = f"custom_{strategy}"
+        self.forecaster = CustomExpenseForecaster()
+        # Direct mode trains one model per horizon; only train the horizons being scored
+        self.fit_horizon = max_horizon
+        self.interval_quantiles = interval_quantiles
+
+    def fit(self, transactions):
+        self.transactions = [{**tx, "timestamp": datetime.strptime(tx["date"], "%Y-%m-%d")} for tx in transactions]
+        self.fitted = self.forecaster.fit(self.transactions, strategy=self.strategy, max_horizon=self.fit_horizon)
+
+    def predict(self, horizon):
+        if self.fitted is None:
+            result = self.forecaster._basic_fallback_forecast(self.transactions, horizon)
+        else:
+            result = self.forecaster.predict_from_fitted(self.fitted, horizon, strategy=self.strategy,
+                                                         quantiles=self.interval_quantiles)
+        forecast = result["forecast"]
+        if self.interval_quantiles and forecast and "lower_bound" in forecast[0]:
+            self.interval_bounds = (np.array([item["lower_bound"] for item in forecast]),
+                                    np.array([item["upper_bound"] for item in forecast]))
+        else:
+            self.interval_bounds = None
+        return np.array([item["predicted_amount"] for item in forecast])
+
+
+class DailyModelEngine(BacktestEngine):
+    """daily_forecaster.DailyExpenseForecaster; histories are cut at month ends, so fit up to the last one"""
+    name = "custom_daily"
+
+    def __init__(self):
+        self.forecaster = DailyExpenseForecaster()
+
+    def fit(self, transactions):
+        self.transactions = [{**tx, "timestamp": datetime.strptime(tx["date"], "%Y-%m-%d")} for tx in transactions]
+        month_end = max(tx["timestamp"] for tx in self.transactions) + pd.offsets.MonthEnd(0)
+        self.fitted = self.forecaster.fit(self.transactions, as_of=month_end)
+
+    def predict(self, horizon):
+        if self.fitted is None:
+            result = CustomExpenseForecaster()._basic_fallback_forecast(self.transactions, horizon)
+        else:
+            result = self.forecaster.predict_from_fitted(self.fitted, horizon)
+        return np.array([item["predicted_amount"] for item in result["forecast"]])
+
+
+class GlobalModelEngine(BacktestEngine):
+    """
+    A trained global_forecaster artifact with per-user calibration. Only meaningful on
+    histories that were not part of its training data.
+    """
+    name = "global"
+
+    def __init__(self, forecaster: GlobalExpenseForecaster):
+        self.forecaster = forecaster
+
+    def fit(self, transactions):
+        self.history = monthly_totals(transactions)
+
+    def predict(self, horizon):
+        result = self.forecaster.predict_series(self.history, horizon)
+        if result is None:
+            return np.full(horizon, self.history.iloc[-1])
+        return np.array([item["predicted_amount"] for item in result["forecast"]])
+
+
+class HoltWintersEngine(BacktestEngine):
+    """statistical_forecaster.DampedTrendForecaster on the monthly total"""
+    name = "holt_winters"
+
+    def fit(self, transactions):
+        self.model = DampedTrendForecaster().fit(monthly_totals(transactions).to_numpy())
+
+    def predict(self, horizon):
+        return np.maximum(self.model.forecast(horizon), 0)
+
+
+class ExpenseTrendEngine(BacktestEngine):
+    """
+    expense_forecast.forecast_expense_trend (ARIMA or Prophet) on the monthly total.
+    That function returns next month only, so this engine is scored at horizon 1.
+    """
+    max_horizon = 1
+
+    def __init__(self, method: str):
+        self.method = method
+        self.name = method
+
+    def fit(self, transactions):
+        # Fitting happens inside forecast_expense_trend; time it as part of fit
+        rows = [{"date": tx["date"], "amount": tx["amount"], "category": "all"} for tx in transactions]
+        self.prediction = forecast_expense_trend(rows, method=self.method).get("all")
+
+    def predict(self, horizon):
+        value = self.prediction if self.prediction is not None else np.nan
+        return np.full(horizon, float(value))
+
+
+def default_engines(horizon: int = 3, interval_quantiles: Optional[List[float]] = None) -> List[BacktestEngine]:
+    engines = [NaiveEngine(), SeasonalNaiveEngine(),
+               CustomModelEngine("recursive", horizon, interval_quantiles),
+               CustomModelEngine("direct", horizon, interval_quantiles),
+               DailyModelEngine(), HoltWintersEngine(), ExpenseTrendEngine("arima")]
+    if Prophet is not None:
+        engines.append(ExpenseTrendEngine("prophet"))
+    return engines
+
+
+# ---------------------------------------------------------------------------
+# Rolling-origin evaluation
+# ---------------------------------------------------------------------------
+
+def rolling_origin_backtest(transactions: List[Dict], engines: List[BacktestEngine],
+                            horizon: int = 3, min_train_months: int = 6,
+                            max_origins: Optional[int] = None) -> List[Dict]:
+    """
+    Return one record per (engine, origin, horizon step) with the forecast, the actual
+    monthly total and the engine's fit/predict time for that origin.
+    """
+    totals = monthly_totals(transactions)
+    months = totals.index
+    dates = pd.to_datetime(pd.Series([tx["date"] for tx in transactions]))
+
+    origins = list(range(min_train_months, len(months)))
+    if max_origins:
+        origins = origins[-max_origins:]
+
+    records = []
+    for origin in origins:
+        train = [tx for tx, keep in zip(transactions, (dates < months[origin]).to_numpy()) if keep]
+        actual = totals.iloc[origin:origin + horizon].to_numpy()
+        for engine in engines:
+            steps = min(len(actual), engine.max_horizon or horizon)
+
+            started = time.perf_counter()
+            engine.fit(train)
+            fit_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            forecast = engine.predict(steps)
+            predict_seconds = time.perf_counter() - started
+
+            for step in range(steps):
+                record = {
+                    "engine": engine.name,
+                    "origin": months[origin].strftime("%Y-%m"),
+                    "horizon": step + 1,
+                    "forecast": float(forecast[step]),
+                    "actual": float(actual[step]),
+                    "fit_ms": fit_seconds * 1000,
+                    "predict_ms": predict_seconds * 1000,
+                }
+                if engine.interval_bounds is not None:
+                    record["lower"] = float(engine.interval_bounds[0][step])
+                    record["upper"] = float(engine.interval_bounds[1][step])
+                records.append(record)
+    return records
+
+
+def summarize(records: List[Dict]) -> pd.DataFrame:
+    """
+    MAE, MAPE (over months with spend) and mean timings per engine and horizon, plus the
+    share of actuals inside the prediction interval for engines that produce one.
+    """
+    df = pd.DataFrame(records)
+    df["abs_error"] = (df["forecast"] - df["actual"]).abs()
+    df["ape"] = np.where(df["actual"] > 0, df["abs_error"] / df["actual"].where(df["actual"] > 0), np.nan)
+
+    # Timings are per origin, not per horizon step
+    timings = df.drop_duplicates(["history", "engine", "origin"]).groupby("engine")[["fit_ms", "predict_ms"]].mean()
+    grouped = df.groupby(["engine", "horizon"])
+    summary = pd.DataFrame({
+        "forecasts": grouped.size(),
+        "failed": grouped["forecast"].apply(lambda s: int(s.isna().sum())),
+        "mae": grouped["abs_error"].mean(),
+        "mape_pct": grouped["ape"].mean() * 100,
+    })
+    if "lower" in df:
+        df["covered"] = ((df["actual"] >= df["lower"]) & (df["actual"] <= df["upper"])).where(df["lower"].notna())
+        summary["coverage_pct"] = df.groupby(["engine", "horizon"])["covered"].mean() * 100
+    summary = summary.reset_index()
+    return summary.join(timings, on="engine").sort_values(["horizon", "mae"]).reset_index(drop=True)
+
+
+def run_backtest(histories: Dict[str, List[Dict]], engines: List[BacktestEngine], horizon: int,
+                 min_train_months: int, max_origins: Optional[int] = None,
+                 progress: Callable[[str], None] = print) -> List[Dict]:
+    records = []
+    for name, transactions in histories.items():
+        started = time.time()
+        history_records = rolling_origin_backtest(transactions, engines, horizon, min_train_months, max_origins)
+        records.extend({**record, "history": name} for record in history_records)
+        progress(f"  {name}: {len(history_records)} forecasts in {time.time() - started:.1f}s")
+    return records
+
+
+def format_report(summary: pd.DataFrame) -> str:
+    has_coverage = "coverage_pct" in summary
+    header = f"{'horizon':>7}  {'engine':<18}{'n':>5}{'failed':>8}{'MAE':>12}{'MAPE %':>9}{'fit ms':>10}{'pred ms':>10}"
+    lines = [header + (f"{'cover %':>9}" if has_coverage else "")]
+    for row in summary.itertuples(index=False):
+        line = (
+            f"{row.horizon:>7}  {row.engine:<18}{row.forecasts:>5}{row.failed:>8}{row.mae:>12.2f}"
+            f"{row.mape_pct:>9.1f}{row.fit_ms:>10.2f}{row.predict_ms:>10.3f}"
+        )
+        if has_coverage:
+            line += f"{row.coverage_pct:>9.1f}" if not pd.isna(row.coverage_pct) else f"{'-':>9}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def benchmark_intervals(horizons: List[int] = (3, 12, 24), n_paths_options: List[int] = (200, 500, 1000),
+                        quantiles: List[float] = (0.1, 0.5, 0.9), repeats: int = 20) -> str:
+    """Time point forecasts against bootstrap quantile forecasts of the custom model"""
+    transactions = synthetic_history("seasonal", 36, seed=0)
+    for tx in transactions:
+        tx["timestamp"] = datetime.strptime(tx["date"], "%Y-%m-%d")
+    forecaster = CustomExpenseForecaster()
+
+    def timed(fn) -> float:
+        fn()
+        started = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+        return (time.perf_counter() - started) / repeats * 1000
+
+    lines = [f"{'strategy':<10}{'horizon':>8}{'paths':>7}{'point ms':>10}{'quantile ms':>13}{'ratio':>7}"]
+    for strategy in ("recursive", "direct"):
+        fitted = forecaster.fit(transactions, strategy=strategy, max_horizon=max(horizons))
+        for horizon in horizons:
+            point_ms = timed(lambda: forecaster.predict_from_fitted(fitted, horizon, strategy=strategy))
+            for n_paths in n_paths_options:
+                quantile_ms = timed(lambda: forecaster.predict_from_fitted(
+                    fitted, horizon, strategy=strategy, quantiles=list(quantiles), n_paths=n_paths))
+                lines.append(f"{strategy:<10}{horizon:>8}{n_paths:>7}{point_ms:>10.2f}{quantile_ms:>13.2f}"
+                             f"{quantile_ms / point_ms:>7.1f}")
+    return "\n".join(lines)
+
+
+def benchmark_daily_fit(months_options: List[int] = (1, 3, 12, 24, 36), horizon: int = 3,
+                        repeats: int = 3) -> str:
+    """Fit/predict time of the daily model against history length (transactions on ~every day)"""
+    forecaster = DailyExpenseForecaster()
+    lines = [f"{'months':>7}{'days':>7}{'transactions':>14}{'fit ms':>10}{'predict ms':>12}"]
+    for months in months_options:
+        transactions = synthetic_history("seasonal", months, seed=0)
+        for tx in transactions:
+            tx["timestamp"] = datetime.strptime(tx["date"], "%Y-%m-%d")
+        fit_times, predict_times = [], []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            fitted = forecaster.fit(transactions)
+            fit_times.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            forecaster.predict_from_fitted(fitted, horizon)
+            predict_times.append(time.perf_counter() - started)
+        lines.append(f"{months:>7}{len(fitted['daily_series']):>7}{len(transactions):>14}"
+                     f"{min(fit_times) * 1000:>10.1f}{min(predict_times) * 1000:>12.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the expense forecasters")
+    parser.add_argument('--horizon', type=int, default=3, help="Months forecast from each origin")
+    parser.add_argument('--min-train', type=int, default=6, help="Months of history before the first origin")
+    parser.add_argument('--max-origins', type=int, help="Only evaluate the most recent N origins per history")
+    parser.add_argument('--months', type=int, default=30, help="Length of each synthetic history")
+    parser.add_argument('--seeds', type=int, default=2, help="Synthetic histories generated per profile")
+    parser.add_argument('--profiles', nargs='*', default=list(SYNTHETIC_PROFILES), choices=SYNTHETIC_PROFILES,
+                        help="Synthetic profiles to include (pass none to skip synthetic data)")
+    parser.add_argument('--fixtures', nargs='*', default=[DEFAULT_FIXTURES],
+                        help="JSON fixture files with anonymized histories (pass none to skip fixtures)")
+    parser.add_argument('--engines', nargs='*', help="Restrict to these engine names")
+    parser.add_argument('--intervals', action='store_true',
+                        help="Also score the custom model's p10-p90 intervals (coverage column)")
+    parser.add_argument('--interval-benchmark', action='store_true',
+                        help="Only time point vs. quantile forecasts of the custom model")
+    parser.add_argument('--daily-benchmark', action='store_true',
+                        help="Only time the daily model's fit and predict against history length")
+    parser.add_argument('--global-model', help="Also score this global_forecaster artifact")
+    parser.add_argument('--output', help="Write the summary and raw records as JSON to this path")
+    args = parser.parse_args()
+
+    # The forecasters log every fit and ARIMA warns on short series; keep the report readable
+    warnings.simplefilter("ignore")
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("expense_predictor_model").setLevel(logging.ERROR)
+    logging.getLogger("daily_forecaster").setLevel(logging.ERROR)
+    logging.getLogger("cmdstanpy").setLevel(logging.ERROR)
+
+    if args.interval_benchmark:
+        print(benchmark_intervals())
+        return
+    if args.daily_benchmark:
+        print(benchmark_daily_fit())
+        return
+
+    histories = {
+        f"{profile}_{seed}": synthetic_history(profile, args.months, seed=seed)
+        for profile in args.profiles for seed in range(args.seeds)
+    }
+    histories.update(load_fixture_histories(args.fixtures))
+    if not histories:
+        print("❌ No histories to evaluate")
+        sys.exit(1)
+
+    engines = default_engines(args.horizon, [0.1, 0.9] if args.intervals else None)
+    if args.global_model:
+        global_forecaster = GlobalExpenseForecaster.load(args.global_model)
+        if global_forecaster is None:
+            print(f"❌ No usable global model at {args.global_model}")
+            sys.exit(1)
+        engines.append(GlobalModelEngine(global_forecaster))
+    if args.engines:
+        engines = [engine for engine in engines if engine.name in args.engines]
+
+    if any(isinstance(engine, ExpenseTrendEngine) for engine in engines):
+        # Keep the pool's spawn start-up out of the first ARIMA/Prophet fit timings
+        warm_up_pool()
+
+    print(f"📊 Backtesting {', '.join(e.name for e in engines)} on {len(histories)} histories "
+          f"(horizon {args.horizon}, min train {args.min_train} months)")
+    records = run_backtest(histories, engines, args.horizon, args.min_train, args.max_origins)
+    summary = summarize(records)
+    print()
+    print(format_report(summary))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary.to_dict(orient="records"), "records": records}, f, indent=2)
+        print(f"\n✅ Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
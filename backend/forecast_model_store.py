@@ -0,0 +1,261 @@
+"""
+Persistent store for fitted per-user expense forecasters, and a cache of the
+forecast responses computed from them.
+
+Fitted models are keyed by (user_id, category, data version) and kept in a bounded
+in-memory LRU, with the latest model of every (user, category) also saved to disk
+with joblib. Forecast requests reuse a stored model and only re-predict; a new model
+is trained only once, since the stored model was fitted, at least `retrain_threshold`
+transactions were added, removed or edited, or the total amount moved by at least
+`retrain_amount_ratio`. Smaller changes only refresh the model's features.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+
+def _row_keys(historical_expenses: List[Dict]) -> List[str]:
+    return sorted(
+        f"{expense.get('timestamp') or expense.get('date')}|{float(expense.get('amount', 0) or 0):.2f}|"
+        f"{expense.get('category', '')}"
+        for expense in historical_expenses
+    )
+
+
+def compute_data_version(historical_expenses: List[Dict]) -> str:
+    """Order-independent fingerprint of the (date, amount, category) rows a model is fitted on"""
+    return hashlib.sha1("\n".join(_row_keys(historical_expenses)).encode("utf-8")).hexdigest()[:16]
+
+
+def row_digests(historical_expenses: List[Dict]) -> List[str]:
+    """Short per-row hashes, so a later data set can be diffed against the one a model was fitted on"""
+    return [hashlib.sha1(row.encode("utf-8")).hexdigest()[:12] for row in _row_keys(historical_expenses)]
+
+
+def _total_amount(historical_expenses: List[Dict]) -> float:
+    return float(sum(float(expense.get('amount', 0) or 0) for expense in historical_expenses))
+
+
+class ForecastModelStore:
+    """Bounded LRU + joblib disk store of fitted CustomExpenseForecaster bundles"""
+
+    def __init__(self, store_dir: str = None, max_entries: int = 256, retrain_threshold: int = 10,
+                 retrain_amount_ratio: float = 0.1):
+        self.store_dir = store_dir or os.getenv("FORECAST_MODEL_DIR", "model_store")
+        self.max_entries = max_entries
+        self.retrain_threshold = retrain_threshold
+        self.retrain_amount_ratio = retrain_amount_ratio
+        self._cache: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "reused_stale": 0, "trained": 0}
+
+    def _path(self, user_id: str, category: str) -> str:
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{user_id}__{category}")
+        return os.path.join(self.store_dir, f"{safe_name}.joblib")
+
+    def _remember(self, key: Tuple[str, str, str], entry: Dict[str, Any]):
+        with self._lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _latest_in_memory(self, user_id: str, category: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for (cached_user, cached_category, _), entry in reversed(self._cache.items()):
+                if cached_user == user_id and cached_category == category:
+                    return entry
+        return None
+
+    def _lookup(self, user_id: str, category: str, data_version: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        key = (user_id, category, data_version)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry, "memory"
+
+        entry = self._load(user_id, category)
+        if entry and entry["data_version"] == data_version:
+            self.stats["disk_hits"] += 1
+            self._remember(key, entry)
+            return entry, "disk"
+        return None, ""
+
+    def get(self, user_id: str, category: str, data_version: str) -> Optional[Dict[str, Any]]:
+        """Return the stored entry for an exact data version, if any"""
+        return self._lookup(user_id, category, data_version)[0]
+
+    def put(self, user_id: str, category: str, data_version: str, fitted: Dict[str, Any],
+            historical_expenses: List[Dict]) -> Dict[str, Any]:
+        entry = {
+            "data_version": data_version,
+            "n_transactions": len(historical_expenses),
+            # What the model was trained on, to measure how far later data has moved
+            "row_digests": row_digests(historical_expenses),
+            "total_amount": _total_amount(historical_expenses),
+            "trained_at": datetime.now().isoformat(),
+            "fitted": fitted
+        }
+        self._remember((user_id, category, data_version), entry)
+        self._save(user_id, category, entry)
+        return entry
+
+    def get_or_fit(self, user_id: str, category: str, historical_expenses: List[Dict],
+                   forecaster, multi_category: bool = False, strategy: str = "recursive",
+                   resolution: str = "monthly") -> Tuple[Optional[Dict[str, Any]], str]:
+        """
+        Return (fitted bundle, source) for a user's data, training only when needed.
+        source is one of 'memory', 'disk', 'refreshed' or 'trained'; the bundle is None
+        when the forecaster has too little data to fit. multi_category selects the
+        forecaster's all-categories model (fit_multi) instead of the single-series one;
+        strategy="direct" stores a bundle that also holds the per-horizon models;
+        resolution="daily" expects a daily_forecaster.DailyExpenseForecaster.
+        """
+        if resolution == "daily":
+            category = f"{category}__daily"
+            fit, refresh = forecaster.fit, forecaster.refresh_features
+        elif multi_category:
+            category = f"{category}__by_category"
+            fit, refresh = forecaster.fit_multi, forecaster.refresh_features_multi
+        elif strategy == "direct":
+            category = f"{category}__direct"
+            fit = lambda expenses: forecaster.fit(expenses, strategy="direct")
+            refresh = forecaster.refresh_features
+        else:
+            fit, refresh = forecaster.fit, forecaster.refresh_features
+
+        data_version = compute_data_version(historical_expenses)
+        entry, source = self._lookup(user_id, category, data_version)
+        if entry:
+            return entry["fitted"], source
+
+        # Data changed: keep the previous model while the change stays under the thresholds,
+        # but rebuild its feature frame so forecasts start from the latest months
+        previous = self._latest_in_memory(user_id, category) or self._load(user_id, category)
+        if previous and not self._needs_retrain(previous, historical_expenses):
+            self.stats["reused_stale"] += 1
+            fitted = refresh(previous["fitted"], historical_expenses)
+            # The training baseline is kept, so changes accumulate until they force a refit
+            entry = {**previous, "data_version": data_version, "fitted": fitted,
+                     "refreshed_at": datetime.now().isoformat()}
+            self._remember((user_id, category, data_version), entry)
+            self._save(user_id, category, entry)
+            return fitted, "refreshed"
+
+        fitted = fit(historical_expenses)
+        if fitted is None:
+            return None, "trained"
+        self.stats["trained"] += 1
+        self.put(user_id, category, data_version, fitted, historical_expenses)
+        return fitted, "trained"
+
+    def _needs_retrain(self, previous: Dict[str, Any], historical_expenses: List[Dict]) -> bool:
+        """
+        True once the rows differ from the training data by retrain_threshold transactions
+        (an edit, or a delete plus an add, counts once) or the total amount by
+        retrain_amount_ratio. Entries saved without a baseline always retrain.
+        """
+        if "row_digests" not in previous:
+            return True
+        trained_rows, current_rows = Counter(previous["row_digests"]), Counter(row_digests(historical_expenses))
+        changed = max(sum((current_rows - trained_rows).values()), sum((trained_rows - current_rows).values()))
+        if changed >= self.retrain_threshold:
+            return True
+        trained_total = previous["total_amount"]
+        drift = abs(_total_amount(historical_expenses) - trained_total) / max(abs(trained_total), 1.0)
+        return drift >= self.retrain_amount_ratio
+
+    def _load(self, user_id: str, category: str) -> Optional[Dict[str, Any]]:
+        path = self._path(user_id, category)
+        if not os.path.exists(path):
+            return None
+        try:
+            return joblib.load(path)
+        except Exception as e:
+            logger.warning(f"Could not load stored forecaster {path}: {e}")
+            return None
+
+    def _save(self, user_id: str, category: str, entry: Dict[str, Any]):
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            path = self._path(user_id, category)
+            # Write then rename so concurrent readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            joblib.dump(entry, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not persist forecaster for {user_id}/{category}: {e}")
+
+
+class ForecastResponseCache:
+    """
+    Bounded TTL + LRU cache of forecast response bodies.
+
+    The ETag is a hash of the stored body, and a client's If-None-Match is only
+    answered with 304 while that body is still cached: the same key can produce a
+    different forecast later (a retrained or reloaded model, a new month), so a
+    tag is never trusted once its entry is gone.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 6 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (stored at, body, etag)
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    @staticmethod
+    def etag(body: Dict[str, Any]) -> str:
+        payload = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+        return '"' + hashlib.sha1(payload.encode("utf-8")).hexdigest()[:20] + '"'
+
+    def matches(self, etag: str, if_none_match: Optional[str]) -> bool:
+        """True when an If-None-Match header names etag (or is '*')"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or etag in tags:
+            self.stats["not_modified"] += 1
+            return True
+        return False
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """(body, etag) of a live entry, else None"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self._cache.pop(key, None)
+                self.stats["misses"] += 1
+                return None
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1], entry[2]
+
+    def put(self, key: str, body: Dict[str, Any]) -> str:
+        """Store body and return its ETag"""
+        etag = self.etag(body)
+        with self._lock:
+            self._cache[key] = (time.monotonic(), body, etag)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return etag
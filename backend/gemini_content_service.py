@@ -1,15 +1,22 @@
 import os
 import json
-from typing import Dict, List, Optional, Any
+from typing import AsyncIterator, Dict, List, Optional, Any
 from datetime import datetime
 import google.generativeai as genai
+from fastapi import Request
 from pydantic import BaseModel
 import logging
+from llm_cache import llm_response_cache
+from llm_client import llm_client
+from llm_stream import Envelope, stream_json_events, stream_result
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Part of the response cache key: bump whenever the content prompt changes
+PROMPT_VERSION = 1
+
 class UserProfile(BaseModel):
     """User profile for personalized content generation"""
     age: Optional[int] = None
@@ -35,12 +42,13 @@ class GeminiContentService:
     
     def __init__(self):
         self.api_key = os.getenv('GEMINI_API_KEY')
+        self.model_name = 'gemini-1.5-flash'
         if not self.api_key:
             logger.warning("GEMINI_API_KEY not found in environment variables")
             self.enabled = False
         else:
             genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.model = genai.GenerativeModel(self.model_name)
             self.enabled = True
             logger.info("Gemini Content Service initialized successfully")
     
@@ -115,88 +123,123 @@ class GeminiContentService:
         }
         return guidelines.get(level, guidelines["beginner"])
     
-    async def generate_personalized_content(self, request: ContentRequest) -> Dict[str, Any]:
-        """Generate personalized investment content for a specific topic"""
+    async def generate_personalized_content(self, request: ContentRequest,
+                                            http_request: Optional[Request] = None) -> Dict[str, Any]:
+        """Generate personalized investment content for a specific topic (cached per topic, level and profile)"""
         
         if not self.enabled:
             return self._get_fallback_content(request.level, request.topic)
         
-        try:
-            # Build the comprehensive prompt
-            user_context = self._build_context_prompt(request.user_profile)
-            level_guidelines = self._get_level_specific_guidelines(request.level)
-            
-            prompt = f"""
-            You are an expert financial advisor specializing in Indian investment markets. Generate comprehensive, personalized investment educational content.
+        return await llm_response_cache.get_or_generate(
+            self._cache_key(request),
+            lambda: self._generate_personalized_content(request, http_request),
+            cacheable=lambda content: content.get("source") == "ai_generated"
+        )
+    
+    def stream_personalized_content(self, request: ContentRequest, envelope: Envelope = None) -> AsyncIterator[str]:
+        """
+        Server-Sent Events for generate_personalized_content: text deltas, completed sections,
+        then the content (as envelope(content) when given)
+        """
+        if not self.enabled:
+            return stream_result(self._get_fallback_content(request.level, request.topic), envelope)
+        return stream_json_events(
+            self.model,
+            self._build_prompt(request),
+            finalize=lambda response_text: self._parse_content(response_text, request),
+            fallback=lambda: self._get_fallback_content(request.level, request.topic),
+            cache_key=self._cache_key(request),
+            cacheable=lambda content: content.get("source") == "ai_generated",
+            envelope=envelope
+        )
+    
+    def _cache_key(self, request: ContentRequest) -> str:
+        return llm_response_cache.make_key(
+            self.model_name, "personalized_content", PROMPT_VERSION,
+            level=request.level, topic=request.topic, content_type=request.content_type,
+            user_profile=request.user_profile.dict()
+        )
+    
+    def _build_prompt(self, request: ContentRequest) -> str:
+        """Build the comprehensive content prompt"""
+        user_context = self._build_context_prompt(request.user_profile)
+        level_guidelines = self._get_level_specific_guidelines(request.level)
+        
+        return f"""
+        You are an expert financial advisor specializing in Indian investment markets. Generate comprehensive, personalized investment educational content.
 
-            {user_context}
+        {user_context}
 
-            Topic: {request.topic}
-            Level: {request.level.title()}
-            Content Type: {request.content_type}
+        Topic: {request.topic}
+        Level: {request.level.title()}
+        Content Type: {request.content_type}
 
-            Content Guidelines:
-            {level_guidelines}
+        Content Guidelines:
+        {level_guidelines}
 
-            Instructions:
-            1. Create content specifically tailored to this user's profile
-            2. Use Indian context (INR, Indian financial products, regulations)
-            3. Make it actionable and practical
-            4. Include specific examples and numbers where relevant
-            5. Mention risks and disclaimers appropriately
-            6. Structure the content with clear headings and bullet points
-            7. Include "Next Steps" section with specific actions the user can take
+        Instructions:
+        1. Create content specifically tailored to this user's profile
+        2. Use Indian context (INR, Indian financial products, regulations)
+        3. Make it actionable and practical
+        4. Include specific examples and numbers where relevant
+        5. Mention risks and disclaimers appropriately
+        6. Structure the content with clear headings and bullet points
+        7. Include "Next Steps" section with specific actions the user can take
 
-            Please generate content in the following JSON format:
-            {{
-                "title": "Engaging title for the topic",
-                "introduction": "Brief introduction paragraph",
-                "main_content": "Detailed educational content with sections",
-                "key_takeaways": ["List of 3-5 key points"],
-                "specific_recommendations": ["Personalized recommendations based on user profile"],
-                "next_steps": ["Actionable steps the user can take"],
-                "resources": ["Relevant resources, tools, or further reading"],
-                "risk_disclaimers": "Important risk information and disclaimers"
-            }}
+        Please generate content in the following JSON format:
+        {{
+            "title": "Engaging title for the topic",
+            "introduction": "Brief introduction paragraph",
+            "main_content": "Detailed educational content with sections",
+            "key_takeaways": ["List of 3-5 key points"],
+            "specific_recommendations": ["Personalized recommendations based on user profile"],
+            "next_steps": ["Actionable steps the user can take"],
+            "resources": ["Relevant resources, tools, or further reading"],
+            "risk_disclaimers": "Important risk information and disclaimers"
+        }}
 
-            Make sure the content is engaging, educational, and specifically relevant to the user's situation.
-            """
-            
+        Make sure the content is engaging, educational, and specifically relevant to the user's situation.
+        """
+    
+    async def _generate_personalized_content(self, request: ContentRequest,
+                                             http_request: Optional[Request]) -> Dict[str, Any]:
+        try:
             # Generate content using Gemini
-            response = self.model.generate_content(prompt)
+            response_text = await llm_client.generate(self.model, self._build_prompt(request), request=http_request)
+            return self._parse_content(response_text, request)
             
-            # Try to parse JSON from response
-            try:
-                # Extract JSON from response text
-                response_text = response.text
-                # Find JSON content (sometimes Gemini adds markdown formatting)
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                json_content = response_text[start_idx:end_idx]
-                
-                content_data = json.loads(json_content)
-                
-                # Add metadata
-                content_data.update({
-                    "generated_at": datetime.now().isoformat(),
-                    "personalized": True,
-                    "level": request.level,
-                    "topic": request.topic,
-                    "user_profile_summary": self._get_profile_summary(request.user_profile)
-                })
-                
-                logger.info(f"Successfully generated personalized content for {request.topic}")
-                return content_data
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse JSON from Gemini response: {e}")
-                # Return structured fallback
-                return self._format_raw_content(response.text, request)
-                
         except Exception as e:
             logger.error(f"Error generating content with Gemini: {e}")
             return self._get_fallback_content(request.level, request.topic)
     
+    def _parse_content(self, response_text: str, request: ContentRequest) -> Dict[str, Any]:
+        """Content JSON from the response text, or the raw text formatted as content"""
+        try:
+            # Find JSON content (sometimes Gemini adds markdown formatting)
+            start_idx = response_text.find('{')
+            end_idx = response_text.rfind('}') + 1
+            json_content = response_text[start_idx:end_idx]
+            
+            content_data = json.loads(json_content)
+            
+            # Add metadata
+            content_data.update({
+                "generated_at": datetime.now().isoformat(),
+                "personalized": True,
+                "level": request.level,
+                "topic": request.topic,
+                "user_profile_summary": self._get_profile_summary(request.user_profile),
+                "source": "ai_generated"
+            })
+            
+            logger.info(f"Successfully generated personalized content for {request.topic}")
+            return content_data
+            
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse JSON from Gemini response: {e}")
+            # Return structured fallback
+            return self._format_raw_content(response_text, request)
+    
     def _format_raw_content(self, raw_content: str, request: ContentRequest) -> Dict[str, Any]:
         """Format raw Gemini response into structured content"""
         return {
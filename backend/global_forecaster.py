@@ -0,0 +1,306 @@
+"""
+Global cross-user expense forecaster.
+
+Instead of fitting a model per request on one user's 3-24 monthly totals, one
+gradient-boosted model is trained offline on every user's monthly series. Each
+series is divided by the user's own scale (mean of the last 12 months before the
+forecast origin), so the model learns the shape of spending over time while
+log(scale), history length and volatility tell it what kind of user it is
+looking at. Every horizon is a separate row with the horizon as a feature.
+
+Online, a forecast is a handful of feature rows (one per horizon, plus one per
+recent month used for calibration) scored in a single predict call. The
+calibration rows are the model's one-step backcasts of the user's latest months;
+their least-squares ratio to the actual totals, shrunk towards 1, is the linear
+rescale applied to that user's forecast.
+
+Usage:
+    python global_forecaster.py --firestore --output model_store/global_forecaster.joblib
+    python global_forecaster.py --synthetic 200 --fixtures fixtures/history_a.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from expense_predictor_model import CustomExpenseForecaster
+from statistical_forecaster import monthly_series
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = os.getenv("GLOBAL_FORECASTER_PATH", os.path.join("model_store", "global_forecaster.joblib"))
+ARTIFACT_FORMAT = 1
+MAX_HORIZON = 12
+MIN_HISTORY_MONTHS = 2
+CALIBRATION_MONTHS = 6
+# Months of calibration evidence at which the per-user factor gets half weight
+CALIBRATION_PRIOR = 6
+CALIBRATION_LIMITS = (0.5, 2.0)
+
+FEATURES = ['horizon', 'target_month', 'lag_1', 'lag_2', 'lag_3', 'mean_3', 'mean_6',
+            'same_month_last_year', 'log_scale', 'history_months', 'volatility']
+
+
+def user_scale(history: np.ndarray) -> float:
+    """Mean of the last 12 months, falling back to the whole history and then 1"""
+    recent = history[-12:]
+    for values in (recent, history):
+        mean = float(values.mean()) if len(values) else 0.0
+        if mean > 0:
+            return mean
+    return 1.0
+
+
+def origin_rows(history: np.ndarray, last_month: int, horizons: np.ndarray,
+                max_horizon: Optional[int] = None) -> np.ndarray:
+    """
+    Feature rows for forecasting `horizons` months after `history` (monthly totals),
+    whose last month has calendar month `last_month` (1-12). The cost depends only
+    on the number of horizons, not on the length of the history. Horizons beyond
+    max_horizon reuse its rows, with their own target month.
+    """
+    n = len(history)
+    scale = user_scale(history)
+    normalized = history[-12:] / scale
+    tail = normalized[::-1]
+
+    def lag(k):
+        return tail[k - 1] if len(tail) >= k else tail[-1]
+
+    mean_3 = normalized[-3:].mean()
+    rows = np.empty((len(horizons), len(FEATURES)))
+    rows[:, 0] = np.minimum(horizons, max_horizon) if max_horizon else horizons
+    rows[:, 1] = (last_month - 1 + horizons) % 12 + 1
+    rows[:, 2:5] = [lag(1), lag(2), lag(3)]
+    rows[:, 5] = mean_3
+    rows[:, 6] = normalized[-6:].mean()
+    # Same calendar month one year before the target, when the history reaches back that far
+    back = 12 - horizons
+    rows[:, 7] = np.where((back >= 0) & (back < len(normalized)),
+                          normalized[np.clip(len(normalized) - 1 - back, 0, len(normalized) - 1)], mean_3)
+    rows[:, 8] = np.log1p(scale)
+    rows[:, 9] = min(n, 24)
+    rows[:, 10] = normalized.std() if len(normalized) > 1 else 0.0
+    return rows
+
+
+def training_rows(series: pd.Series, max_horizon: int = MAX_HORIZON):
+    """(X, y_normalized, scales) for every origin and horizon of one user's monthly series"""
+    values = series.to_numpy(dtype=float)
+    months = series.index.month.to_numpy()
+    X, y, scales = [], [], []
+    for origin in range(MIN_HISTORY_MONTHS, len(values)):
+        history = values[:origin]
+        horizons = np.arange(1, min(max_horizon, len(values) - origin) + 1)
+        scale = user_scale(history)
+        X.append(origin_rows(history, months[origin - 1], horizons))
+        y.append(values[origin + horizons - 1] / scale)
+        scales.append(np.full(len(horizons), scale))
+    if not X:
+        return np.empty((0, len(FEATURES))), np.empty(0), np.empty(0)
+    return np.vstack(X), np.concatenate(y), np.concatenate(scales)
+
+
+def _stack_rows(series_list: List[pd.Series], max_horizon: int):
+    parts = [training_rows(series, max_horizon) for series in series_list]
+    return tuple(np.concatenate([part[i] for part in parts]) for i in range(3))
+
+
+class GlobalExpenseForecaster:
+    """A trained global model plus the metadata it was trained with"""
+
+    def __init__(self, artifact: Dict[str, Any]):
+        self.artifact = artifact
+
+    @classmethod
+    def train(cls, histories: Dict[str, pd.Series], max_horizon: int = MAX_HORIZON,
+              holdout_share: float = 0.2, seed: int = 42) -> 'GlobalExpenseForecaster':
+        """
+        Train on users' monthly series. Accuracy is measured on a holdout of whole users
+        (one-month-ahead, in currency), then the model is refitted on everyone.
+        """
+        names = sorted(name for name, series in histories.items() if len(series) > MIN_HISTORY_MONTHS)
+        if not names:
+            raise ValueError("No history is long enough to train the global forecaster")
+        rng = np.random.default_rng(seed)
+        holdout = set(rng.choice(names, size=int(len(names) * holdout_share), replace=False)) if len(names) >= 5 else set()
+
+        def new_model():
+            return GradientBoostingRegressor(n_estimators=300, learning_rate=0.05, max_depth=4,
+                                             subsample=0.8, random_state=seed)
+
+        model_accuracy = None
+        if holdout:
+            X_train, y_train, _ = _stack_rows([histories[n] for n in names if n not in holdout], max_horizon)
+            X_test, y_test, test_scales = _stack_rows([histories[n] for n in sorted(holdout)], max_horizon)
+            model = new_model().fit(X_train, y_train)
+            one_step = X_test[:, 0] == 1
+            actual = y_test[one_step] * test_scales[one_step]
+            predicted = np.maximum(model.predict(X_test[one_step]), 0) * test_scales[one_step]
+            if actual.mean() > 0:
+                model_accuracy = float(1.0 - np.abs(actual - predicted).mean() / actual.mean())
+                logger.info(f"Global model holdout accuracy ({len(holdout)} users): {model_accuracy:.3f}")
+
+        X, y, _ = _stack_rows([histories[n] for n in names], max_horizon)
+        model = new_model().fit(X, y)
+        if model_accuracy is None:
+            model_accuracy = float(1.0 - np.abs(model.predict(X) - y).mean() / y.mean()) if y.mean() > 0 else 1.0
+
+        return cls({
+            "format": ARTIFACT_FORMAT,
+            "trained_at": datetime.now().isoformat(),
+            "model": model,
+            "features": FEATURES,
+            "fast_predict_base": CustomExpenseForecaster._fast_predict_base(model, X),
+            "max_horizon": max_horizon,
+            "n_users": len(names),
+            "n_rows": int(len(y)),
+            "model_accuracy": model_accuracy
+        })
+
+    def save(self, path: str = DEFAULT_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Write then rename so a server loading at startup never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(self.artifact, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> Optional['GlobalExpenseForecaster']:
+        """The saved model, or None when there is no compatible artifact at path"""
+        if not os.path.exists(path):
+            return None
+        artifact = joblib.load(path)
+        if artifact.get("format") != ARTIFACT_FORMAT or artifact.get("features") != FEATURES:
+            logger.warning(f"Ignoring global forecaster at {path}: trained with an incompatible feature set")
+            return None
+        return cls(artifact)
+
+    def predict_series(self, series: pd.Series, timeframe: int) -> Optional[Dict[str, Any]]:
+        """
+        Forecast the `timeframe` months after a monthly series (month-start index).
+        Returns None when the series is shorter than MIN_HISTORY_MONTHS.
+        """
+        values = series.to_numpy(dtype=float)
+        if len(values) < MIN_HISTORY_MONTHS:
+            return None
+        months = series.index.month.to_numpy()
+        horizons = np.arange(1, timeframe + 1)
+
+        # Backcast the latest months from their own origins: same model, same predict call
+        origins = list(range(max(MIN_HISTORY_MONTHS, len(values) - CALIBRATION_MONTHS), len(values)))
+        blocks = [origin_rows(values, months[-1], horizons, self.artifact["max_horizon"])]
+        blocks += [origin_rows(values[:origin], months[origin - 1], np.array([1])) for origin in origins]
+        predicted = CustomExpenseForecaster._fast_predict(self.artifact, np.vstack(blocks))
+
+        calibration = 1.0
+        if origins:
+            backcast = np.maximum(predicted[timeframe:], 0) * [user_scale(values[:origin]) for origin in origins]
+            actual = values[origins]
+            if (backcast ** 2).sum() > 0:
+                ratio = float((backcast * actual).sum() / (backcast ** 2).sum())
+                weight = len(origins) / (len(origins) + CALIBRATION_PRIOR)
+                calibration = float(np.clip(1.0 + weight * (ratio - 1.0), *CALIBRATION_LIMITS))
+
+        amounts = np.maximum(predicted[:timeframe], 0) * user_scale(values) * calibration
+        future_dates = pd.date_range(series.index[-1], periods=timeframe + 1, freq='MS')[1:]
+        return {
+            "forecast": [
+                {
+                    "date": date.strftime("%Y-%m-%d"),
+                    "period": date.strftime("%Y-%m"),
+                    "predicted_amount": round(float(amount), 2),
+                    "category": "all"
+                }
+                for date, amount in zip(future_dates, amounts)
+            ],
+            "model_accuracy": round(self.artifact["model_accuracy"], 3),
+            "calibration": round(calibration, 3)
+        }
+
+    def predict(self, historical_expenses: List[Dict], timeframe: int) -> Optional[Dict[str, Any]]:
+        """Forecast from raw transactions ({'timestamp' or 'date', 'amount'})"""
+        if not historical_expenses:
+            return None
+        dates = [expense.get('timestamp') or expense.get('date') for expense in historical_expenses]
+        amounts = [float(expense.get('amount', 0) or 0) for expense in historical_expenses]
+        return self.predict_series(monthly_series(dates, amounts), timeframe)
+
+
+def load_firestore_histories(firestore_service) -> Dict[str, pd.Series]:
+    """Every user's monthly expense totals, streamed with only the needed fields projected"""
+    rows = []
+    docs = firestore_service.db.collection('transactions').select(['userId', 'date', 'amount', 'type']).stream()
+    for doc in docs:
+        data = doc.to_dict()
+        if data.get('userId') and data.get('date') and str(data.get('type', 'expense')).lower() == 'expense':
+            rows.append((data['userId'], str(data['date'])[:10], float(data.get('amount', 0) or 0)))
+    if not rows:
+        return {}
+    df = pd.DataFrame(rows, columns=['user_id', 'date', 'amount'])
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date'])
+    return {user_id: monthly_series(group['date'], group['amount']) for user_id, group in df.groupby('user_id')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the global cross-user expense forecaster")
+    parser.add_argument('--firestore', action='store_true', help="Train on every user's Firestore transactions")
+    parser.add_argument('--fixtures', nargs='*', default=[], help="JSON fixture files with anonymized histories")
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help="Add this many seeded synthetic histories per profile (for development)")
+    parser.add_argument('--months', type=int, default=30, help="Length of each synthetic history")
+    parser.add_argument('--max-horizon', type=int, default=MAX_HORIZON, help="Longest horizon trained")
+    parser.add_argument('--output', default=DEFAULT_MODEL_PATH, help="Where to write the model artifact")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from forecast_backtest import SYNTHETIC_PROFILES, load_fixture_histories, synthetic_history
+
+    started = time.time()
+    histories = {}
+    if args.firestore:
+        from dotenv import load_dotenv
+        from firestore_service import FirestoreService
+        load_dotenv()
+        firestore_service = FirestoreService()
+        if not firestore_service.db:
+            print("❌ Firestore is not available, aborting training")
+            sys.exit(1)
+        histories.update(load_firestore_histories(firestore_service))
+
+    raw = load_fixture_histories(args.fixtures)
+    raw.update({
+        f"{profile}_{seed}": synthetic_history(profile, args.months, seed=seed)
+        for profile in SYNTHETIC_PROFILES for seed in range(args.synthetic)
+    })
+    for name, transactions in raw.items():
+        histories[name] = monthly_series([tx['date'] for tx in transactions], [tx['amount'] for tx in transactions])
+
+    if not histories:
+        print("❌ No histories to train on (pass --firestore, --fixtures or --synthetic)")
+        sys.exit(1)
+
+    print(f"📊 Training the global forecaster on {len(histories)} users")
+    forecaster = GlobalExpenseForecaster.train(histories, max_horizon=args.max_horizon)
+    forecaster.save(args.output)
+    artifact = forecaster.artifact
+    print(json.dumps({key: artifact[key] for key in ("trained_at", "n_users", "n_rows", "model_accuracy")}, indent=2))
+    print(f"✅ Wrote {args.output} in {time.time() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""
+Response cache for Gemini-generated content.
+
+Glossary explanations, filing guides, learning content and form comparisons are a
+function of a few inputs (model, prompt template version and the arguments filled
+into it), and the same inputs are requested over and over. LLMResponseCache keys
+the parsed result by a hash of those inputs after canonicalization ("HRA " and
+"hra" are the same term, ITR-2 vs ITR-1 is the same pair as ITR-1 vs ITR-2), keeps
+recent entries in an in-memory LRU and every entry in SQLite so the cache survives
+restarts and is shared by workers on one host. Entries expire after a TTL.
+
+Concurrent misses for the same key are coalesced (single flight): the first caller
+generates, the others await its result (or its exception), so a burst of identical
+requests costs one upstream call. `python llm_cache.py` runs a load test against a fake upstream.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           "model_store", "llm_cache.sqlite3"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Expired rows are deleted from SQLite once every this many writes
+PRUNE_EVERY_PUTS = 256
+
+
+def canonicalize(value: Any) -> Any:
+    """
+    Canonical form of prompt arguments: strings trimmed, whitespace collapsed and
+    casefolded, empty values dropped from dicts. List order is kept; callers sort
+    lists whose order does not matter.
+    """
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, dict):
+        canonical = {str(k): canonicalize(v) for k, v in value.items()}
+        return {k: v for k, v in canonical.items() if v not in (None, "", [], {})}
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(v) for v in value]
+    return value
+
+
+class LLMResponseCache:
+    """
+    TTL cache of JSON-serializable LLM results: LRU in memory in front of SQLite.
+    Values are returned without copying, so callers must not mutate them.
+    """
+
+    def __init__(self, db_path: Optional[str] = LLM_CACHE_PATH, max_entries: int = 2048,
+                 ttl_seconds: float = LLM_CACHE_TTL_SECONDS):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "not_cacheable": 0,
+                        "coalesced": 0}
+        # key -> future resolved with (value, cacheable) by the caller currently generating it
+        self._flights: Dict[str, asyncio.Future] = {}
+        # Opened on first use, so importing the services never touches the disk
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pending = bool(db_path)
+
+    @staticmethod
+    def make_key(model: str, template: str, version: Any, **args) -> str:
+        """Key for a prompt template filled with args (canonicalized) on model"""
+        payload = json.dumps([model, template, version, canonicalize(args)], sort_keys=True,
+                             separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """The SQLite connection, opened (and pruned) on first use; call with _lock held"""
+        if self._db_pending:
+            self._db_pending = False
+            self._db = self._open(self.db_path)
+        return self._db
+
+    def _open(self, db_path: str) -> Optional[sqlite3.Connection]:
+        try:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            # WAL keeps reads from waiting on the occasional write; NORMAL skips an fsync per write
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS llm_cache ("
+                       "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, created_at REAL NOT NULL)")
+            db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+            return db
+        except Exception as e:
+            logger.warning(f"LLM response cache at {db_path} unavailable, caching in memory only: {e}")
+            return None
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] >= now:
+                self._memory.move_to_end(key)
+                self._counts["memory_hits"] += 1
+                return entry[1]
+            self._memory.pop(key, None)
+            row = None
+            db = self._connection()
+            if db is not None:
+                try:
+                    row = db.execute("SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at >= ?",
+                                           (key, now)).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"LLM response cache read failed: {e}")
+            if row is None:
+                self._counts["misses"] += 1
+                return None
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            self._counts["disk_hits"] += 1
+            return value
+
+    def put(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self._counts["stores"] += 1
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                db.execute("INSERT OR REPLACE INTO llm_cache (key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                                 (key, json.dumps(value, default=str), expires_at, now))
+                self._puts += 1
+                if self._puts % PRUNE_EVERY_PUTS == 0:
+                    db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logger.warning(f"LLM response cache write failed: {e}")
+
+    def _remember(self, key: str, expires_at: float, value: Any):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[Any]],
+                              cacheable: Callable[[Any], bool], ttl_seconds: Optional[float] = None) -> Any:
+        """
+        Cached value for key, or the result of generate(), stored when cacheable(result)
+        is true; fallbacks and error results are returned but not stored.
+
+        Callers arriving while another caller generates the same key wait for it and
+        share its outcome: an exception raised by generate() is raised to every waiter.
+        After a fallback result each waiter tries once more, again coalesced, and then
+        returns the second fallback rather than piling on more calls. If the generating
+        caller is cancelled (its client disconnected), the waiters start a new flight.
+        """
+        retries = 1
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+            flight = self._flights.get(key)
+            if flight is None:
+                return await self._generate(key, generate, cacheable, ttl_seconds)
+            with self._lock:
+                self._counts["coalesced"] += 1
+            # shield: a waiter being cancelled must not cancel the shared flight
+            value, cached, abandoned = await asyncio.shield(flight)
+            if cached:
+                return value
+            if abandoned:
+                continue
+            if retries == 0:
+                return value
+            retries -= 1
+
+    async def _generate(self, key: str, generate: Callable[[], Awaitable[Any]],
+                        cacheable: Callable[[Any], bool], ttl_seconds: Optional[float]) -> Any:
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        # (value, cached, abandoned) or the exception handed to the waiters
+        outcome: Any = (None, False, True)
+        try:
+            value = await generate()
+            cached = cacheable(value)
+            if cached:
+                self.put(key, value, ttl_seconds)
+            else:
+                with self._lock:
+                    self._counts["not_cacheable"] += 1
+            outcome = (value, cached, False)
+            return value
+        except Exception as e:
+            outcome = e
+            raise
+        finally:
+            # Unregister before waking the waiters so a retrying waiter starts a new flight
+            del self._flights[key]
+            if isinstance(outcome, Exception):
+                flight.set_exception(outcome)
+                # Mark it retrieved: with no waiters asyncio would log it as unhandled
+                flight.exception()
+            else:
+                flight.set_result(outcome)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._connection()
+            if db is not None:
+                db.execute("DELETE FROM llm_cache")
+
+    def close(self):
+        with self._lock:
+            self._db_pending = False
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._counts["memory_hits"] + self._counts["disk_hits"]
+            lookups = hits + self._counts["misses"]
+            disk_entries = None
+            db = self._connection()
+            if db is not None:
+                try:
+                    disk_entries = db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+            return {
+                **self._counts,
+                "hits": hits,
+                "hit_rate": round(hits / lookups, 4) if lookups else None,
+                "in_flight": len(self._flights),
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+
+# Shared by the Gemini services
+llm_response_cache = LLMResponseCache()
+
+
+async def _load_test(callers: int, keys: int, latency: float):
+    """callers simultaneous requests over `keys` distinct keys, against a fake upstream"""
+    from llm_client import LLMClient
+
+    class FakeResponse:
+        def __init__(self, text: str):
+            self.text = text
+
+    class FakeModel:
+        def __init__(self):
+            self.calls = 0
+
+        async def generate_content_async(self, prompt: str):
+            self.calls += 1
+            await asyncio.sleep(latency)
+            return FakeResponse(json.dumps({"term": prompt, "explanation": "..."}))
+
+    client = LLMClient()
+    terms = [f"term-{i % keys}" for i in range(callers)]
+
+    async def run(coalesce: bool) -> Dict[str, Any]:
+        model = FakeModel()
+        cache = LLMResponseCache(db_path=None)
+
+        async def request(term: str):
+            if not coalesce:
+                return json.loads(await client.generate(model, term))
+            key = cache.make_key("fake-model", "glossary_explanation", 1, term=term)
+            return await cache.get_or_generate(key, lambda: client.generate(model, term),
+                                               cacheable=lambda result: bool(result))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request(term) for term in terms))
+        return {"upstream_calls": model.calls, "seconds": round(time.perf_counter() - started, 3),
+                "coalesced": cache.stats()["coalesced"]}
+
+    print(f"{callers} simultaneous callers, {keys} distinct key(s), upstream latency {latency}s, "
+          f"LLM concurrency {client.max_concurrency}")
+    print(f"  direct calls:  {await run(coalesce=False)}")
+    print(f"  single flight: {await run(coalesce=True)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test single-flight coalescing against a fake Gemini upstream")
+    parser.add_argument('--callers', type=int, default=100, help="Simultaneous identical requests")
+    parser.add_argument('--keys', type=int, default=1, help="Distinct cache keys the callers spread over")
+    parser.add_argument('--latency', type=float, default=0.2, help="Fake upstream latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(_load_test(args.callers, args.keys, args.latency))
+
+
+if __name__ == '__main__':
+    main()
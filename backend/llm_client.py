@@ -0,0 +1,233 @@
+"""
+Shared async client for Gemini calls.
+
+Every AI service sends its prompts through llm_client.generate(), which never
+blocks the event loop: it awaits the SDK's generate_content_async when the model
+has one and otherwise runs generate_content on a bounded thread pool. A semaphore
+caps concurrent upstream calls across all services, every call has a timeout,
+and when the HTTP client that asked for the answer disconnects the call is
+cancelled instead of running to completion for nobody. llm_client.stream() is
+the same for streamed generation, yielding text chunks as they arrive.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# How often a waiting call checks whether its HTTP client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class LLMTimeoutError(Exception):
+    """The upstream model did not answer within the call's timeout"""
+
+
+class ClientDisconnectedError(Exception):
+    """The HTTP client went away, so its LLM call was cancelled"""
+
+
+def response_text(response: Any) -> str:
+    """
+    Text of a Gemini response. Some responses (blocked or multi-part candidates)
+    raise on .text, so the first candidate part is tried before str(response).
+    """
+    try:
+        text = response.text
+        if isinstance(text, str):
+            return text
+    except Exception:
+        pass
+    try:
+        part = response.candidates[0].content.parts[0]
+        text = part['text'] if isinstance(part, dict) else part.text
+        if isinstance(text, str):
+            return text
+    except Exception as e:
+        logger.error(f"Error extracting text from Gemini candidates: {e}")
+    logger.warning(f"Gemini response text extraction fallback. Raw response: {response}")
+    return str(response)
+
+
+def _chunk_text(chunk: Any) -> str:
+    """Text of one streamed chunk; chunks without text (e.g. the final usage chunk) give ''"""
+    try:
+        return chunk.text or ""
+    except Exception:
+        return ""
+
+
+def _next_or_stop(iterator):
+    # StopIteration cannot cross a Future, so the end of a sync stream is re-raised as its async form
+    try:
+        return next(iterator)
+    except StopIteration:
+        raise StopAsyncIteration
+
+
+class LLMClient:
+    """Bounded, cancellable async access to generative models"""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_TIMEOUT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        # Only used for models without an async API. A cancelled call cannot stop its
+        # thread, but the pool size still bounds how many blocking calls run at once.
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop = None
+        self.in_flight = 0
+        self.stats = {"calls": 0, "succeeded": 0, "failed": 0, "timeouts": 0, "cancelled": 0,
+                      "total_seconds": 0.0, "prompt_tokens": 0, "output_tokens": 0}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Semaphores bind to the event loop they are first used on (tests start new loops)
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _call(self, model: Any, prompt: str) -> str:
+        if hasattr(model, "generate_content_async"):
+            response = await model.generate_content_async(prompt)
+        else:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(self._executor, model.generate_content, prompt)
+        self._count_usage(response)
+        return response_text(response)
+
+    def _count_usage(self, response: Any):
+        """Add the token counts Gemini reports (usage_metadata) to the stats"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self.stats["prompt_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+            self.stats["output_tokens"] += getattr(usage, "candidates_token_count", 0) or 0
+
+    async def generate(self, model: Any, prompt: str, timeout: Optional[float] = None,
+                       request: Optional[Request] = None) -> str:
+        """
+        Response text for prompt. Raises LLMTimeoutError after `timeout` seconds
+        (waiting for a free slot included) and ClientDisconnectedError when
+        `request`'s client disconnects first; other SDK errors propagate.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.stats["calls"] += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self._generate(model, prompt, request), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise LLMTimeoutError(f"LLM call timed out after {timeout:g}s")
+        except ClientDisconnectedError:
+            self.stats["cancelled"] += 1
+            raise
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self.stats["total_seconds"] += time.perf_counter() - started
+
+    async def _generate(self, model: Any, prompt: str, request: Optional[Request]) -> str:
+        async with self._get_semaphore():
+            self.in_flight += 1
+            try:
+                if request is None:
+                    text = await self._call(model, prompt)
+                else:
+                    text = await self._call_until_disconnect(model, prompt, request)
+            finally:
+                self.in_flight -= 1
+        self.stats["succeeded"] += 1
+        return text
+
+    async def _call_until_disconnect(self, model: Any, prompt: str, request: Request) -> str:
+        call = asyncio.ensure_future(self._call(model, prompt))
+        try:
+            while True:
+                done, _ = await asyncio.wait({call}, timeout=DISCONNECT_POLL_SECONDS)
+                if done:
+                    return call.result()
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, cancelling LLM call")
+                    raise ClientDisconnectedError("client disconnected")
+        finally:
+            if not call.done():
+                call.cancel()
+
+    async def stream(self, model: Any, prompt: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Response text chunks as the model generates them, under the same semaphore.
+        `timeout` bounds the whole stream. A client disconnect needs no polling here:
+        StreamingResponse cancels the consuming task, which cancels the upstream read.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.stats["calls"] += 1
+        started = time.perf_counter()
+        try:
+            async with self._get_semaphore():
+                self.in_flight += 1
+                try:
+                    if hasattr(model, "generate_content_async"):
+                        response = await asyncio.wait_for(model.generate_content_async(prompt, stream=True),
+                                                          deadline - loop.time())
+                        chunks = response.__aiter__()
+                        next_chunk = chunks.__anext__
+                    else:
+                        response = await asyncio.wait_for(
+                            loop.run_in_executor(self._executor, lambda: iter(model.generate_content(prompt, stream=True))),
+                            deadline - loop.time())
+                        next_chunk = lambda: loop.run_in_executor(self._executor, _next_or_stop, response)
+                    usage_chunk = None
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(next_chunk(), deadline - loop.time())
+                        except StopAsyncIteration:
+                            break
+                        if getattr(chunk, "usage_metadata", None) is not None:
+                            usage_chunk = chunk
+                        text = _chunk_text(chunk)
+                        if text:
+                            yield text
+                    # Streamed usage is cumulative; the last chunk carrying it has the totals
+                    if usage_chunk is not None:
+                        self._count_usage(usage_chunk)
+                finally:
+                    self.in_flight -= 1
+            self.stats["succeeded"] += 1
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise LLMTimeoutError(f"LLM stream timed out after {timeout:g}s")
+        except (asyncio.CancelledError, GeneratorExit):
+            self.stats["cancelled"] += 1
+            raise
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self.stats["total_seconds"] += time.perf_counter() - started
+
+    def status(self) -> Dict[str, Any]:
+        calls = self.stats["calls"]
+        return {
+            "max_concurrency": self.max_concurrency,
+            "timeout_seconds": self.timeout,
+            "in_flight": self.in_flight,
+            **self.stats,
+            "total_seconds": round(self.stats["total_seconds"], 3),
+            "avg_seconds": round(self.stats["total_seconds"] / calls, 3) if calls else None
+        }
+
+
+# Shared by every Gemini service so the concurrency limit is global
+llm_client = LLMClient()
@@ -0,0 +1,153 @@
+"""
+Server-Sent Events for streamed Gemini JSON responses.
+
+The AI endpoints ask Gemini for one JSON object (learning content, field
+assistance) or array (filing guide). stream_json_events() forwards the model's
+text as it is generated and, using IncrementalJSONParser, emits every top-level
+member of that JSON as soon as it is complete, so a client can render the title
+or the first guide step long before the full answer exists. The last event
+carries the same body the non-streaming endpoint returns: the validated result,
+wrapped by the endpoint's envelope when it has one.
+
+Events:
+    delta    {"text": "..."}                     raw model text as generated
+    section  {"section": <key|index>, "value": ...} one complete top-level member
+    result   {...}                                final validated response body
+    error    {"detail": "..."}                    generation failed (details are only logged); a result event with the fallback follows
+"""
+
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple, Union
+
+from llm_cache import llm_response_cache
+from llm_client import llm_client
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop nginx-style proxies from buffering the stream
+    "X-Accel-Buffering": "no"
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class IncrementalJSONParser:
+    """
+    Emits the top-level members of the first JSON object or array in a text stream
+    as each one completes: (key, value) for an object, (index, value) for an array.
+    Text before the opening bracket (e.g. a ```json fence) is skipped. Members that
+    fail to parse are skipped; the caller validates the complete text at the end.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.root: Optional[str] = None
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.member_start = 0
+        self.index = 0
+        self.done = False
+
+    def feed(self, text: str) -> List[Tuple[Union[str, int], Any]]:
+        self.buffer += text
+        members = []
+        buffer = self.buffer
+        for i in range(self.position, len(buffer)):
+            if self.done:
+                break
+            char = buffer[i]
+            if self.root is None:
+                if char in "{[":
+                    self.root, self.depth, self.member_start = char, 1, i + 1
+                continue
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._finish_member(buffer[self.member_start:i], members)
+                    self.done = True
+            elif char == "," and self.depth == 1:
+                self._finish_member(buffer[self.member_start:i], members)
+                self.member_start = i + 1
+        self.position = len(buffer)
+        return members
+
+    def _finish_member(self, text: str, members: list):
+        text = text.strip()
+        if not text:
+            return
+        try:
+            if self.root == "[":
+                members.append((self.index, json.loads(text)))
+                self.index += 1
+            else:
+                members.extend(json.loads("{" + text + "}").items())
+        except json.JSONDecodeError:
+            logger.debug(f"Skipping unparsable streamed JSON member: {text[:80]}")
+
+
+Envelope = Optional[Callable[[Any], Any]]
+STREAM_ERROR_DETAIL = "AI generation failed; the result is the standard fallback"
+
+
+def _enveloped(result: Any, envelope: Envelope) -> Any:
+    return envelope(result) if envelope else result
+
+
+async def stream_result(result: Any, envelope: Envelope = None) -> AsyncIterator[str]:
+    """The SSE stream of a response that is already known (AI disabled, cache hit)"""
+    yield sse_event("result", _enveloped(result, envelope))
+
+
+async def stream_json_events(model: Any, prompt: str, finalize: Callable[[str], Any],
+                             fallback: Callable[[], Any], cache_key: Optional[str] = None,
+                             cacheable: Optional[Callable[[Any], bool]] = None,
+                             envelope: Envelope = None) -> AsyncIterator[str]:
+    """
+    SSE events for one streamed generation. finalize(full_text) builds the validated
+    result; fallback() is used when generation fails. With a cache_key, a cached
+    result is sent at once, and a cacheable result is stored. envelope(result) is the
+    body of the result event, for endpoints that wrap their result (the cache holds
+    the bare result, shared with the non-streaming path).
+    """
+    if cache_key:
+        cached = llm_response_cache.get(cache_key)
+        if cached is not None:
+            yield sse_event("result", _enveloped(cached, envelope))
+            return
+
+    parser = IncrementalJSONParser()
+    parts = []
+    try:
+        async for text in llm_client.stream(model, prompt):
+            parts.append(text)
+            yield sse_event("delta", {"text": text})
+            for section, value in parser.feed(text):
+                yield sse_event("section", {"section": section, "value": value})
+        result = finalize("".join(parts))
+    except Exception as e:
+        # Upstream errors can carry request details; the client only learns that generation failed
+        logger.error(f"Error streaming Gemini response: {e}")
+        yield sse_event("error", {"detail": STREAM_ERROR_DETAIL})
+        result = fallback()
+
+    if cache_key and cacheable and cacheable(result):
+        llm_response_cache.put(cache_key, result)
+    yield sse_event("result", _enveloped(result, envelope))
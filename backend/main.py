@@ -1,5 +1,5 @@
-from fastapi import FastAPI, Depends, Header, UploadFile, File, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Depends, Header, UploadFile, File, Form, Response, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
@@ -11,7 +11,13 @@ import logging
 from firestore_service import FirestoreService
 from bank_statement_parser import BankStatementParser
 from spending_analysis_service import SpendingAnalysisService
+from spending_trends import TREND_METHODS, dense_daily_series, estimate_trend
+from spending_anomaly_service import SpendingAnomalyService
+from spending_distribution_service import SpendingDistributionService
 from gemini_content_service import GeminiContentService, ContentRequest, UserProfile
+from llm_client import llm_client
+from llm_cache import llm_response_cache
+from llm_stream import SSE_HEADERS
 import json
 
 import models, database
@@ -24,13 +30,19 @@ import jwt
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from tax_chatbot import classify_tax_question
-from expense_classifier import predict_expense_category
+from expense_classifier import classify_batch, classifier_info, is_calibrated
+from online_expense_classifier import OnlineExpenseClassifier
+from categorization_service import CategorizationService, canonicalize_category
 from tax_filing.form_registry import get_all_forms, get_form_details
 from tax_filing.gemini_tax_service import gemini_tax_service
 from tax_filing.validation_engine import validate_form_data
 from tax_filing.gemini_guide_service import gemini_tax_guide_service
 from tax_filing.gemini_glossary_service import gemini_glossary_service
-from expense_predictor_model import CustomExpenseForecaster # Import the class, not an instance
+from expense_predictor_model import CustomExpenseForecaster, FORECAST_STRATEGIES, stable_seed, future_month_starts # Import the class, not an instance
+from daily_forecaster import DailyExpenseForecaster
+from global_forecaster import MIN_HISTORY_MONTHS as GLOBAL_MIN_HISTORY_MONTHS, GlobalExpenseForecaster
+from forecast_model_store import ForecastModelStore, ForecastResponseCache, compute_data_version
+from statistical_forecaster import forecast_monthly
 
 load_dotenv()
 
@@ -54,9 +66,24 @@ except Exception as e:
     print(f"⚠️  Gemini Content service initialization failed: {e}")
     gemini_service = None
 
+anomaly_service = SpendingAnomalyService(firestore_service)
+distribution_service = SpendingDistributionService(firestore_service)
+forecast_model_store = ForecastModelStore()
+forecast_response_cache = ForecastResponseCache()
+# Learns from users' category corrections; per-user overrides are checked first
+online_classifier = OnlineExpenseClassifier()
+# User overrides -> merchant cache -> keyword rules -> model -> default, for every categorizer
+categorization_service = CategorizationService(
+    classify_batch=classify_batch,
+    model_version=lambda: classifier_info().get("version"),
+    online_classifier=online_classifier
+)
+# Cross-user forecaster trained offline (global_forecaster.py); loaded once at startup
+global_forecaster = None
+
 # Initialize bank statement parser
 try:
-    bank_parser = BankStatementParser()
+    bank_parser = BankStatementParser(categorization_service)
     print("✅ Bank statement parser initialized successfully")
 except Exception as e:
     print(f"⚠️  Bank statement parser initialization failed: {e}")
@@ -66,6 +93,9 @@ except Exception as e:
 async def lifespan(app: FastAPI):
     # Startup: Create the database tables
     models.Base.metadata.create_all(bind=database.engine)
+    # create_all skips indexes on tables that already exist, so add any new ones explicitly
+    for index in models.Expense.__table__.indexes:
+        index.create(bind=database.engine, checkfirst=True)
     
     # Test Firestore connection on startup
     if firestore_service and firestore_service.db:
@@ -76,9 +106,23 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             print(f"⚠️  Firestore connection test failed: {e}")
     
+    global global_forecaster
+    try:
+        global_forecaster = GlobalExpenseForecaster.load()
+        if global_forecaster:
+            print(f"✅ Global forecaster loaded (trained {global_forecaster.artifact['trained_at']})")
+        else:
+            print("📝 No global forecaster artifact found, forecasts use per-user models")
+    except Exception as e:
+        print(f"⚠️  Global forecaster failed to load: {e}")
+        global_forecaster = None
+    
+    online_classifier.start()
+    
     yield
-    # Shutdown: Add any cleanup code here if needed
-    pass
+    # Shutdown: apply queued category corrections and snapshot them
+    online_classifier.stop()
+    llm_response_cache.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -349,34 +393,46 @@ class ExpenseCategoryInput(BaseModel):
 
 @app.post("/predict-expense-category")
 def predict_expense_category_route(input: ExpenseCategoryInput):
-    category = predict_expense_category(input.description)
-    return {"category": category}
+    category, confidence, _ = categorization_service.categorize(input.description)
+    return {"category": category, "confidence": round(confidence, 3)}
 
 class ExpenseRecord(BaseModel):
     date: str  # ISO format date
     amount: float
     category: str
 
+FORECAST_ENGINES = ("holt_winters", "prophet")
+
 class ForecastInput(BaseModel):
     category: str
     expenses: List[ExpenseRecord]
+    engine: str = "holt_winters"  # "prophet" is opt-in and much slower
 
 @app.post("/forecast-expenses-with-data")
 def forecast_expenses_with_data(input: ForecastInput):
+    if input.engine not in FORECAST_ENGINES:
+        raise HTTPException(status_code=400, detail=f"Invalid engine. Use one of: {', '.join(FORECAST_ENGINES)}")
     # Filter expenses for the requested category
     filtered = [e.dict() for e in input.expenses if e.category.lower() == input.category.lower()]
     if not filtered or len(filtered) < 3:
         return {"error": "Not enough data for forecasting."}
-    # Prepare data for Prophet
-    import pandas as pd
-    from prophet import Prophet
+
+    if input.engine == "holt_winters":
+        result = forecast_monthly(filtered, horizon=3)
+        return {"category": input.category, "forecast": result, "engine": input.engine}
+
+    # Prophet is only imported when explicitly requested (slow import + Stan fit per call)
+    try:
+        from prophet import Prophet
+    except ImportError:
+        raise HTTPException(status_code=400, detail="Prophet engine is not installed on this server")
     df = pd.DataFrame(filtered)
     df['date'] = pd.to_datetime(df['date'])
-    df = df.groupby(pd.Grouper(key='date', freq='M')).sum().reset_index()
+    df = df.groupby(pd.Grouper(key='date', freq='MS'))['amount'].sum().reset_index()
     df = df.rename(columns={'date': 'ds', 'amount': 'y'})
     model = Prophet(yearly_seasonality=False, daily_seasonality=False, weekly_seasonality=False)
     model.fit(df)
-    future = model.make_future_dataframe(periods=3, freq='M')
+    future = model.make_future_dataframe(periods=3, freq='MS')
     forecast = model.predict(future)
     # Get only the next 3 months
     next_months = forecast[['ds', 'yhat']].tail(3)
@@ -384,7 +440,7 @@ def forecast_expenses_with_data(input: ForecastInput):
         {"month": row['ds'].strftime('%Y-%m'), "predicted_amount": round(row['yhat'], 2)}
         for _, row in next_months.iterrows()
     ]
-    return {"category": input.category, "forecast": result}
+    return {"category": input.category, "forecast": result, "engine": input.engine}
 
 # Spending Analysis Endpoints
 @app.get("/api/spending/summary/{user_id}")
@@ -402,7 +458,7 @@ async def get_spending_summary(
     """
     try:
         analysis_service = SpendingAnalysisService(db, firestore_service)
-        summary = analysis_service.get_spending_summary(user_id, period)
+        summary = analysis_service.get_spending_summary(user_id, period, use_precomputed=True)
         return {"status": "success", "data": summary}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
@@ -417,7 +473,7 @@ async def get_spending_insights(
     """
     try:
         analysis_service = SpendingAnalysisService(db, firestore_service)
-        insights = analysis_service.generate_insights(user_id)
+        insights = analysis_service.generate_insights(user_id, use_precomputed=True)
         return {"status": "success", "insights": insights}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Insights generation failed: {str(e)}")
@@ -442,80 +498,119 @@ async def get_budget_analysis(
 async def categorize_expense(
     description: str,
     amount: float,
-    merchant: str = None
+    merchant: str = None,
+    user=Depends(optional_firebase_token)
 ):
     """
     Automatically categorize an expense based on description and amount
     """
     try:
-        from expense_classifier import predict_expense_category
-        category = predict_expense_category(description)
-        
-        # Enhanced categorization logic
-        confidence = 0.8  # Base confidence
-        
-        # Adjust confidence based on amount and patterns
-        if amount > 10000:
-            category_hints = {
-                "rent": ["rent", "housing", "apartment"],
-                "medical": ["hospital", "doctor", "pharmacy"],
-                "travel": ["flight", "hotel", "booking"]
-            }
-            
-            for cat, keywords in category_hints.items():
-                if any(keyword in description.lower() for keyword in keywords):
-                    category = cat
-                    confidence = 0.95
-                    break
-        
+        # Large rent, hospital and travel payments are matched by the service's high-value rules
+        category, confidence, source = categorization_service.categorize(
+            description, amount, user['user_id'] if user else None
+        )
         return {
             "status": "success",
             "category": category,
-            "confidence": confidence,
-            "suggestions": get_category_suggestions(description, amount)
+            "confidence": round(confidence, 3),
+            "source": source,
+            "suggestions": categorization_service.suggest(description, amount)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Categorization failed: {str(e)}")
 
-def get_category_suggestions(description: str, amount: float) -> List[str]:
-    """Get category suggestions based on description and amount patterns"""
-    suggestions = []
-    desc_lower = description.lower()
-    
-    # Amount-based suggestions
-    if amount < 100:
-        suggestions.extend(["food", "transport", "utilities"])
-    elif amount < 1000:
-        suggestions.extend(["shopping", "entertainment", "groceries"])
-    elif amount < 5000:
-        suggestions.extend(["electronics", "clothing", "dining"])
-    else:
-        suggestions.extend(["rent", "travel", "medical", "education"])
-    
-    # Description-based suggestions
-    food_keywords = ["restaurant", "cafe", "food", "zomato", "swiggy"]
-    transport_keywords = ["uber", "ola", "taxi", "metro", "bus"]
-    shopping_keywords = ["amazon", "flipkart", "mall", "store"]
+MAX_CATEGORIZE_BATCH = 100_000
+
+class CategorizeBatchRequest(BaseModel):
+    descriptions: List[str]
+
+@app.post("/api/spending/categorize/batch")
+def categorize_expenses_batch(request: CategorizeBatchRequest, user=Depends(optional_firebase_token)):
+    """
+    Categorize many descriptions at once (e.g. a whole statement). The model runs one
+    vectorizer transform and one probability call over all of them; results are
+    parallel lists in request order. confidences_calibrated is false while the model
+    was trained on too few labelled examples to fit a temperature (e.g. the built-in
+    examples); model confidences are then raw naive Bayes probabilities.
+    """
+    if not request.descriptions:
+        raise HTTPException(status_code=400, detail="descriptions must not be empty")
+    if len(request.descriptions) > MAX_CATEGORIZE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_CATEGORIZE_BATCH} descriptions per request")
     
-    if any(keyword in desc_lower for keyword in food_keywords):
-        suggestions.insert(0, "food")
-    elif any(keyword in desc_lower for keyword in transport_keywords):
-        suggestions.insert(0, "transport")
-    elif any(keyword in desc_lower for keyword in shopping_keywords):
-        suggestions.insert(0, "shopping")
+    try:
+        started = time.perf_counter()
+        categories, confidences, sources = categorization_service.categorize_batch(
+            request.descriptions, user_id=user['user_id'] if user else None
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        return {
+            "status": "success",
+            "count": len(categories),
+            "categories": categories,
+            "confidences": np.round(confidences, 3).tolist(),
+            "sources": sources,
+            "model_version": classifier_info().get("version"),
+            "confidences_calibrated": is_calibrated(),
+            "elapsed_ms": round(elapsed_ms, 2)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch categorization failed: {str(e)}")
+
+class CategoryFeedback(BaseModel):
+    description: str
+    category: str  # The category the user chose instead of the predicted one
+
+@app.post("/api/spending/categorize/feedback")
+def categorize_feedback(feedback: CategoryFeedback, user=Depends(verify_firebase_token)):
+    """
+    Record a user's category correction. It overrides that user's future predictions
+    for the same description right away and is learned by the shared online model in
+    the next micro-batch.
+    """
+    if not feedback.description.strip() or not feedback.category.strip():
+        raise HTTPException(status_code=400, detail="description and category are required")
     
-    return list(dict.fromkeys(suggestions))  # Remove duplicates while preserving order
+    try:
+        online_classifier.record_correction(user['user_id'], feedback.description, canonicalize_category(feedback.category))
+        return {"status": "success", "data": online_classifier.status()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Recording feedback failed: {str(e)}")
+
+@app.get("/api/spending/categorize/status")
+def categorize_status():
+    """Which classifier serves categorization, how much the online model has learned, and per-tier hits and latency"""
+    return {
+        "status": "success",
+        "data": {
+            "classifier": classifier_info(),
+            "online": online_classifier.status(),
+            "cascade": categorization_service.stats()
+        }
+    }
 
 @app.get("/api/spending/trends/{user_id}")
 async def get_spending_trends(
     user_id: str,
     category: str = None,
     time_range: str = "3months",
+    trend_method: str = "ols",
+    ewma_alpha: float = 0.3,
     db: Session = Depends(get_db)
 ):
     """
     Get spending trends over time, optionally filtered by category
+    
+    Parameters:
+    - trend_method: Slope estimator for the zero-filled daily series (ols, theil_sen, ewma);
+      only that estimator is computed, theil_sen over the days with spending
+    - ewma_alpha: Smoothing factor used for the EWMA series
     """
+    if trend_method not in TREND_METHODS:
+        raise HTTPException(status_code=400, detail=f"Invalid trend_method. Use one of: {', '.join(TREND_METHODS)}")
+    if not 0 < ewma_alpha <= 1:
+        raise HTTPException(status_code=400, detail="ewma_alpha must be in (0, 1]")
+    
     try:
         # Time range mapping
         days_map = {
@@ -529,45 +624,38 @@ async def get_spending_trends(
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
         
-        # Query expenses
-        query = db.query(Expense).filter(
-            Expense.user_id == user_id,
-            Expense.timestamp >= start_date,
-            Expense.timestamp <= end_date
-        )
-        
-        if category:
-            query = query.filter(Expense.category == category)
-            
-        expenses = query.all()
+        # Daily totals are aggregated in SQL; only one row per day is fetched
+        analysis_service = SpendingAnalysisService(db, firestore_service)
+        df = analysis_service.get_daily_totals_sql(user_id, start_date, end_date, category)
         
-        if not expenses:
+        if df.empty:
             return {"status": "success", "trends": [], "summary": {}}
         
-        # Convert to DataFrame for analysis
-        df = pd.DataFrame([{
-            'date': exp.timestamp.date(),
-            'amount': exp.amount,
-            'category': exp.category or 'uncategorized'
-        } for exp in expenses])
+        # Zero-filled daily totals over the whole range, so quiet days count towards the trend
+        day_index, amounts = dense_daily_series(df['date'], df['amount'], start_date.date(), end_date.date())
+        trend = estimate_trend(amounts, method=trend_method, alpha=ewma_alpha)
+        trend_slope = trend["slope"]
         
-        # Group by date and calculate daily totals
-        daily_totals = df.groupby('date')['amount'].sum().reset_index()
-        daily_totals['date'] = daily_totals['date'].astype(str)
-        
-        # Calculate trend metrics
-        amounts = daily_totals['amount'].values
-        trend_slope = np.polyfit(range(len(amounts)), amounts, 1)[0] if len(amounts) > 1 else 0
+        day_labels = day_index.astype(str)
+        trends_data = [
+            {"date": day, "amount": float(amount), "ewma": round(float(smoothed), 2)}
+            for day, amount, smoothed in zip(day_labels, amounts, trend["ewma"])
+        ]
         
-        trends_data = daily_totals.to_dict('records')
+        # Peak/lowest are reported among days that actually had spending
+        spend_days = np.flatnonzero(amounts)
         
         summary = {
             "total_amount": float(df['amount'].sum()),
             "average_daily": float(df['amount'].sum() / max(1, days)),
             "trend_direction": "increasing" if trend_slope > 0 else "decreasing",
             "trend_strength": abs(float(trend_slope)),
-            "peak_day": daily_totals.loc[daily_totals['amount'].idxmax(), 'date'] if len(daily_totals) > 0 else None,
-            "lowest_day": daily_totals.loc[daily_totals['amount'].idxmin(), 'date'] if len(daily_totals) > 0 else None
+            "trend_method": trend_method,
+            "slope_ols": trend["slope_ols"],
+            "slope_theil_sen": trend["slope_theil_sen"],
+            "ewma_latest": trend["ewma_latest"],
+            "peak_day": day_labels[spend_days[amounts[spend_days].argmax()]] if len(spend_days) > 0 else None,
+            "lowest_day": day_labels[spend_days[amounts[spend_days].argmin()]] if len(spend_days) > 0 else None
         }
         
         return {
@@ -579,17 +667,204 @@ async def get_spending_trends(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Trends analysis failed: {str(e)}")
 
+ANOMALY_LIST_MAX = 200
+
+@app.get("/api/spending/anomalies/{user_id}")
+async def get_spending_anomalies(
+    user_id: str,
+    category: str = None,
+    limit: int = 50
+):
+    """
+    List transactions flagged as unusual when they were written.
+    Scores come from per-category rolling state, so no history is rescanned here.
+    """
+    if not 1 <= limit <= ANOMALY_LIST_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {ANOMALY_LIST_MAX}")
+    try:
+        anomalies = anomaly_service.get_user_anomalies(user_id, limit=limit, category=category)
+        return {"status": "success", "anomalies": anomalies, "count": len(anomalies)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Anomaly lookup failed: {str(e)}")
+
+def _is_month(value: str) -> bool:
+    """True for a YYYY-MM month string"""
+    try:
+        return len(value) == 7 and datetime.strptime(value, "%Y-%m") is not None
+    except ValueError:
+        return False
+
+@app.get("/api/spending/distribution/{user_id}")
+async def get_spending_distribution(
+    user_id: str,
+    percentiles: str = "10,25,50,75,90",
+    bins: int = 10,
+    start_month: str = None,
+    end_month: str = None,
+    category: str = None
+):
+    """
+    Percentiles and an adaptive histogram of transaction amounts.
+    
+    Parameters:
+    - percentiles: Comma-separated percentiles between 0 and 100
+    - bins: Number of equal-mass histogram bins
+    - start_month / end_month: Inclusive month range (YYYY-MM)
+    - category: Restrict to one category
+    """
+    try:
+        requested = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles must be comma-separated numbers")
+    if not requested or any(p < 0 or p > 100 for p in requested):
+        raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+    if not 1 <= bins <= 100:
+        raise HTTPException(status_code=400, detail="bins must be between 1 and 100")
+    for month in (start_month, end_month):
+        if month is not None and not _is_month(month):
+            raise HTTPException(status_code=400, detail="start_month and end_month must be YYYY-MM")
+    if start_month and end_month and start_month > end_month:
+        raise HTTPException(status_code=400, detail="start_month must not be after end_month")
+    
+    try:
+        distribution = distribution_service.get_distribution(
+            user_id, requested, bins=bins, start_month=start_month, end_month=end_month, category=category
+        )
+        return {"status": "success", "data": distribution}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Distribution analysis failed: {str(e)}")
+
+def invalidate_spending_summaries(user_id: str):
+    """Drop the batch-job snapshot, which no longer reflects the user's transactions"""
+    try:
+        SpendingAnalysisService(None, firestore_service).invalidate_precomputed_summaries(user_id)
+    except Exception as e:
+        logger.error(f"Failed to invalidate precomputed summaries for {user_id}: {e}")
+
+def record_transaction_rollups(user_id: str, transaction: Dict, transaction_id: str = None,
+                               invalidate_summaries: bool = True) -> Optional[Dict]:
+    """
+    Update write-time rollups for a new transaction; never fails the write itself.
+    Bulk writers pass invalidate_summaries=False and call invalidate_spending_summaries() once.
+    """
+    if invalidate_summaries:
+        invalidate_spending_summaries(user_id)
+    try:
+        distribution_service.record_transaction(user_id, transaction)
+        return anomaly_service.process_transaction(user_id, transaction, transaction_id)
+    except Exception as e:
+        logger.error(f"Failed to update rollups for transaction {transaction_id}: {e}")
+        return None
+
+def sync_transaction_rollups(user_id: str, transaction_id: str, previous: Optional[Dict],
+                             current: Optional[Dict]) -> Optional[Dict]:
+    """
+    Bring rollups in line with a write made outside the backend: previous=None is an add,
+    current=None a delete, both an edit. Returns the anomaly score of the current values.
+    """
+    if previous is None:
+        return record_transaction_rollups(user_id, current, transaction_id) if current else None
+
+    invalidate_spending_summaries(user_id)
+    try:
+        if current is None:
+            distribution_service.remove_transaction(user_id, previous)
+            anomaly_service.remove_transaction(user_id, previous, transaction_id)
+            return None
+        distribution_service.update_transaction(user_id, previous, current)
+        return anomaly_service.update_transaction(user_id, previous, current, transaction_id)
+    except Exception as e:
+        logger.error(f"Failed to update rollups for transaction {transaction_id}: {e}")
+        return None
+
+FORECAST_RESOLUTIONS = ("monthly", "daily")
+FORECAST_QUANTILES_UNAVAILABLE = "Not enough transaction history to compute forecast quantiles; retry without quantiles"
+# "auto" uses the global model when it is loaded and the request does not need a per-user model
+FORECAST_MODEL_ENGINES = ("auto", "per_user", "global")
+
 # New Forecast Input Model for frontend compatibility
 class ForecastRequestInput(BaseModel):
     timeframe: int  # Number of months to forecast
     category: Optional[str] = None  # Specific category or None for all
+    multi_category: bool = False  # Forecast every category (and their total) with one model
+    strategy: str = "recursive"  # "recursive" or "direct" (one model per horizon)
+    quantiles: Optional[List[float]] = None  # e.g. [0.1, 0.5, 0.9] adds prediction intervals per month (422 when history is too short)
+    resolution: str = "monthly"  # "daily" trains on daily totals with calendar features (needs only weeks of data)
+    engine: str = "auto"  # "per_user" fits the user's own model, "global" uses the cross-user model (400/503 when it cannot)
+
+def _cached_forecast(cache_key: str, response: Response, if_none_match: Optional[str]):
+    """304 when the client already holds the cached forecast, the cached body on a hit, else None"""
+    entry = forecast_response_cache.get(cache_key)
+    if entry is None:
+        return None
+    cached, etag = entry
+    if forecast_response_cache.matches(etag, if_none_match):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    return cached
+
+def _store_forecast(cache_key: str, body: Dict[str, Any], response: Response) -> Dict[str, Any]:
+    response.headers["ETag"] = forecast_response_cache.put(cache_key, body)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return body
+
+def _per_user_forecast(user_id: str, input: ForecastRequestInput, historical_expenses: List[Dict],
+                       forecaster: CustomExpenseForecaster):
+    """Forecast with the user's own (stored or freshly fitted) model: (result, data_source, model_source)"""
+    # Reuse the stored model for this data version; only retrain when data changed enough
+    fitted = None
+    if input.resolution == "monthly":
+        fitted, model_source = forecast_model_store.get_or_fit(
+            user_id, input.category or "all", historical_expenses, forecaster, strategy=input.strategy
+        )
+        logger.info(f"[Forecast] Model source: {model_source}")
+    if fitted is not None:
+        result = forecaster.predict_from_fitted(fitted, input.timeframe, strategy=input.strategy, quantiles=input.quantiles)
+        return result, "custom_ml_model", model_source
+    if input.quantiles:
+        # The daily and basic fallback forecasts have no residuals to bootstrap intervals from
+        raise HTTPException(status_code=422, detail=FORECAST_QUANTILES_UNAVAILABLE)
+
+    # The daily model needs weeks rather than months of history, so it also
+    # covers users the monthly model has too few months for
+    daily_forecaster = DailyExpenseForecaster()
+    fitted, model_source = forecast_model_store.get_or_fit(
+        user_id, input.category or "all", historical_expenses, daily_forecaster, resolution="daily"
+    )
+    logger.info(f"[Forecast] Daily model source: {model_source}")
+    if fitted is not None:
+        return daily_forecaster.predict_from_fitted(fitted, input.timeframe), "custom_ml_model_daily", model_source
+    return forecaster._basic_fallback_forecast(historical_expenses, input.timeframe), "custom_ml_model", model_source
 
 @app.post("/forecast-expenses")
-def forecast_expenses_new(input: ForecastRequestInput, user=Depends(optional_firebase_token)):
+def forecast_expenses_new(input: ForecastRequestInput, response: Response, user=Depends(optional_firebase_token),
+                          if_none_match: Optional[str] = Header(None)):
     """
     Generate expense forecasts for the specified timeframe and category using actual user data from Firestore.
     Falls back to mock data if insufficient historical data is available or custom model fails.
+    Responses are cached per (data version, category, timeframe, engine, month) and carry an ETag of the
+    body; send it back as If-None-Match to get a 304 while that body is still the cached answer.
     """
+    if input.strategy not in FORECAST_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Invalid strategy. Use one of: {', '.join(FORECAST_STRATEGIES)}")
+    if input.quantiles is not None and (not input.quantiles or any(not 0 < q < 1 for q in input.quantiles)):
+        raise HTTPException(status_code=400, detail="quantiles must be a non-empty list of values in (0, 1)")
+    if input.resolution not in FORECAST_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid resolution. Use one of: {', '.join(FORECAST_RESOLUTIONS)}")
+    if input.resolution == "daily" and (input.quantiles or input.multi_category):
+        raise HTTPException(status_code=400, detail="quantiles and multi_category are only supported with the monthly resolution")
+    if input.quantiles and input.multi_category:
+        raise HTTPException(status_code=400, detail="quantiles are not supported with multi_category")
+    if input.engine not in FORECAST_MODEL_ENGINES:
+        raise HTTPException(status_code=400, detail=f"Invalid engine. Use one of: {', '.join(FORECAST_MODEL_ENGINES)}")
+    needs_per_user_model = bool(input.quantiles) or input.multi_category or input.resolution == "daily"
+    if input.engine == "global" and needs_per_user_model:
+        raise HTTPException(status_code=400, detail="The global engine does not support quantiles, multi_category or the daily resolution")
+    if input.engine == "global" and global_forecaster is None:
+        raise HTTPException(status_code=503, detail="The global forecasting model is not loaded")
+    use_global = global_forecaster is not None and input.engine != "per_user" and not needs_per_user_model
+
     try:
         historical_expenses = []
         # Try to use Firestore data for authenticated users
@@ -652,12 +927,60 @@ def forecast_expenses_new(input: ForecastRequestInput, user=Depends(optional_fir
                 
                 # --- Use Custom ML Model for Forecasting ---
                 if len(historical_expenses) >= 5: # Minimum data requirement for ML model
+                    # One predict call on the preloaded cross-user model (cheap enough to run before the
+                    # cache lookup, so the key names the engine that actually answers)
+                    global_result = global_forecaster.predict(historical_expenses, input.timeframe) if use_global else None
+                    if global_result is None and input.engine == "global":
+                        raise HTTPException(
+                            status_code=400,
+                            detail=f"The global model needs at least {GLOBAL_MIN_HISTORY_MONTHS} months of history"
+                        )
+                    engine = {"strategy": input.strategy, "multi_category": input.multi_category, "resolution": input.resolution,
+                              "global_model": global_forecaster.artifact["trained_at"] if global_result is not None else None,
+                              "quantiles": sorted(input.quantiles) if input.quantiles else None}
+                    # Fallback forecasts start at the current month, so it is part of the key
+                    cache_key = forecast_response_cache.make_key(
+                        user_id, compute_data_version(historical_expenses), input.category or "all",
+                        input.timeframe, engine, datetime.now().strftime("%Y-%m")
+                    )
+                    cached = _cached_forecast(cache_key, response, if_none_match)
+                    if cached is not None:
+                        return cached
+
                     logger.info("[Forecast] Using custom ML model for prediction.")
                     # The custom_expense_forecaster expects a list of dicts with 'timestamp' as datetime
-                    ml_forecast_result = forecaster.train_and_predict(historical_expenses, input.timeframe)
+                    if input.multi_category and (input.category == "all" or input.category is None):
+                        fitted, model_source = forecast_model_store.get_or_fit(
+                            user_id, "all", historical_expenses, forecaster, multi_category=True
+                        )
+                        logger.info(f"[Forecast] Multi-category model source: {model_source}")
+                        if fitted is not None:
+                            ml_forecast_result = forecaster.predict_multi_from_fitted(fitted, input.timeframe)
+                            category_forecasts = ml_forecast_result["category_forecasts"]
+                            return _store_forecast(cache_key, {
+                                "forecast": ml_forecast_result["forecast"],
+                                "category_forecasts": category_forecasts,
+                                "category_breakdown": {
+                                    cat: round(sum(item["predicted_amount"] for item in items) / len(items), 2)
+                                    for cat, items in category_forecasts.items() if items
+                                },
+                                "model_accuracy": ml_forecast_result["model_accuracy"],
+                                "category_accuracy": ml_forecast_result["category_accuracy"],
+                                "data_source": "custom_ml_model_multi_category",
+                                "model_source": model_source,
+                                "message": f"Forecast for {len(category_forecasts)} categories based on {len(historical_expenses)} transactions using one custom ML model.",
+                                "user_authenticated": user is not None
+                            }, response)
+
+                    # Per-user training only when the global model cannot answer
+                    if global_result is not None:
+                        ml_forecast_result, data_source, model_source = global_result, "global_ml_model", "global"
+                    else:
+                        ml_forecast_result, data_source, model_source = _per_user_forecast(
+                            user_id, input, historical_expenses, forecaster
+                        )
                     forecast_data = ml_forecast_result["forecast"]
                     model_accuracy = ml_forecast_result["model_accuracy"]
-                    data_source = "custom_ml_model"
                     message = f"Forecast based on {len(historical_expenses)} transactions using custom ML model."
 
                     # Re-calculate category breakdown based on historical distribution if 'all' categories requested
@@ -666,7 +989,7 @@ def forecast_expenses_new(input: ForecastRequestInput, user=Depends(optional_fir
                         category_totals = {}
                         total_historical_amount = 0
                         for expense in historical_expenses:
-                            cat = expense.get('category', 'other').lower()
+                            cat = canonicalize_category(expense.get('category'))
                             category_totals[cat] = category_totals.get(cat, 0) + expense.get('amount', 0)
                             total_historical_amount += expense.get('amount', 0)
                         
@@ -681,61 +1004,79 @@ def forecast_expenses_new(input: ForecastRequestInput, user=Depends(optional_fir
                         # If a specific category is requested, the ML model gives total for that category, so we just use that
                         category_breakdown[input.category] = sum(item["predicted_amount"] for item in forecast_data)
 
-                    return {
+                    result = {
                         "forecast": forecast_data,
                         "category_breakdown": category_breakdown,
                         "model_accuracy": model_accuracy,
                         "data_source": data_source,
+                        "model_source": model_source,
                         "message": message,
                         "user_authenticated": user is not None
                     }
+                    for key in ("current_month", "calibration"):
+                        if key in ml_forecast_result:
+                            result[key] = ml_forecast_result[key]
+                    return _store_forecast(cache_key, result, response)
                 else:
                     logger.warning(f"[Forecast] Insufficient Firestore data ({len(historical_expenses)} transactions) for custom ML, falling back to mock data.")
                     
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"[Forecast] Error using custom ML model: {e}, falling back to mock data.")
         
         # --- Fallback to Mock Data (or if Firestore failed/insufficient data) ---
-        import random
+        if input.quantiles:
+            raise HTTPException(status_code=422, detail=FORECAST_QUANTILES_UNAVAILABLE)
+        # Mock forecasts are seeded per user, category, timeframe and month, so they are cacheable too
+        current_month = datetime.now().strftime("%Y-%m")
+        mock_owner = user['user_id'] if user else "anonymous"
+        cache_key = forecast_response_cache.make_key(mock_owner, "mock", input.category or "all", input.timeframe, current_month)
+        cached = _cached_forecast(cache_key, response, if_none_match)
+        if cached is not None:
+            return cached
+
+        rng = np.random.default_rng(stable_seed(mock_owner, input.category or "all", input.timeframe, current_month))
         forecast_data = []
         base_amount = 1500  # Base monthly amount
         
         # Add some user-specific variation if authenticated
         if user:
-            user_id_hash = hash(user['user_id']) % 1000
-            base_amount += user_id_hash  # Vary base amount by user
+            base_amount += stable_seed(user['user_id']) % 1000  # Vary base amount by user
             data_source = "personalized_mock"
             message = f"Personalized forecast using sample data patterns. Add more transactions for data-driven predictions."
         else:
             data_source = "mock_data"
             message = "Forecast generated using sample data. Sign in to get personalized predictions based on your spending history."
         
-        for i in range(input.timeframe):
-            # Add some random variation to simulate realistic forecasting
-            variation = random.uniform(0.8, 1.2)
+        for future_date in future_month_starts(input.timeframe):
+            # Add some variation to simulate realistic forecasting
+            variation = rng.uniform(0.8, 1.2)
             amount = base_amount * variation
             
-            future_date = datetime.now() + timedelta(days=30 * (i + 1))
             forecast_data.append({
                 "date": future_date.strftime("%Y-%m-%d"),  # Full date format
                 "period": future_date.strftime("%Y-%m"),    # Month format
-                "predicted_amount": round(amount, 2),
+                "predicted_amount": round(float(amount), 2),
                 "category": input.category if input.category != "all" else "all",
-                "confidence": round(random.uniform(0.75, 0.95), 2)
+                "confidence": None
             })
         
         # Generate category breakdown for mock data
         category_breakdown = _get_default_category_breakdown(avg_predicted_monthly=sum(item["predicted_amount"] for item in forecast_data) / len(forecast_data) if forecast_data else base_amount)
         
-        return {
+        return _store_forecast(cache_key, {
             "forecast": forecast_data,
             "category_breakdown": category_breakdown,
-            "model_accuracy": round(random.uniform(0.75, 0.95), 3),
+            # Sample data has no accuracy to report; see forecast_backtest.py for measured accuracy
+            "model_accuracy": None,
             "data_source": data_source,
             "message": message,
             "user_authenticated": user is not None
-        }
+        }, response)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"[Forecast] Top-level error: {e}")
         raise HTTPException(status_code=500, detail=f"Forecast generation failed: {str(e)}")
@@ -743,18 +1084,19 @@ def forecast_expenses_new(input: ForecastRequestInput, user=Depends(optional_fir
 def _get_default_category_breakdown(avg_predicted_monthly: float) -> Dict[str, float]:
     """
     Helper to generate a default category breakdown for mock/fallback scenarios.
+    Seeded from the amount, so the same forecast always gets the same breakdown.
     """
-    import random
+    rng = np.random.default_rng(stable_seed(round(avg_predicted_monthly, 2)))
     categories = ["Food", "Transport", "Entertainment", "Shopping", "Bills", "Healthcare"]
     category_breakdown = {}
     remaining = avg_predicted_monthly
     for i, category in enumerate(categories[:-1]):
         # Distribute amounts across categories
-        percent = random.uniform(0.1, 0.25) # Slightly adjusted distribution
+        percent = rng.uniform(0.1, 0.25) # Slightly adjusted distribution
         amount = remaining * percent
-        category_breakdown[category.lower()] = round(amount, 2)
+        category_breakdown[category.lower()] = round(float(amount), 2)
         remaining -= amount
-    category_breakdown[categories[-1].lower()] = round(remaining, 2) # Assign remaining to last category
+    category_breakdown[categories[-1].lower()] = round(float(remaining), 2) # Assign remaining to last category
     return category_breakdown
 
 from fastapi import Query
@@ -856,7 +1198,7 @@ def compare_months_expenses(input: MonthComparisonInput, user=Depends(optional_f
                     by_category = {}
                     total = 0
                     for expense in expenses:
-                        category = expense.get('category', 'uncategorized')
+                        category = canonicalize_category(expense.get('category'))
                         all_categories.add(category)
                         if category not in by_category:
                             by_category[category] = 0
@@ -1111,22 +1453,39 @@ class GeminiTaxRequest(BaseModel):
     user_query: str
     form_data: Optional[Dict] = None
 
+def _tax_assistance_body(assistance: Dict[str, Any]) -> Dict[str, Any]:
+    """Response body of /api/tax/assist, also the `result` event of its streaming variant"""
+    return {"assistance": assistance}
+
 @app.post("/api/tax/assist")
-def get_gemini_tax_assistance(request: GeminiTaxRequest, user=Depends(optional_firebase_token)):
+async def get_gemini_tax_assistance(request: GeminiTaxRequest, http_request: Request, user=Depends(optional_firebase_token)):
     """Provides AI-powered assistance for a specific tax form field."""
     try:
         # Provide assistance even for unauthenticated users
-        assistance = gemini_tax_service.get_field_assistance(
+        assistance = await gemini_tax_service.get_field_assistance(
             form_id=request.form_id,
             field_id=request.field_id,
             user_query=request.user_query,
-            current_form_data=request.form_data
+            current_form_data=request.form_data,
+            http_request=http_request
         )
-        return {"assistance": assistance}
+        return _tax_assistance_body(assistance)
     except Exception as e:
         logger.error(f"Error getting Gemini tax assistance: {e}")
         raise HTTPException(status_code=500, detail="Failed to get AI assistance.")
 
+@app.post("/api/tax/assist/stream")
+def stream_gemini_tax_assistance(request: GeminiTaxRequest, user=Depends(optional_firebase_token)):
+    """Streaming /api/tax/assist: Server-Sent Events ending with a `result` event holding the /api/tax/assist body."""
+    events = gemini_tax_service.stream_field_assistance(
+        form_id=request.form_id,
+        field_id=request.field_id,
+        user_query=request.user_query,
+        current_form_data=request.form_data,
+        envelope=_tax_assistance_body
+    )
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
 # Gemini Form Search Endpoints
 
 class FormSearchRequest(BaseModel):
@@ -1147,7 +1506,7 @@ class FormFeatureSearchRequest(BaseModel):
     user_context: Optional[Dict[str, Any]] = None
 
 @app.post("/api/tax/search-forms")
-def search_tax_forms_with_ai(request: FormSearchRequest, user=Depends(optional_firebase_token)):
+async def search_tax_forms_with_ai(request: FormSearchRequest, http_request: Request, user=Depends(optional_firebase_token)):
     """
     Search tax forms using Gemini AI based on natural language query.
     
@@ -1165,10 +1524,11 @@ def search_tax_forms_with_ai(request: FormSearchRequest, user=Depends(optional_f
             enhanced_context['user_id'] = user.get('user_id')
         
         # Perform AI-powered form search
-        search_results = gemini_form_search_service.search_forms(
+        search_results = await gemini_form_search_service.search_forms(
             query=request.query,
             user_context=enhanced_context,
-            search_type=request.search_type
+            search_type=request.search_type,
+            http_request=http_request
         )
         
         return {
@@ -1183,7 +1543,7 @@ def search_tax_forms_with_ai(request: FormSearchRequest, user=Depends(optional_f
         raise HTTPException(status_code=500, detail="Failed to search forms with AI.")
 
 @app.post("/api/tax/discover-forms")
-def discover_forms_by_situation(request: FormDiscoveryRequest, user=Depends(optional_firebase_token)):
+async def discover_forms_by_situation(request: FormDiscoveryRequest, http_request: Request, user=Depends(optional_firebase_token)):
     """
     Discover tax forms based on user's description of their tax situation.
     
@@ -1203,9 +1563,10 @@ def discover_forms_by_situation(request: FormDiscoveryRequest, user=Depends(opti
             # This could integrate with existing user data analysis
         
         # Perform semantic form discovery
-        discovery_results = gemini_form_search_service.semantic_form_discovery(
+        discovery_results = await gemini_form_search_service.semantic_form_discovery(
             user_description=request.user_description,
-            user_profile=enhanced_profile
+            user_profile=enhanced_profile,
+            http_request=http_request
         )
         
         return {
@@ -1219,7 +1580,7 @@ def discover_forms_by_situation(request: FormDiscoveryRequest, user=Depends(opti
         raise HTTPException(status_code=500, detail="Failed to discover forms.")
 
 @app.post("/api/tax/forms/compare")
-def compare_tax_forms_with_ai(request: FormComparisonRequest, user=Depends(optional_firebase_token)):
+async def compare_tax_forms_with_ai(request: FormComparisonRequest, http_request: Request, user=Depends(optional_firebase_token)):
     """
     Compare specific tax forms using AI analysis.
     
@@ -1236,9 +1597,10 @@ def compare_tax_forms_with_ai(request: FormComparisonRequest, user=Depends(optio
             raise HTTPException(status_code=400, detail="Maximum 4 forms can be compared at once.")
         
         # Perform AI-powered form comparison
-        comparison_results = gemini_form_search_service.compare_forms(
+        comparison_results = await gemini_form_search_service.compare_forms(
             form_ids=request.form_ids,
-            comparison_context=request.comparison_context
+            comparison_context=request.comparison_context,
+            http_request=http_request
         )
         
         return {
@@ -1253,7 +1615,7 @@ def compare_tax_forms_with_ai(request: FormComparisonRequest, user=Depends(optio
         raise HTTPException(status_code=500, detail="Failed to compare forms.")
 
 @app.post("/api/tax/forms/find-by-features")
-def find_forms_by_features(request: FormFeatureSearchRequest, user=Depends(optional_firebase_token)):
+async def find_forms_by_features(request: FormFeatureSearchRequest, http_request: Request, user=Depends(optional_firebase_token)):
     """
     Find tax forms that support specific features or capabilities.
     
@@ -1273,9 +1635,10 @@ def find_forms_by_features(request: FormFeatureSearchRequest, user=Depends(optio
             enhanced_context['user_id'] = user.get('user_id')
         
         # Find forms by features
-        feature_results = gemini_form_search_service.find_forms_by_features(
+        feature_results = await gemini_form_search_service.find_forms_by_features(
             required_features=request.required_features,
-            user_context=enhanced_context
+            user_context=enhanced_context,
+            http_request=http_request
         )
         
         return {
@@ -1301,10 +1664,11 @@ def check_form_search_health():
     try:
         return {
             "service_enabled": gemini_form_search_service.enabled,
-            "forms_in_knowledge_base": len(gemini_form_search_service.form_knowledge_base.split('\n')),
+            "forms_in_knowledge_base": len(gemini_form_search_service.form_records),
             "available_search_types": list(gemini_form_search_service.search_prompts.keys()),
             "status": "healthy" if gemini_form_search_service.enabled else "disabled",
-            "message": "Gemini Form Search Service is ready" if gemini_form_search_service.enabled else "AI search disabled - check GEMINI_API_KEY"
+            "message": "Gemini Form Search Service is ready" if gemini_form_search_service.enabled else "AI search disabled - check GEMINI_API_KEY",
+            "prompt_stats": gemini_form_search_service.prompt_stats()
         }
         
     except Exception as e:
@@ -1317,9 +1681,20 @@ def check_form_search_health():
 
 # Investment Learning Content Generation Endpoints
 
+def _learning_content_body(content: Dict[str, Any]) -> Dict[str, Any]:
+    """Response body of /api/learning/generate-content, also the `result` event of its streaming variant"""
+    return {
+        "status": "success",
+        "content": content,
+        "personalized": content.get("personalized", False),
+        "generated_at": content.get("generated_at"),
+        "message": "Content generated successfully"
+    }
+
 @app.post("/api/learning/generate-content")
 async def generate_learning_content(
     request: ContentRequest,
+    http_request: Request,
     user=Depends(optional_firebase_token)
 ):
     """
@@ -1334,15 +1709,9 @@ async def generate_learning_content(
             # and update the request.user_profile accordingly
         
         # Generate personalized content
-        content = await gemini_service.generate_personalized_content(request)
+        content = await gemini_service.generate_personalized_content(request, http_request)
         
-        return {
-            "status": "success",
-            "content": content,
-            "personalized": content.get("personalized", False),
-            "generated_at": content.get("generated_at"),
-            "message": "Content generated successfully"
-        }
+        return _learning_content_body(content)
         
     except Exception as e:
         logger.error(f"Error generating learning content: {e}")
@@ -1351,6 +1720,21 @@ async def generate_learning_content(
             detail=f"Failed to generate content: {str(e)}"
         )
 
+@app.post("/api/learning/generate-content/stream")
+def stream_learning_content(
+    request: ContentRequest,
+    user=Depends(optional_firebase_token)
+):
+    """
+    Streaming /api/learning/generate-content: Server-Sent Events with text deltas and
+    each content section as it completes, ending with a `result` event holding the
+    /api/learning/generate-content body
+    """
+    if gemini_service is None:
+        raise HTTPException(status_code=503, detail="Content generation service is unavailable")
+    events = gemini_service.stream_personalized_content(request, envelope=_learning_content_body)
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.get("/api/learning/topics/{level}")
 async def get_learning_topics(level: str):
     """
@@ -1587,10 +1971,12 @@ def add_sample_transactions(user=Depends(optional_firebase_token)):
         added_transactions = []
         for transaction in sample_transactions:
             transaction_id = firestore_service.add_transaction(user_id, transaction)
+            record_transaction_rollups(user_id, transaction, transaction_id, invalidate_summaries=False)
             added_transactions.append({
                 "id": transaction_id,
                 **transaction
             })
+        invalidate_spending_summaries(user_id)
         
         return {
             "message": f"Successfully added {len(added_transactions)} sample transactions",
@@ -1618,17 +2004,38 @@ def add_transaction(transaction: TransactionInput, user=Depends(optional_firebas
         transaction_data = transaction.dict()
         
         transaction_id = firestore_service.add_transaction(user_id, transaction_data)
+        anomaly = record_transaction_rollups(user_id, transaction_data, transaction_id)
         
         return {
             "message": "Transaction added successfully",
             "transaction_id": transaction_id,
-            "transaction": transaction_data
+            "transaction": transaction_data,
+            "anomaly": anomaly
         }
         
     except Exception as e:
         print(f"Error adding transaction: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to add transaction: {str(e)}")
 
+class TransactionRollupSync(BaseModel):
+    transaction_id: str
+    previous: Optional[Dict[str, Any]] = None  # Stored values before an edit or delete
+    current: Optional[Dict[str, Any]] = None  # Stored values after an add or edit
+
+@app.post("/api/transactions/sync-rollups")
+def sync_rollups(sync: TransactionRollupSync, user=Depends(optional_firebase_token)):
+    """
+    Update anomaly and distribution rollups for a transaction the frontend wrote
+    directly to Firestore (add, edit or delete), which never passes through /add.
+    """
+    if not user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    if sync.previous is None and sync.current is None:
+        raise HTTPException(status_code=400, detail="previous or current is required")
+    
+    anomaly = sync_transaction_rollups(user['user_id'], sync.transaction_id, sync.previous, sync.current)
+    return {"status": "success", "anomaly": anomaly}
+
 @app.get("/api/transactions/list/{user_id}")
 def list_user_transactions(user_id: str, user=Depends(optional_firebase_token)):
     """
@@ -1766,7 +2173,7 @@ async def import_parsed_transactions(request: TransactionImportRequest):
                 transaction = {
                     'amount': float(transaction_data['amount']),
                     'description': transaction_data['description'],
-                    'category': transaction_data.get('category', 'other'),
+                    'category': canonicalize_category(transaction_data.get('category')),
                     'subcategory': transaction_data.get('subcategory', ''),
                     'payment_method': transaction_data.get('payment_method', 'bank_transfer'),
                     'date': transaction_data['date'],
@@ -1779,7 +2186,13 @@ async def import_parsed_transactions(request: TransactionImportRequest):
                 }
                 
                 # Add transaction to Firestore
-                firestore_service.add_transaction(request.user_id, transaction)
+                transaction_id = firestore_service.add_transaction(request.user_id, transaction)
+                record_transaction_rollups(
+                    request.user_id,
+                    {**transaction, 'type': transaction_data.get('transaction_type', 'expense')},
+                    transaction_id,
+                    invalidate_summaries=False
+                )
                 imported_count += 1
                 
             except Exception as e:
@@ -1787,6 +2200,9 @@ async def import_parsed_transactions(request: TransactionImportRequest):
                 errors.append(f"Failed to import transaction '{transaction_data.get('description', 'Unknown')}': {str(e)}")
                 logger.error(f"Error importing transaction: {e}")
         
+        if imported_count:
+            invalidate_spending_summaries(request.user_id)
+        
         return TransactionImportResponse(
             success=True,
             message=f"Successfully imported {imported_count} transactions",
@@ -2277,18 +2693,36 @@ def update_user_profile(
     return data
 
 @app.get("/api/tax/ai-filing-guide")
-def get_ai_filing_guide(form_id: str):
+async def get_ai_filing_guide(form_id: str, http_request: Request):
     """
     Generate a step-by-step AI-powered tax filing guide for the given form_id.
     Returns: { guide: [ ...steps... ] }
     """
     # Use the new dedicated guide service
-    return gemini_tax_guide_service.generate_filing_guide(form_id)
+    return await gemini_tax_guide_service.generate_filing_guide(form_id, http_request)
+
+@app.get("/api/tax/ai-filing-guide/stream")
+def stream_ai_filing_guide(form_id: str):
+    """
+    Streaming /api/tax/ai-filing-guide: Server-Sent Events with each step as it is generated,
+    ending with a `result` event holding { guide: [ ...steps... ] }
+    """
+    events = gemini_tax_guide_service.stream_filing_guide(form_id)
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
 
 @app.get("/api/tax/glossary/explain")
-def explain_tax_term(term: str):
+async def explain_tax_term(term: str, http_request: Request):
     """
     Provides a detailed and easy-to-understand explanation for a given tax term.
     """
-    return gemini_glossary_service.get_explanation(term)
+    return await gemini_glossary_service.get_explanation(term, http_request)
+
+@app.get("/api/ai/status")
+def ai_status():
+    """Gemini response cache hit rate and upstream call statistics"""
+    return {
+        "status": "success",
+        "cache": llm_response_cache.stats(),
+        "llm": llm_client.status()
+    }
 
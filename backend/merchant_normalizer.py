@@ -0,0 +1,92 @@
+"""
+Merchant normalization and a merchant -> category cache.
+
+Bank narrations for the same merchant differ only in payment-rail prefixes,
+reference numbers, VPAs and dates (UPI-SWIGGY-SWIGGY8@YBL-YESB0YBLUPI-4123...,
+UPI/DR/4123.../SWIGGY/...). merchant_key() reduces them to a canonical key such as
+"swiggy", and MerchantCategoryCache remembers the category computed for each key,
+so an import with thousands of rows categorizes every merchant once. The lookup
+and grouping of rows by merchant live in categorization_service, the only user.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+MAX_KEY_TOKENS = 4
+
+# Whole tokens made only of letters (plus . & ' inside); a token touching a digit is a
+# reference, account, card or IFSC code, or a date, and never matches
+_WORD = re.compile(r"(?<![a-z0-9@])([a-z][a-z.&']*[a-z])(?![a-z0-9@])")
+# Possessive quantifiers: a run that is not followed by '@' fails at once instead of backtracking
+_VPA = re.compile(r"(?<![a-z0-9._])([a-z]*+)[a-z0-9._]*+@[a-z0-9.]*+")
+
+# Payment rails, narration boilerplate and VPA handles; none of them identify a merchant
+NOISE_TOKENS = frozenset({
+    'upi', 'neft', 'imps', 'rtgs', 'ach', 'nach', 'ecs', 'pos', 'mb', 'ib', 'inb', 'bil', 'billpay',
+    'dr', 'cr', 'ref', 'refno', 'txn', 'utr', 'rrn', 'p2m', 'p2a', 'collect', 'request', 'pay',
+    'payment', 'paid', 'to', 'from', 'by', 'via', 'for', 'the', 'of', 'inr', 'rs',
+    'ltd', 'pvt', 'private', 'limited', 'india', 'ybl', 'ibl', 'axl', 'okaxis', 'oksbi', 'okicici',
+    'okhdfcbank', 'apl', 'na',
+    # IFSC bank prefixes that narrations print on their own (YESB, SBIN, ...)
+    'yesb', 'sbin', 'icic', 'utib', 'kkbk', 'punb', 'barb', 'ubin', 'cnrb', 'idib', 'ioba', 'fdrl', 'indb',
+    # Billing-period months (SALARY JAN 2024)
+    'jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+})
+
+
+def merchant_key(description: str) -> str:
+    """
+    Canonical merchant key: lowercase, rail prefixes, reference numbers and dates removed.
+    A VPA contributes its handle without digits (swiggy8@ybl -> swiggy). Returns "" when
+    nothing identifying is left, e.g. a narration made only of numbers.
+    """
+    text = str(description).lower()
+    if '@' in text:
+        text = _VPA.sub(r" \1 ", text)
+    tokens = [token for token in _WORD.findall(text) if token not in NOISE_TOKENS and token.strip('x')]
+    return " ".join(list(dict.fromkeys(tokens))[:MAX_KEY_TOKENS])
+
+
+class MerchantCategoryCache:
+    """
+    Bounded LRU of merchant key -> category (or any per-merchant result, e.g. a
+    (category, confidence) pair). `namespace` separates results of different
+    categorizers or model versions sharing one cache; stale namespaces age out
+    through the LRU.
+    """
+
+    def __init__(self, max_entries: int = 50_000):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str, namespace: str = "") -> Optional[Any]:
+        with self._lock:
+            value = self._cache.get((namespace, key))
+            if value is None:
+                self._counts["misses"] += 1
+                return None
+            self._cache.move_to_end((namespace, key))
+            self._counts["hits"] += 1
+            return value
+
+    def put(self, key: str, value: Any, namespace: str = ""):
+        with self._lock:
+            self._cache[(namespace, key)] = value
+            self._cache.move_to_end((namespace, key))
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["misses"]
+            return {
+                **self._counts,
+                "size": len(self._cache),
+                "max_entries": self.max_entries,
+                "hit_rate": round(self._counts["hits"] / lookups, 4) if lookups else None
+            }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from pydantic import BaseModel
@@ -25,6 +25,11 @@ class Expense(Base):
     user_id = Column(Integer, ForeignKey('users.id'))
     owner = relationship('User', back_populates='expenses')
 
+    # Spending queries always filter by user and a timestamp range
+    __table_args__ = (
+        Index('ix_expenses_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
 # Pydantic models for bank statement upload
 class ParsedTransaction(BaseModel):
     date: str
@@ -0,0 +1,358 @@
+"""
+Online expense classifier that learns from users' category corrections.
+
+Descriptions are hashed into a fixed number of features (HashingVectorizer), so
+memory does not grow with the vocabulary, and an SGD logistic regression is
+updated with partial_fit. Corrections are queued and applied in micro-batches,
+either when a batch fills up or by the background flusher. Every user also has a
+bounded override table (normalized description -> category) that is checked
+before the shared model, so a user's own corrections apply immediately. Model and
+overrides are snapshotted to disk periodically and on shutdown.
+
+Every server worker process keeps its own copy and they share one snapshot file.
+A snapshot merges instead of overwriting: under a file lock, the examples and
+overrides this worker took since its last snapshot are applied on top of what is
+on disk, and the worker adopts the merged result. Workers without corrections of
+their own reload the file when another worker has changed it.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: the single-process dev server needs no cross-process lock
+    fcntl = None
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from categorization_service import CANONICAL_CATEGORIES
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.getenv("ONLINE_CLASSIFIER_PATH", os.path.join("model_store", "online_expense_classifier.joblib"))
+SNAPSHOT_FORMAT = 1
+# Examples learned since the last snapshot that are kept for merging; older ones only live in this worker's model
+MAX_UNSAVED_EXAMPLES = 20000
+
+# Categories the shared model can learn; corrections to anything else only become user overrides
+ONLINE_CATEGORIES = CANONICAL_CATEGORIES
+
+
+def normalize_description(description: str) -> str:
+    """Lowercase, digits (references, amounts, dates) dropped, whitespace collapsed"""
+    return re.sub(r"\s+", " ", re.sub(r"\d+", " ", str(description).lower())).strip()
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Exclusive lock shared by every process using the same path"""
+    with open(path, "a") as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class OnlineExpenseClassifier:
+    """HashingVectorizer + SGDClassifier updated incrementally from corrections"""
+
+    def __init__(self, snapshot_path: str = SNAPSHOT_PATH, n_features: int = 2 ** 16,
+                 batch_size: int = 64, flush_interval: float = 30.0, snapshot_interval: float = 300.0,
+                 min_examples: int = 200, max_overrides_per_user: int = 1000, max_users: int = 10000):
+        self.snapshot_path = snapshot_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.min_examples = min_examples
+        self.max_overrides_per_user = max_overrides_per_user
+        self.max_users = max_users
+        self.classes = np.array(sorted(ONLINE_CATEGORIES))
+        # Stateless: nothing to fit or store, memory is fixed by n_features
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, ngram_range=(1, 2),
+                                            preprocessor=normalize_description)
+        # Averaged SGD: plain SGD's early steps are large enough to flip classes between micro-batches
+        self.model = SGDClassifier(loss='log_loss', alpha=1e-5, average=True, random_state=42)
+        self.examples_seen = 0
+        self.overrides: "OrderedDict[str, OrderedDict[str, str]]" = OrderedDict()
+        self.stats = {"corrections": 0, "ignored_categories": 0, "batches": 0, "snapshots": 0,
+                      "override_hits": 0, "model_predictions": 0}
+
+        self._pending: List[Tuple[str, str]] = []
+        # Learned or set since the last snapshot, replayed onto the file's state when merging
+        self._unsaved_examples: List[Tuple[str, str]] = []
+        self._unsaved_overrides: Dict[str, Dict[str, str]] = {}
+        self._snapshot_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._last_snapshot = time.monotonic()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._load()
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether the shared model has seen enough examples to be preferred over the static classifier"""
+        return self.examples_seen >= self.min_examples
+
+    # ------------------------------------------------------------------
+    # Learning
+    # ------------------------------------------------------------------
+
+    def learn(self, descriptions: List[str], categories: List[str]) -> int:
+        """partial_fit on labelled examples (e.g. seed data); unknown categories are skipped"""
+        pairs = [(d, c) for d, c in zip(descriptions, categories) if c in ONLINE_CATEGORIES]
+        if not pairs:
+            return 0
+        X = self.vectorizer.transform([d for d, _ in pairs])
+        with self._model_lock:
+            self.model.partial_fit(X, [c for _, c in pairs], classes=self.classes)
+            self.examples_seen += len(pairs)
+            self._unsaved_examples.extend(pairs)
+            del self._unsaved_examples[:-MAX_UNSAVED_EXAMPLES]
+        self._dirty = True
+        return len(pairs)
+
+    def record_correction(self, user_id: Optional[str], description: str, category: str):
+        """
+        Queue a user's correction for the next micro-batch. The user's override takes
+        effect immediately; the shared model learns it when the batch is applied.
+        """
+        category = str(category).strip().lower()
+        if user_id:
+            self._set_override(user_id, description, category)
+        with self._lock:
+            self.stats["corrections"] += 1
+            if category not in ONLINE_CATEGORIES:
+                self.stats["ignored_categories"] += 1
+                return
+            self._pending.append((description, category))
+            due = len(self._pending) >= self.batch_size
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """Apply queued corrections as one partial_fit; snapshot when the interval has passed"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        applied = self.learn([d for d, _ in batch], [c for _, c in batch]) if batch else 0
+        if applied:
+            self.stats["batches"] += 1
+        if time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+            if self._dirty:
+                self.snapshot()
+            else:
+                self._reload_if_changed()
+        return applied
+
+    def _set_override(self, user_id: str, description: str, category: str):
+        key = normalize_description(description)
+        with self._lock:
+            self._put_override(self.overrides, user_id, key, category)
+            self._unsaved_overrides.setdefault(user_id, {})[key] = category
+            self._dirty = True
+
+    def _put_override(self, overrides: "OrderedDict[str, OrderedDict[str, str]]", user_id: str, key: str,
+                      category: str):
+        """Set one override in a table of tables, evicting the least recently corrected entries and users"""
+        table = overrides.get(user_id)
+        if table is None:
+            table = overrides[user_id] = OrderedDict()
+        overrides.move_to_end(user_id)
+        table[key] = category
+        table.move_to_end(key)
+        while len(table) > self.max_overrides_per_user:
+            table.popitem(last=False)
+        while len(overrides) > self.max_users:
+            overrides.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # Prediction
+    # ------------------------------------------------------------------
+
+    def lookup_overrides(self, user_id: Optional[str], descriptions: List[str]) -> List[Optional[str]]:
+        if not user_id:
+            return [None] * len(descriptions)
+        with self._lock:
+            table = self.overrides.get(user_id)
+            if not table:
+                return [None] * len(descriptions)
+            found = [table.get(normalize_description(d)) for d in descriptions]
+        self.stats["override_hits"] += sum(category is not None for category in found)
+        return found
+
+    def predict_batch(self, descriptions: List[str]) -> Tuple[List[str], np.ndarray]:
+        """Shared-model categories and probabilities: one transform and one predict_proba"""
+        X = self.vectorizer.transform(descriptions)
+        with self._model_lock:
+            probabilities = self.model.predict_proba(X)
+            classes = self.model.classes_
+        best = probabilities.argmax(axis=1)
+        self.stats["model_predictions"] += len(descriptions)
+        return classes[best].tolist(), probabilities[np.arange(len(best)), best]
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def snapshot(self):
+        """
+        Merge this worker's unsaved examples and overrides into the snapshot on disk and
+        write it back (write then rename), then adopt the merged model and overrides.
+        The file lock makes read-merge-write atomic across worker processes; the
+        in-process locks keep learning from slipping in between merge and adoption.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            with _file_lock(f"{self.snapshot_path}.lock"), self._lock, self._model_lock:
+                model, examples_seen, overrides = self._merge(self._read_snapshot())
+                state = {
+                    "format": SNAPSHOT_FORMAT,
+                    "saved_at": datetime.now().isoformat(),
+                    "n_features": self.vectorizer.n_features,
+                    "model": model if examples_seen else None,
+                    "examples_seen": examples_seen,
+                    "overrides": {user: dict(table) for user, table in overrides.items()}
+                }
+                tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+                joblib.dump(state, tmp_path)
+                os.replace(tmp_path, self.snapshot_path)
+
+                self.model, self.examples_seen, self.overrides = model, examples_seen, overrides
+                self._unsaved_examples, self._unsaved_overrides = [], {}
+                self._snapshot_mtime = os.path.getmtime(self.snapshot_path)
+                self._dirty = False
+                self._last_snapshot = time.monotonic()
+            self.stats["snapshots"] += 1
+        except Exception as e:
+            logger.warning(f"Could not snapshot online classifier to {self.snapshot_path}: {e}")
+
+    def _merge(self, state: Optional[Dict[str, Any]]):
+        """
+        (model, examples_seen, overrides) of the state on disk with this worker's unsaved
+        examples partial_fit onto its model and unsaved overrides set in its tables.
+        Without a usable file, this worker's own state is the merge.
+        """
+        if state is None:
+            return self.model, self.examples_seen, self.overrides
+
+        model, examples_seen = state["model"], state["examples_seen"]
+        if model is None:
+            # No other worker has learned anything yet
+            model, examples_seen = self.model, self.examples_seen
+        elif self._unsaved_examples:
+            X = self.vectorizer.transform([d for d, _ in self._unsaved_examples])
+            model.partial_fit(X, [c for _, c in self._unsaved_examples], classes=self.classes)
+            examples_seen += len(self._unsaved_examples)
+
+        overrides = state["overrides"]
+        for user_id, table in self._unsaved_overrides.items():
+            for key, category in table.items():
+                self._put_override(overrides, user_id, key, category)
+        return model, examples_seen, overrides
+
+    def _read_snapshot(self) -> Optional[Dict[str, Any]]:
+        """
+        The snapshot on disk with overrides as OrderedDicts, or None when it is missing or
+        incompatible. A model trained on another category set is dropped (partial_fit cannot
+        add classes), so only the overrides are kept.
+        """
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            state = joblib.load(self.snapshot_path)
+        except Exception as e:
+            logger.warning(f"Could not load online classifier snapshot {self.snapshot_path}: {e}")
+            return None
+        if state.get("format") != SNAPSHOT_FORMAT or state.get("n_features") != self.vectorizer.n_features:
+            logger.warning(f"Ignoring online classifier snapshot {self.snapshot_path}: incompatible format")
+            return None
+        model = state.get("model")
+        if model is not None and list(model.classes_) != list(self.classes):
+            logger.warning(f"Online classifier snapshot {self.snapshot_path} has other categories; retraining the model")
+            model = None
+        return {
+            "model": model,
+            "examples_seen": state.get("examples_seen", 0) if model is not None else 0,
+            "overrides": OrderedDict((user, OrderedDict(table)) for user, table in state.get("overrides", {}).items())
+        }
+
+    def _load(self):
+        state = self._read_snapshot()
+        if state is None:
+            return
+        if state["model"] is not None:
+            self.model, self.examples_seen = state["model"], state["examples_seen"]
+        self.overrides = state["overrides"]
+        self._snapshot_mtime = os.path.getmtime(self.snapshot_path)
+
+    def _reload_if_changed(self):
+        """Pick up what other workers snapshotted; only called with nothing unsaved here"""
+        self._last_snapshot = time.monotonic()
+        try:
+            if os.path.getmtime(self.snapshot_path) == self._snapshot_mtime:
+                return
+        except OSError:
+            return
+        with _file_lock(f"{self.snapshot_path}.lock"), self._lock, self._model_lock:
+            if not self._dirty:
+                self._load()
+
+    # ------------------------------------------------------------------
+    # Background flushing
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Flush queued corrections every flush_interval seconds in a daemon thread"""
+        if self._flusher is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Online classifier flush failed: {e}")
+
+        self._flusher = threading.Thread(target=run, name="online-classifier-flush", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """Stop the flusher, apply what is queued and snapshot"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        self.flush()
+        if self._dirty:
+            self.snapshot()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+            users = len(self.overrides)
+        return {
+            "ready": self.is_ready,
+            "examples_seen": self.examples_seen,
+            "pending_corrections": pending,
+            "users_with_overrides": users,
+            "n_features": self.vectorizer.n_features,
+            **self.stats
+        }
@@ -1,11 +1,29 @@
 from typing import List, Dict, Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import pandas as pd
+from google.cloud import firestore
+from sqlalchemy import case, extract, func, select
 from sqlalchemy.orm import Session
 from models import Expense, User
 import numpy as np
 from collections import defaultdict
 from firestore_service import FirestoreService
+from spending_trends import dense_daily_series, estimate_trend, rolling_mean
+from categorization_service import canonicalize_category
+
+def parse_transaction_date(date_str: str) -> Optional[datetime]:
+    """
+    Parse a stored transaction date into a naive UTC datetime, or None if unparseable.
+    The frontend stores dates as UTC ISO strings ('...Z'), so the live and batch paths
+    must normalize them the same way to land transactions on the same day.
+    """
+    try:
+        parsed = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
 
 class SpendingAnalysisService:
     """
@@ -13,14 +31,16 @@ class SpendingAnalysisService:
     into user financial behavior and patterns.
     """
     
+    # Firestore collection holding summaries written by the nightly batch job
+    PRECOMPUTED_COLLECTION = 'spendingSummaries'
+    PERIODS = ("week", "month", "quarter", "year")
+    
     def __init__(self, db: Session, firestore_service: FirestoreService = None):
         self.db = db
         self.firestore_service = firestore_service
-        
-    def get_spending_summary(self, user_id: str, period: str = "month") -> Dict:
-        """
-        Get comprehensive spending summary for a user, using Firestore as the primary data source.
-        """
+
+    def _get_period_bounds(self, period: str):
+        """Return (start_date, end_date) for an analysis period"""
         end_date = datetime.now()
         
         if period == "week":
@@ -31,6 +51,20 @@ class SpendingAnalysisService:
             start_date = end_date - timedelta(days=90)
         else:  # year
             start_date = end_date - timedelta(days=365)
+        
+        return start_date, end_date
+
+    def get_spending_summary(self, user_id: str, period: str = "month", use_precomputed: bool = False) -> Dict:
+        """
+        Get comprehensive spending summary for a user, using Firestore as the primary data source.
+        When use_precomputed is set, a fresh summary written by the batch job is returned instead.
+        """
+        if use_precomputed:
+            precomputed = self.get_precomputed_summary(user_id, period)
+            if precomputed:
+                return precomputed['summary']
+        
+        start_date, end_date = self._get_period_bounds(period)
 
         expenses = []
         if self.firestore_service and self.firestore_service.db:
@@ -42,17 +76,9 @@ class SpendingAnalysisService:
                 expenses = []
                 for doc in docs:
                     data = doc.to_dict()
-                    # Parse date for filtering
                     date_str = data.get('date', '')
-                    try:
-                        if date_str:
-                            if 'T' in date_str:
-                                doc_date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                            else:
-                                doc_date = datetime.fromisoformat(date_str)
-                        else:
-                            continue
-                    except:
+                    doc_date = parse_transaction_date(date_str)
+                    if doc_date is None:
                         continue
                     
                     # Apply date filter in memory
@@ -74,34 +100,13 @@ class SpendingAnalysisService:
                 print(f"Error in spending analysis Firestore query: {e}")
                 expenses = []
         else:
-            # Fallback to legacy database if Firestore is not available
-            db_expenses = self.db.query(Expense).filter(
-                Expense.user_id == user_id,
-                Expense.timestamp >= start_date,
-                Expense.timestamp <= end_date
-            ).all()
-            # Convert to dictionary format to match Firestore's output
-            for exp in db_expenses:
-                expenses.append({
-                    'amount': exp.amount,
-                    'category': exp.category,
-                    'date': exp.timestamp.isoformat(),
-                    'description': exp.description,
-                    'timestamp': exp.timestamp
-                })
+            # Fallback to legacy database if Firestore is not available.
+            # Aggregation is pushed into SQL so only grouped rows are transferred.
+            return self._summary_from_sql(user_id, start_date, end_date)
         
         if not expenses:
             # Return full structure with safe defaults
-            return {
-                "total_spent": 0.0,
-                "transaction_count": 0,
-                "average_transaction": 0.0,
-                "categories": {},
-                "daily_average": 0.0,
-                "trends": {},
-                "top_merchants": [],
-                "spending_patterns": {}
-            }
+            return self._empty_summary()
             
         # The data from Firestore is a list of dicts, which is what we need.
         # The fallback logic now also produces a list of dicts.
@@ -123,9 +128,22 @@ class SpendingAnalysisService:
             "spending_patterns": self._analyze_patterns(df)
         }
     
+    def _empty_summary(self) -> Dict:
+        """Summary structure with safe defaults for users without transactions"""
+        return {
+            "total_spent": 0.0,
+            "transaction_count": 0,
+            "average_transaction": 0.0,
+            "categories": {},
+            "daily_average": 0.0,
+            "trends": {},
+            "top_merchants": [],
+            "spending_patterns": {}
+        }
+    
     def _analyze_categories(self, df: pd.DataFrame) -> Dict:
         """Analyze spending by categories"""
-        category_summary = df.groupby('category')['amount'].agg([
+        category_summary = df.groupby(df['category'].map(canonicalize_category))['amount'].agg([
             'sum', 'count', 'mean', 'std'
         ]).round(2)
         
@@ -145,18 +163,19 @@ class SpendingAnalysisService:
     
     def _analyze_trends(self, df: pd.DataFrame) -> Dict:
         """Analyze spending trends over time"""
-        df['date_only'] = df['date'].dt.date
-        daily_spending = df.groupby('date_only')['amount'].sum()
-        
-        if len(daily_spending) < 2:
+        if df['date'].dt.normalize().nunique() < 2:
             return {"trend": "insufficient_data"}
+        
+        # Zero-filled daily series so days without spend don't skew the trend
+        _, daily_spending = dense_daily_series(df['date'], df['amount'])
+        trend = estimate_trend(daily_spending, "ols", extra_methods=("theil_sen",))
             
-        # Calculate moving average
-        if len(daily_spending) >= 7:
-            moving_avg = daily_spending.rolling(window=7).mean()
-            recent_trend = moving_avg.iloc[-3:].mean() - moving_avg.iloc[-7:-4].mean()
+        # Calculate moving average (13 days gives full 7-day windows for both comparison points)
+        if len(daily_spending) >= 13:
+            moving_avg = rolling_mean(daily_spending, 7)
+            recent_trend = moving_avg[-3:].mean() - moving_avg[-7:-4].mean()
         else:
-            recent_trend = daily_spending.iloc[-1] - daily_spending.iloc[0]
+            recent_trend = daily_spending[-1] - daily_spending[0]
             
         # Day of week analysis
         df['day_of_week'] = df['date'].dt.day_name()
@@ -165,6 +184,8 @@ class SpendingAnalysisService:
         return {
             "trend_direction": "increasing" if recent_trend > 0 else "decreasing",
             "trend_magnitude": abs(float(recent_trend)),
+            "daily_slope": trend["slope_ols"],
+            "robust_daily_slope": trend["slope_theil_sen"],
             "highest_spending_day": dow_spending.idxmax(),
             "weekend_vs_weekday": self._weekend_weekday_comparison(df),
             "monthly_pattern": self._monthly_pattern(df)
@@ -272,7 +293,11 @@ class SpendingAnalysisService:
         # 3. Frequency of small transactions
         small_tx_pct = len(df[df['amount'] < df['amount'].median()]) / len(df)
         
-        # Weighted score (0-100)
+        return self._impulse_score_from_stats(amount_cv, evening_pct, weekend_pct, small_tx_pct)
+    
+    def _impulse_score_from_stats(self, amount_cv: float, evening_pct: float,
+                                  weekend_pct: float, small_tx_pct: float) -> float:
+        """Weighted impulse score (0-100) from precomputed behaviour ratios"""
         impulse_score = min(100, (
             amount_cv * 30 +
             evening_pct * 25 +
@@ -280,13 +305,188 @@ class SpendingAnalysisService:
             small_tx_pct * 20
         ))
         
-        return round(impulse_score, 1)
+        return round(float(impulse_score), 1)
+    
+    # SQL-side aggregation for the legacy SQLAlchemy path
+    
+    def _expense_filters(self, user_id: str, start_date: datetime, end_date: datetime, category: str = None) -> List:
+        filters = [
+            Expense.user_id == user_id,
+            Expense.timestamp >= start_date,
+            Expense.timestamp <= end_date
+        ]
+        if category:
+            filters.append(Expense.category == category)
+        return filters
+    
+    def get_daily_totals_sql(self, user_id: str, start_date: datetime, end_date: datetime,
+                             category: str = None) -> pd.DataFrame:
+        """Daily spending totals computed with GROUP BY date(timestamp) in the database"""
+        day = func.date(Expense.timestamp).label('day')
+        stmt = (
+            select(day, func.sum(Expense.amount).label('amount'))
+            .where(*self._expense_filters(user_id, start_date, end_date, category))
+            .group_by(day)
+            .order_by(day)
+        )
+        rows = self.db.execute(stmt).all()
+        df = pd.DataFrame(rows, columns=['date', 'amount'])
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+    
+    def _summary_from_sql(self, user_id: str, start_date: datetime, end_date: datetime) -> Dict:
+        """
+        Build the spending summary from GROUP BY (date, hour, category) aggregates.
+        Each aggregate row stands in for all transactions in that bucket, so the
+        time-based helpers work on it unchanged; per-transaction statistics
+        (std, size buckets, median) are derived from SQL sums instead.
+        """
+        filters = self._expense_filters(user_id, start_date, end_date)
+        day = func.date(Expense.timestamp).label('day')
+        hour = extract('hour', Expense.timestamp).label('hour')
+        category = func.coalesce(Expense.category, 'uncategorized').label('category')
+        
+        stmt = (
+            select(
+                day, hour, category,
+                func.sum(Expense.amount).label('amount'),
+                func.count(Expense.id).label('count'),
+                func.sum(Expense.amount * Expense.amount).label('sum_sq'),
+                func.sum(case((Expense.amount < 500, Expense.amount), else_=0)).label('small'),
+                func.sum(case((Expense.amount >= 2000, Expense.amount), else_=0)).label('large')
+            )
+            .where(*filters)
+            .group_by(day, hour, category)
+        )
+        agg = pd.DataFrame(self.db.execute(stmt).all(),
+                           columns=['day', 'hour', 'category', 'amount', 'count', 'sum_sq', 'small', 'large'])
+        
+        if agg.empty:
+            return self._empty_summary()
+        
+        agg['date'] = pd.to_datetime(agg['day']) + pd.to_timedelta(agg['hour'].astype(int), unit='h')
+        total_spent = float(agg['amount'].sum())
+        transaction_count = int(agg['count'].sum())
+        mean_amount = total_spent / transaction_count
+        
+        return {
+            "total_spent": total_spent,
+            "transaction_count": transaction_count,
+            "average_transaction": mean_amount,
+            "categories": self._categories_from_aggregates(agg, total_spent),
+            "daily_average": float(total_spent / max(1, (end_date - start_date).days)),
+            "trends": self._analyze_trends(agg),
+            "top_merchants": self._top_merchants_sql(filters),
+            "spending_patterns": self._patterns_from_aggregates(agg, filters, total_spent, transaction_count)
+        }
+    
+    def _aggregate_std(self, total, count, sum_sq):
+        """Sample standard deviation from sum, count and sum of squares"""
+        mean = total / count
+        variance = (sum_sq - count * mean ** 2) / (count - 1)
+        return np.sqrt(np.clip(variance, 0, None))
+    
+    def _categories_from_aggregates(self, agg: pd.DataFrame, total_spent: float) -> Dict:
+        category_summary = agg.groupby(agg['category'].map(canonicalize_category))[['amount', 'count', 'sum_sq']].sum()
+        
+        result = {}
+        for category, data in category_summary.iterrows():
+            count = int(data['count'])
+            result[category] = {
+                "total": round(float(data['amount']), 2),
+                "percentage": round((data['amount'] / total_spent) * 100, 1),
+                "transaction_count": count,
+                "average_amount": round(float(data['amount'] / count), 2),
+                "volatility": round(float(self._aggregate_std(data['amount'], count, data['sum_sq'])), 2) if count > 1 else 0
+            }
+            
+        return dict(sorted(result.items(), key=lambda x: x[1]['total'], reverse=True))
+    
+    def _top_merchants_sql(self, filters: List) -> List[Dict]:
+        """Top merchants from per-description aggregates (merchant prefixes are merged in pandas)"""
+        stmt = (
+            select(
+                func.coalesce(Expense.description, '').label('description'),
+                func.sum(Expense.amount).label('sum'),
+                func.count(Expense.id).label('count')
+            )
+            .where(*filters)
+            .group_by(Expense.description)
+        )
+        df = pd.DataFrame(self.db.execute(stmt).all(), columns=['description', 'sum', 'count'])
+        if df.empty:
+            return []
+        
+        df['merchant'] = df['description'].str.split(' - ').str[0]
+        top_merchants = df.groupby('merchant')[['sum', 'count']].sum().round(2).nlargest(5, 'sum')
+        
+        return [
+            {
+                "name": merchant,
+                "total_spent": float(data['sum']),
+                "transaction_count": int(data['count']),
+                "average_amount": float(data['sum'] / data['count'])
+            }
+            for merchant, data in top_merchants.iterrows()
+        ]
+    
+    def _patterns_from_aggregates(self, agg: pd.DataFrame, filters: List,
+                                  total_spent: float, transaction_count: int) -> Dict:
+        hour_distribution = agg.groupby('hour')['amount'].sum()
+        small = float(agg['small'].sum())
+        large = float(agg['large'].sum())
+        medium = total_spent - small - large
+        
+        sum_sq = float(agg['sum_sq'].sum())
+        std = float(self._aggregate_std(total_spent, transaction_count, sum_sq)) if transaction_count > 1 else float('nan')
+        
+        impulse_score = 0.0
+        if transaction_count >= 5:
+            evening_pct = agg.loc[agg['hour'] >= 18, 'count'].sum() / transaction_count
+            weekend_pct = agg.loc[agg['date'].dt.dayofweek >= 5, 'count'].sum() / transaction_count
+            
+            # Lower median via OFFSET and a count below it: two single-row queries
+            median_stmt = (
+                select(Expense.amount).where(*filters)
+                .order_by(Expense.amount).offset((transaction_count - 1) // 2).limit(1)
+            )
+            median = self.db.execute(median_stmt).scalar()
+            below_median = self.db.execute(
+                select(func.count(Expense.id)).where(*filters, Expense.amount < median)
+            ).scalar()
+            
+            impulse_score = self._impulse_score_from_stats(
+                std / (total_spent / transaction_count),
+                evening_pct,
+                weekend_pct,
+                below_median / transaction_count
+            )
+        
+        return {
+            "peak_spending_hour": int(hour_distribution.idxmax()),
+            "transaction_size_distribution": {
+                "small_transactions_pct": round((small / total_spent) * 100, 1),
+                "medium_transactions_pct": round((medium / total_spent) * 100, 1),
+                "large_transactions_pct": round((large / total_spent) * 100, 1)
+            },
+            "spending_consistency": std,
+            "impulse_indicator": impulse_score
+        }
     
-    def generate_insights(self, user_id: str) -> List[Dict]:
+    def generate_insights(self, user_id: str, use_precomputed: bool = False) -> List[Dict]:
         """
         Generate personalized insights based on spending analysis
         """
+        if use_precomputed:
+            precomputed = self.get_precomputed_summary(user_id, "month")
+            if precomputed:
+                return precomputed['insights']
+        
         summary = self.get_spending_summary(user_id, "month")
+        return self._insights_from_summary(summary)
+    
+    def _insights_from_summary(self, summary: Dict) -> List[Dict]:
+        """Derive insights from an already computed spending summary"""
         insights = []
         
         # Budget variance insights
@@ -383,3 +583,206 @@ class SpendingAnalysisService:
             recommendations.append("You might have room for some planned purchases or investments")
         
         return recommendations
+    
+    # Batch analytics (see spending_batch_job.py)
+    
+    def load_transactions_bulk(self, user_ids: List[str], start_date: datetime, end_date: datetime) -> pd.DataFrame:
+        """
+        Load transactions for many users in as few Firestore round trips as possible.
+        Firestore 'in' filters accept at most 10 values, so user ids are queried in chunks.
+        """
+        columns = ['user_id', 'amount', 'category', 'date', 'description']
+        if not self.firestore_service or not self.firestore_service.db:
+            return pd.DataFrame(columns=columns)
+        
+        rows = []
+        for i in range(0, len(user_ids), 10):
+            chunk = user_ids[i:i + 10]
+            docs = self.firestore_service.db.collection('transactions').where('userId', 'in', chunk).stream()
+            for doc in docs:
+                data = doc.to_dict()
+                doc_date = parse_transaction_date(data.get('date', ''))
+                if doc_date is None or doc_date < start_date or doc_date > end_date:
+                    continue
+                
+                rows.append({
+                    'user_id': data.get('userId'),
+                    'amount': data.get('amount', 0),
+                    'category': data.get('category', 'uncategorized'),
+                    'date': doc_date,
+                    'description': data.get('description', '')
+                })
+        
+        return pd.DataFrame(rows, columns=columns)
+    
+    def compute_batch_summaries(self, user_ids: List[str], period: str = "month",
+                                transactions: Optional[pd.DataFrame] = None) -> Dict[str, Dict]:
+        """
+        Compute summaries and insights for many users at once.
+        Totals, category and merchant breakdowns are computed with grouped operations
+        keyed by user_id; only the time-series parts run per user group.
+        Returns: {user_id: {"summary": {...}, "insights": [...], "fingerprint": {...}}}
+        
+        Fingerprints are taken before loading, so a write that lands while the batch
+        runs makes the stored snapshot stale instead of silently missing from it.
+        Caller-supplied transactions get no fingerprint and are never served as fresh.
+        """
+        start_date, end_date = self._get_period_bounds(period)
+        fingerprints = {}
+        if transactions is None:
+            fingerprints = {user_id: self.transactions_fingerprint(user_id) for user_id in user_ids}
+        df = transactions if transactions is not None else self.load_transactions_bulk(user_ids, start_date, end_date)
+        
+        results = {}
+        for user_id in user_ids:
+            summary = self._empty_summary()
+            results[user_id] = {"summary": summary, "insights": self._insights_from_summary(summary)}
+        for user_id, result in results.items():
+            result['fingerprint'] = fingerprints.get(user_id)
+        
+        if df.empty:
+            return results
+        
+        df = df.copy()
+        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0)
+        df['date'] = pd.to_datetime(df['date'])
+        df['merchant'] = df['description'].fillna('').str.split(' - ').str[0]
+        df['category'] = df['category'].map(canonicalize_category)
+        days = max(1, (end_date - start_date).days)
+        
+        totals = df.groupby('user_id')['amount'].agg(['sum', 'count', 'mean'])
+        
+        category_stats = df.groupby(['user_id', 'category'])['amount'].agg(['sum', 'count', 'mean', 'std'])
+        category_stats['percentage'] = (
+            category_stats['sum'] / category_stats.groupby(level='user_id')['sum'].transform('sum') * 100
+        ).round(1)
+        category_stats = category_stats.round(2).sort_values('sum', ascending=False)
+        
+        merchant_stats = df.groupby(['user_id', 'merchant'])['amount'].agg(['sum', 'count']).round(2)
+        top_merchants = merchant_stats.sort_values('sum', ascending=False).groupby(level='user_id').head(5)
+        
+        categories_by_user = defaultdict(dict)
+        for (user_id, category), row in category_stats.iterrows():
+            categories_by_user[user_id][category] = {
+                "total": float(row['sum']),
+                "percentage": float(row['percentage']),
+                "transaction_count": int(row['count']),
+                "average_amount": float(row['mean']),
+                "volatility": float(row['std']) if not pd.isna(row['std']) else 0
+            }
+        
+        merchants_by_user = defaultdict(list)
+        for (user_id, merchant), row in top_merchants.iterrows():
+            merchants_by_user[user_id].append({
+                "name": merchant,
+                "total_spent": float(row['sum']),
+                "transaction_count": int(row['count']),
+                "average_amount": float(row['sum'] / row['count'])
+            })
+        
+        for user_id, user_df in df.groupby('user_id', sort=False):
+            user_df = user_df.copy()
+            user_totals = totals.loc[user_id]
+            summary = {
+                "total_spent": float(user_totals['sum']),
+                "transaction_count": int(user_totals['count']),
+                "average_transaction": float(user_totals['mean']),
+                "categories": categories_by_user[user_id],
+                "daily_average": float(user_totals['sum'] / days),
+                "trends": self._analyze_trends(user_df),
+                "top_merchants": merchants_by_user[user_id],
+                "spending_patterns": self._analyze_patterns(user_df)
+            }
+            results[user_id].update(summary=summary, insights=self._insights_from_summary(summary))
+        
+        return results
+    
+    def write_precomputed_summaries(self, results: Dict[str, Dict], period: str = "month") -> int:
+        """Persist batch results so request handlers can serve them without recomputation"""
+        if not self.firestore_service or not self.firestore_service.db:
+            raise Exception("Firestore client not initialized")
+        
+        db = self.firestore_service.db
+        computed_at = datetime.now().isoformat()
+        written = 0
+        batch = db.batch()
+        
+        for user_id, result in results.items():
+            doc_ref = db.collection(self.PRECOMPUTED_COLLECTION).document(f"{user_id}_{period}")
+            batch.set(doc_ref, {
+                'userId': user_id,
+                'period': period,
+                'summary': result['summary'],
+                'insights': result['insights'],
+                'fingerprint': result.get('fingerprint'),
+                'computedAt': computed_at
+            })
+            written += 1
+            # Firestore batches are limited to 500 writes
+            if written % 500 == 0:
+                batch.commit()
+                batch = db.batch()
+        
+        batch.commit()
+        return written
+    
+    def transactions_fingerprint(self, user_id: str) -> Dict:
+        """
+        Cheap change marker for a user's transactions: a count aggregation plus the
+        newest updatedAt. Adds and deletes change the count; the frontend stamps
+        updatedAt on every add and edit. Needs the (userId, updatedAt desc) index.
+        """
+        query = self.firestore_service.db.collection('transactions').where('userId', '==', user_id)
+        count = query.count().get()[0][0].value
+        latest = list(query.order_by('updatedAt', direction=firestore.Query.DESCENDING).limit(1).stream())
+        updated_at = latest[0].to_dict().get('updatedAt') if latest else None
+        return {
+            'transactionCount': int(count),
+            'latestUpdate': str(updated_at) if updated_at is not None else None
+        }
+    
+    def get_precomputed_summary(self, user_id: str, period: str = "month", max_age_hours: int = 24) -> Optional[Dict]:
+        """
+        Return the precomputed summary and insights for a user if the batch job
+        produced them within max_age_hours and the user's transactions have not
+        changed since, otherwise None.
+        
+        Most writes go straight from the frontend to Firestore and never reach the
+        backend, so freshness is checked on read against transactions_fingerprint().
+        """
+        if not self.firestore_service or not self.firestore_service.db:
+            return None
+        
+        try:
+            doc = self.firestore_service.db.collection(self.PRECOMPUTED_COLLECTION).document(f"{user_id}_{period}").get()
+            if not doc.exists:
+                return None
+            
+            data = doc.to_dict()
+            computed_at = datetime.fromisoformat(data.get('computedAt', ''))
+            if datetime.now() - computed_at > timedelta(hours=max_age_hours):
+                return None
+            # The period window is relative to today, so a summary from an earlier
+            # day covers a different window than a live computation would
+            if computed_at.date() != datetime.now().date():
+                return None
+            if not data.get('fingerprint') or data['fingerprint'] != self.transactions_fingerprint(user_id):
+                return None
+            
+            return data
+        except Exception as e:
+            print(f"Error reading precomputed spending summary: {e}")
+            return None
+    
+    def invalidate_precomputed_summaries(self, user_id: str):
+        """
+        Delete a user's precomputed summaries so the next request computes them live.
+        Called by backend write endpoints (add or import); frontend writes are caught
+        by the fingerprint check in get_precomputed_summary.
+        """
+        if not self.firestore_service or not self.firestore_service.db:
+            return
+        
+        collection = self.firestore_service.db.collection(self.PRECOMPUTED_COLLECTION)
+        for period in self.PERIODS:
+            collection.document(f"{user_id}_{period}").delete()
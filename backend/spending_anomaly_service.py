@@ -0,0 +1,185 @@
+"""
+Incremental anomaly detection for new transactions.
+
+Each (user, category) pair keeps a small rolling window of log-amounts in the
+spendingRollups collection. A new transaction is scored with a robust z-score
+(median/MAD of that window) when it is written, so flagging an unusual expense
+never rescans the user's history. Edits and deletes take the old amount back out
+of the window and drop the transaction's anomaly record.
+"""
+
+import hashlib
+import math
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from google.cloud import firestore
+
+from categorization_service import canonicalize_category
+from firestore_service import FirestoreService
+
+# Scale factor that makes MAD a consistent estimator of the standard deviation
+MAD_SCALE = 1.4826
+
+
+class RobustAnomalyDetector:
+    """
+    Robust z-score on log(amount) against a bounded rolling window.
+    The window size is fixed, so scoring and updating are O(1) per transaction.
+    """
+
+    def __init__(self, window_size: int = 64, threshold: float = 3.5, min_history: int = 8,
+                 min_mad: float = 0.05):
+        self.window_size = window_size
+        self.threshold = threshold
+        self.min_history = min_history
+        # Floor for MAD in log space (~5%) so identical recurring payments don't divide by zero
+        self.min_mad = min_mad
+
+    def empty_state(self) -> Dict:
+        return {'window': [], 'count': 0}
+
+    def score(self, state: Dict, amount: float) -> Optional[Dict]:
+        """Score an amount against the current state; None while history is too short"""
+        window = state.get('window', [])
+        if len(window) < self.min_history or amount <= 0:
+            return None
+
+        values = np.asarray(window, dtype=float)
+        median = float(np.median(values))
+        mad = max(float(np.median(np.abs(values - median))) * MAD_SCALE, self.min_mad)
+        z_score = (math.log(amount) - median) / mad
+
+        return {
+            'z_score': round(float(z_score), 2),
+            'is_anomaly': bool(abs(z_score) >= self.threshold),
+            'direction': 'high' if z_score > 0 else 'low',
+            'typical_amount': round(math.exp(median), 2)
+        }
+
+    def update(self, state: Dict, amount: float) -> Dict:
+        """Return the state after observing an amount"""
+        if amount <= 0:
+            return state
+        window = (state.get('window', []) + [math.log(amount)])[-self.window_size:]
+        return {'window': window, 'count': state.get('count', 0) + 1}
+
+    def remove(self, state: Dict, amount: float) -> Dict:
+        """Return the state without one observation of an amount (no-op if it has left the window)"""
+        if amount <= 0:
+            return state
+        window = list(state.get('window', []))
+        log_amount = math.log(amount)
+        for i in range(len(window) - 1, -1, -1):
+            if math.isclose(window[i], log_amount, abs_tol=1e-9):
+                del window[i]
+                return {'window': window, 'count': max(state.get('count', 0) - 1, 0)}
+        return state
+
+
+class SpendingAnomalyService:
+    """Scores transactions at write time and serves flagged anomalies"""
+
+    ROLLUP_COLLECTION = 'spendingRollups'
+    ANOMALY_COLLECTION = 'transactionAnomalies'
+
+    def __init__(self, firestore_service: FirestoreService, detector: RobustAnomalyDetector = None):
+        self.firestore_service = firestore_service
+        self.detector = detector or RobustAnomalyDetector()
+
+    def _rollup_ref(self, user_id: str, category: str):
+        # Categories are free text and may contain '/', which Firestore reads as a path separator
+        category_key = hashlib.sha1(category.encode("utf-8")).hexdigest()[:16]
+        return self.firestore_service.db.collection(self.ROLLUP_COLLECTION).document(f"{user_id}_{category_key}")
+
+    def _update_rollup(self, user_id: str, category: str, step):
+        """
+        Apply step(state) -> (new_state, result) to a rollup and return the result.
+        Read-modify-write runs in a transaction so concurrent writes for the same
+        user and category do not drop each other's window updates.
+        """
+        rollup_ref = self._rollup_ref(user_id, category)
+
+        @firestore.transactional
+        def apply(db_transaction):
+            rollup_doc = rollup_ref.get(transaction=db_transaction)
+            rollup = rollup_doc.to_dict() if rollup_doc.exists else {}
+            state = rollup.get('anomalyState') or self.detector.empty_state()
+            new_state, result = step(state)
+
+            db_transaction.set(rollup_ref, {
+                'userId': user_id,
+                'category': category,
+                'anomalyState': new_state,
+                'updatedAt': datetime.now().isoformat()
+            }, merge=True)
+            return result
+
+        return apply(self.firestore_service.db.transaction())
+
+    def process_transaction(self, user_id: str, transaction: Dict, transaction_id: str = None) -> Optional[Dict]:
+        """
+        Score a newly written expense and fold it into the rolling state.
+        Returns the score (or None when there is not enough history yet).
+        """
+        if not self.firestore_service or not self.firestore_service.db:
+            return None
+        if str(transaction.get('type', 'expense')).lower() == 'income':
+            return None
+
+        amount = float(transaction.get('amount', 0) or 0)
+        category = canonicalize_category(transaction.get('category'))
+
+        result = self._update_rollup(user_id, category,
+                                     lambda state: (self.detector.update(state, amount),
+                                                    self.detector.score(state, amount)))
+
+        if result and result['is_anomaly']:
+            self.firestore_service.db.collection(self.ANOMALY_COLLECTION).add({
+                'userId': user_id,
+                'transactionId': transaction_id,
+                'category': category,
+                'amount': amount,
+                'description': transaction.get('description', ''),
+                'date': transaction.get('date', ''),
+                'detectedAt': datetime.now().isoformat(),
+                **result
+            })
+
+        return result
+
+    def remove_transaction(self, user_id: str, transaction: Dict, transaction_id: str = None):
+        """Take a deleted expense (as it was stored) out of the rolling state and drop its anomaly"""
+        if not self.firestore_service or not self.firestore_service.db:
+            return
+        if transaction_id:
+            flagged = (self.firestore_service.db.collection(self.ANOMALY_COLLECTION)
+                       .where('userId', '==', user_id).where('transactionId', '==', transaction_id).stream())
+            for doc in flagged:
+                doc.reference.delete()
+        if str(transaction.get('type', 'expense')).lower() == 'income':
+            return
+
+        amount = float(transaction.get('amount', 0) or 0)
+        category = canonicalize_category(transaction.get('category'))
+        self._update_rollup(user_id, category, lambda state: (self.detector.remove(state, amount), None))
+
+    def update_transaction(self, user_id: str, previous: Dict, current: Dict,
+                           transaction_id: str = None) -> Optional[Dict]:
+        """Replace an edited expense: remove the old values, then score the new ones"""
+        self.remove_transaction(user_id, previous, transaction_id)
+        return self.process_transaction(user_id, current, transaction_id)
+
+    def get_user_anomalies(self, user_id: str, limit: int = 50, category: str = None) -> List[Dict]:
+        """Return previously flagged anomalies for a user, newest first"""
+        if not self.firestore_service or not self.firestore_service.db:
+            return []
+
+        query = self.firestore_service.db.collection(self.ANOMALY_COLLECTION).where('userId', '==', user_id)
+        if category:
+            query = query.where('category', '==', canonicalize_category(category))
+
+        # Backed by the (userId[, category], detectedAt desc) indexes in firestore.indexes.json
+        query = query.order_by('detectedAt', direction=firestore.Query.DESCENDING).limit(limit)
+        return [{'id': doc.id, **doc.to_dict()} for doc in query.stream()]
@@ -0,0 +1,96 @@
+"""
+Nightly batch job that precomputes spending summaries and insights for all users.
+
+Results are written to the 'spendingSummaries' Firestore collection and served by
+the /api/spending/summary and /api/spending/insights endpoints, so morning dashboard
+traffic does not have to recompute them per request.
+
+Usage:
+    python spending_batch_job.py --workers 4 --periods week month
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from typing import List
+
+from dotenv import load_dotenv
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Load environment variables
+load_dotenv()
+
+from firestore_service import FirestoreService
+from spending_analysis_service import SpendingAnalysisService
+
+
+def discover_user_ids(firestore_service: FirestoreService) -> List[str]:
+    """
+    Collect the distinct user ids that own transactions.
+    Only the userId field is projected, so this stays cheap on large collections.
+    """
+    docs = firestore_service.db.collection('transactions').select(['userId']).stream()
+    return sorted({doc.to_dict().get('userId') for doc in docs if doc.to_dict().get('userId')})
+
+
+def process_user_chunk(args) -> int:
+    """Worker entry point: bulk load, summarize and write one chunk of users"""
+    user_ids, periods = args
+    # Firestore clients are not fork-safe, so each worker creates its own
+    firestore_service = FirestoreService()
+    service = SpendingAnalysisService(None, firestore_service)
+
+    written = 0
+    for period in periods:
+        results = service.compute_batch_summaries(user_ids, period)
+        written += service.write_precomputed_summaries(results, period)
+    return written
+
+
+def run_batch_job(user_ids: List[str], periods: List[str], workers: int, chunk_size: int) -> int:
+    """Fan user chunks out to a process pool and return the number of summaries written"""
+    chunks = [(user_ids[i:i + chunk_size], periods) for i in range(0, len(user_ids), chunk_size)]
+    if not chunks:
+        return 0
+
+    if workers <= 1:
+        return sum(process_user_chunk(chunk) for chunk in chunks)
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes=workers) as pool:
+        return sum(pool.imap_unordered(process_user_chunk, chunks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute spending summaries for all users")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--periods', nargs='+', default=['month'],
+                        choices=['week', 'month', 'quarter', 'year'],
+                        help="Analysis periods to precompute")
+    parser.add_argument('--chunk-size', type=int, default=200,
+                        help="Users loaded and summarized together by one worker task")
+    parser.add_argument('--user-ids', nargs='*',
+                        help="Restrict the job to these users instead of discovering all of them")
+    args = parser.parse_args()
+
+    started = time.time()
+    user_ids = args.user_ids
+    if not user_ids:
+        firestore_service = FirestoreService()
+        if not firestore_service.db:
+            print("❌ Firestore is not available, aborting batch job")
+            sys.exit(1)
+        user_ids = discover_user_ids(firestore_service)
+
+    print(f"📊 Precomputing {', '.join(args.periods)} summaries for {len(user_ids)} users with {args.workers} workers")
+    written = run_batch_job(user_ids, args.periods, args.workers, args.chunk_size)
+    print(f"✅ Wrote {written} precomputed summaries in {time.time() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
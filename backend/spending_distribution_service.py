@@ -0,0 +1,224 @@
+"""
+Mergeable quantile sketches of transaction amounts.
+
+Every (user, category, month) keeps a log-bucketed sketch (DDSketch-style, ~1%
+relative error) that is updated with atomic Firestore increments on write.
+Edits and deletes decrement the same buckets, so sketches follow the data.
+Sketches for different months and categories merge by adding bucket counts, so
+percentiles and histograms over a range never load raw transactions.
+"""
+
+import hashlib
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+from google.cloud import firestore
+
+from categorization_service import canonicalize_category
+from firestore_service import FirestoreService
+
+
+class AmountSketch:
+    """Log-bucketed quantile sketch with bounded relative error"""
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def bucket_index(self, amount: float) -> int:
+        return int(math.ceil(math.log(amount) / self.log_gamma))
+
+    def bucket_value(self, index) -> np.ndarray:
+        """Representative value of a bucket (within relative_accuracy of every member)"""
+        return 2 * self.gamma ** np.asarray(index, dtype=float) / (self.gamma + 1)
+
+    def add(self, amount: float, count: int = 1):
+        if amount <= 0:
+            self.zero_count += count
+        else:
+            index = self.bucket_index(amount)
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.total += amount * count
+        self.min = min(self.min, amount)
+        self.max = max(self.max, amount)
+
+    def merge(self, other: 'AmountSketch') -> 'AmountSketch':
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _sorted_buckets(self):
+        indexes = np.array(sorted(self.bins), dtype=float)
+        values = self.bucket_value(indexes) if len(indexes) else np.array([])
+        counts = np.array([self.bins[int(i)] for i in indexes], dtype=float)
+        # Zero/negative amounts form the lowest bucket
+        values = np.concatenate(([0.0], values))
+        counts = np.concatenate(([self.zero_count], counts))
+        return values, np.cumsum(counts)
+
+    def quantiles(self, qs: List[float]) -> List[Optional[float]]:
+        if self.count == 0:
+            return [None for _ in qs]
+        values, cumulative = self._sorted_buckets()
+        ranks = np.clip(np.asarray(qs, dtype=float), 0, 1) * (self.count - 1)
+        positions = np.searchsorted(cumulative, ranks, side='right')
+        estimates = values[np.minimum(positions, len(values) - 1)]
+        # Representative values can fall just outside the observed range
+        return [float(v) for v in np.clip(estimates, self.min, self.max)]
+
+    def histogram(self, bins: int = 10) -> List[Dict]:
+        """
+        Adaptive (equal-mass) histogram: edges are quantiles, so dense amount ranges get
+        narrow bins and the long tail gets wide ones.
+        """
+        if self.count == 0:
+            return []
+        edges = np.unique(np.round(self.quantiles(np.linspace(0, 1, bins + 1)), 2))
+        if len(edges) < 2:
+            return [{"lower": float(edges[0]), "upper": float(edges[0]), "count": self.count}]
+
+        values, cumulative = self._sorted_buckets()
+        # Number of transactions with a bucket value <= each edge
+        below = cumulative[np.maximum(np.searchsorted(values, edges, side='right') - 1, 0)]
+        below[0] = 0
+        below[-1] = self.count
+        counts = np.diff(below)
+
+        return [
+            {"lower": float(lower), "upper": float(upper), "count": int(count)}
+            for lower, upper, count in zip(edges[:-1], edges[1:], counts)
+        ]
+
+    @classmethod
+    def from_dict(cls, data: Dict, relative_accuracy: float = 0.01) -> 'AmountSketch':
+        sketch = cls(relative_accuracy)
+        # Removed transactions leave emptied buckets behind
+        sketch.bins = {int(index): int(count) for index, count in (data.get('bins') or {}).items() if int(count) > 0}
+        sketch.zero_count = max(int(data.get('zeroCount', 0)), 0)
+        sketch.count = max(int(data.get('count', 0)), 0)
+        sketch.total = float(data.get('sum', 0.0))
+        if sketch.count == 0:
+            return sketch
+
+        # Stored min/max only ever widen, so after a removal they are narrowed to
+        # the bounds of the buckets that are still occupied
+        sketch.min = float(data.get('min', math.inf))
+        sketch.max = float(data.get('max', -math.inf))
+        if sketch.bins:
+            sketch.max = min(sketch.max, sketch.gamma ** max(sketch.bins))
+            if not sketch.zero_count:
+                sketch.min = max(sketch.min, sketch.gamma ** (min(sketch.bins) - 1))
+        else:
+            sketch.max = min(sketch.max, 0.0)
+        return sketch
+
+
+class SpendingDistributionService:
+    """Maintains monthly amount sketches and answers percentile/histogram queries"""
+
+    SKETCH_COLLECTION = 'amountSketches'
+
+    def __init__(self, firestore_service: FirestoreService, relative_accuracy: float = 0.01):
+        self.firestore_service = firestore_service
+        self.relative_accuracy = relative_accuracy
+        self._bucketer = AmountSketch(relative_accuracy)
+
+    def _sketch_ref(self, user_id: str, category: str, month: str):
+        # Categories are free text and may contain '/', which Firestore reads as a path separator
+        category_key = hashlib.sha1(category.encode("utf-8")).hexdigest()[:16]
+        return self.firestore_service.db.collection(self.SKETCH_COLLECTION).document(f"{user_id}_{category_key}_{month}")
+
+    def _apply(self, user_id: str, transaction: Dict, step: int):
+        """Add (step=1) or remove (step=-1) one expense with atomic increments (no read needed)"""
+        if not self.firestore_service or not self.firestore_service.db:
+            return
+        if str(transaction.get('type', 'expense')).lower() == 'income':
+            return
+
+        amount = float(transaction.get('amount', 0) or 0)
+        category = canonicalize_category(transaction.get('category'))
+        month = str(transaction.get('date', ''))[:7]
+        if len(month) != 7:
+            return
+
+        update = {
+            'userId': user_id,
+            'category': category,
+            'month': month,
+            'count': firestore.Increment(step),
+            'sum': firestore.Increment(step * amount)
+        }
+        if step > 0:
+            update['min'] = firestore.Minimum(amount)
+            update['max'] = firestore.Maximum(amount)
+        if amount > 0:
+            update['bins'] = {str(self._bucketer.bucket_index(amount)): firestore.Increment(step)}
+        else:
+            update['zeroCount'] = firestore.Increment(step)
+
+        self._sketch_ref(user_id, category, month).set(update, merge=True)
+
+    def record_transaction(self, user_id: str, transaction: Dict):
+        """Fold one new expense into its monthly sketch"""
+        self._apply(user_id, transaction, 1)
+
+    def remove_transaction(self, user_id: str, transaction: Dict):
+        """Take a deleted expense (as it was stored) back out of its monthly sketch"""
+        self._apply(user_id, transaction, -1)
+
+    def update_transaction(self, user_id: str, previous: Dict, current: Dict):
+        """Move an edited expense between buckets, months or categories"""
+        self.remove_transaction(user_id, previous)
+        self.record_transaction(user_id, current)
+
+    def get_sketch(self, user_id: str, start_month: str = None, end_month: str = None,
+                   category: str = None) -> AmountSketch:
+        """Merge the monthly sketches of a user within [start_month, end_month] (YYYY-MM)"""
+        merged = AmountSketch(self.relative_accuracy)
+        if not self.firestore_service or not self.firestore_service.db:
+            return merged
+
+        # Backed by the (userId[, category], month) indexes in firestore.indexes.json
+        query = self.firestore_service.db.collection(self.SKETCH_COLLECTION).where('userId', '==', user_id)
+        if category and category != 'all':
+            query = query.where('category', '==', canonicalize_category(category))
+        if start_month:
+            query = query.where('month', '>=', start_month)
+        if end_month:
+            query = query.where('month', '<=', end_month)
+
+        for doc in query.stream():
+            merged.merge(AmountSketch.from_dict(doc.to_dict(), self.relative_accuracy))
+        return merged
+
+    def get_distribution(self, user_id: str, percentiles: List[float], bins: int = 10,
+                         start_month: str = None, end_month: str = None, category: str = None) -> Dict:
+        sketch = self.get_sketch(user_id, start_month, end_month, category)
+        values = sketch.quantiles([p / 100 for p in percentiles])
+
+        return {
+            "transaction_count": sketch.count,
+            "total_amount": round(sketch.total, 2),
+            "min_amount": sketch.min if sketch.count else None,
+            "max_amount": sketch.max if sketch.count else None,
+            "percentiles": {
+                f"p{p:g}": round(value, 2) if value is not None else None
+                for p, value in zip(percentiles, values)
+            },
+            "histogram": sketch.histogram(bins),
+            "relative_accuracy": self.relative_accuracy
+        }
@@ -1,9 +1,15 @@
 import os
 import json
+import math
+import time
+from collections import Counter
 from typing import Dict, List, Optional, Any, Union
 import google.generativeai as genai
+from fastapi import Request
 from pydantic import BaseModel
 import logging
+from llm_cache import llm_response_cache
+from llm_client import llm_client
 from .form_registry import tax_form_registry, FormType, FormMetadata
 from .field_definitions import tax_field_registry
 from datetime import datetime
@@ -11,6 +17,98 @@ import re
 
 logger = logging.getLogger(__name__)
 
+# Part of the response cache key: bump whenever a search prompt or the knowledge base format changes
+PROMPT_VERSION = 2
+
+# Forms sent to Gemini per search; the rest of the registry is filtered out locally
+MAX_CANDIDATE_FORMS = 5
+# Popular forms pad vague queries that match fewer forms than this
+MIN_CANDIDATE_FORMS = 3
+# Prompt size is estimated, not counted: ~4 characters per token for English text and JSON
+CHARS_PER_TOKEN = 4
+# gemini-1.5-flash list price for prompts up to 128k tokens, USD per million input tokens
+INPUT_COST_PER_MILLION_TOKENS = float(os.getenv('GEMINI_INPUT_COST_PER_MILLION_TOKENS', '0.075'))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'be', 'can', 'do', 'does', 'for', 'from', 'have', 'i', 'if', 'in', 'is',
+    'it', 'me', 'my', 'need', 'of', 'on', 'or', 'should', 'that', 'the', 'these', 'this', 'to', 'what',
+    'which', 'with', 'you', 'your', 'form', 'forms', 'tax', 'file', 'filing'
+})
+# Everyday words for each eligibility income source, so "rent" or "freelancer" reach the right forms
+INCOME_SOURCE_TERMS = {
+    'salary': "salary salaried employee employer job pension form16",
+    'house_property': "house property rent rental landlord home flat",
+    'business': "business profession professional freelance freelancer consultant shop proprietor presumptive turnover",
+    'capital_gains': "capital gains shares stocks equity mutual funds crypto sold sale",
+    'other_sources': "interest dividend deposit fd savings lottery"
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _tokens(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+class FormRetriever:
+    """
+    Local pre-filter for form search: scores every registry form against the query
+    with IDF-weighted term overlap, and ranks forms the query names outright
+    ("ITR-2", "26Q", "form 16") first. Eligibility exclusions are left out of the indexed
+    text so "capital gains" does not pull in ITR-1, which excludes them.
+    """
+
+    def __init__(self, forms: List[FormMetadata]):
+        self.forms = {form.form_type.value: form for form in forms}
+        self.term_counts = {form_id: Counter(_tokens(self._document(form))) for form_id, form in self.forms.items()}
+        document_frequency = Counter(term for counts in self.term_counts.values() for term in counts)
+        total = len(self.forms)
+        self.idf = {term: math.log((total + 1) / (df + 0.5)) for term, df in document_frequency.items()}
+        self.aliases = {form_id: self._alias_pattern(form_id) for form_id in self.forms}
+
+    @staticmethod
+    def _document(form: FormMetadata) -> str:
+        sources = [INCOME_SOURCE_TERMS.get(source.value, source.value) for source in form.eligibility.income_sources]
+        return " ".join([
+            form.name, form.name, form.description, *sources,
+            *(form.eligibility.additional_conditions or []), *form.sections, *form.common_deductions
+        ])
+
+    @staticmethod
+    def _alias_pattern(form_id: str) -> "re.Pattern":
+        form_id = form_id.lower()
+        aliases = {form_id.replace('-', sep) for sep in ('-', '', ' ')}
+        if form_id[0].isdigit():
+            # Bare numbers ("16") are too ambiguous; ids such as 26Q or 15G are not
+            aliases = {f"form {alias}" for alias in aliases} | {f"form{alias}" for alias in aliases} | \
+                      {alias for alias in aliases if not alias.isdigit()}
+        return re.compile(r"(?<![a-z0-9])(?:" + "|".join(map(re.escape, sorted(aliases, key=len, reverse=True))) + r")(?![a-z0-9])")
+
+    def mentioned_forms(self, text: str) -> List[str]:
+        text = text.lower()
+        return [form_id for form_id, pattern in self.aliases.items() if pattern.search(text)]
+
+    def retrieve(self, query: str, limit: int = MAX_CANDIDATE_FORMS, search_type: str = "natural_language") -> List[str]:
+        """Ids of the forms most relevant to query, forms named in it first"""
+        mentioned = self.mentioned_forms(query)
+        if search_type == "comparison" and len(mentioned) >= 2:
+            # A comparison of named forms needs exactly those forms
+            return mentioned
+        terms = set(_tokens(query))
+        scores = {
+            form_id: sum(self.idf[term] * (1 + math.log(counts[term])) for term in terms if term in counts)
+            for form_id, counts in self.term_counts.items()
+        }
+        ranked = [form_id for form_id, score in sorted(scores.items(), key=lambda item: -item[1]) if score > 0]
+        candidates = list(dict.fromkeys(mentioned + ranked))[:max(limit, len(mentioned))]
+        if len(candidates) < MIN_CANDIDATE_FORMS:
+            popular = [form_id for form_id, form in self.forms.items() if form.is_popular]
+            candidates = list(dict.fromkeys(candidates + popular))[:max(MIN_CANDIDATE_FORMS, len(candidates))]
+        return candidates
+
 class FormSearchQuery(BaseModel):
     """Structured search query for tax forms"""
     query: str
@@ -33,17 +131,21 @@ class GeminiFormSearchService:
     
     def __init__(self):
         self.api_key = os.getenv('GEMINI_API_KEY')
+        self.model_name = 'gemini-1.5-flash'
         if not self.api_key:
             logger.warning("GEMINI_API_KEY not found for form search service")
             self.enabled = False
         else:
             genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.model = genai.GenerativeModel(self.model_name)
             self.enabled = True
             logger.info("Gemini Form Search Service initialized successfully")
         
-        # Pre-built form knowledge base
-        self.form_knowledge_base = self._build_form_knowledge_base()
+        # Compact per-form records; each search sends only its retrieved candidates
+        self.form_records = self._build_form_records()
+        self.retriever = FormRetriever(tax_form_registry.get_all_forms())
+        self.stats = {"searches": 0, "candidates_sent": 0, "prompt_chars": 0, "prompt_tokens_estimated": 0,
+                      "llm_seconds": 0.0}
         
         # Search prompt templates
         self.search_prompts = {
@@ -52,37 +154,53 @@ class GeminiFormSearchService:
             "comparison": self._get_comparison_search_prompt()
         }
     
-    def _build_form_knowledge_base(self) -> str:
-        """Build a comprehensive knowledge base about all available tax forms"""
-        forms = tax_form_registry.get_all_forms()
-        knowledge_base = []
-        
-        for form in forms:
-            form_info = {
-                "form_id": form.form_type.value,
+    def _build_form_records(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Compact record of every form, keyed by form id: the eligibility facts and
+        descriptions a search needs, without links, documents or empty fields
+        """
+        records = {}
+        for form in tax_form_registry.get_all_forms():
+            record = {
+                "id": form.form_type.value,
                 "name": form.name,
-                "description": form.description,
-                "difficulty": form.difficulty_level,
-                "estimated_time": form.estimated_time,
-                "income_sources": [source.value for source in form.eligibility.income_sources],
+                "desc": form.description,
+                "level": form.difficulty_level,
+                "mins": form.estimated_time,
+                "income": [source.value for source in form.eligibility.income_sources],
                 "max_income": form.eligibility.max_income,
-                "additional_conditions": form.eligibility.additional_conditions or [],
-                "excluded_conditions": form.eligibility.excluded_conditions or [],
+                "conditions": form.eligibility.additional_conditions,
+                "excluded": form.eligibility.excluded_conditions,
                 "sections": form.sections,
-                "required_documents": form.required_documents,
-                "common_deductions": form.common_deductions,
-                "is_popular": form.is_popular
+                "deductions": form.common_deductions,
+                "popular": form.is_popular
             }
-            knowledge_base.append(form_info)
-        
-        return json.dumps(knowledge_base, indent=2)
-    
+            records[record["id"]] = {key: value for key, value in record.items() if value not in (None, [], False)}
+        return records
+
+    def _candidate_knowledge_base(self, form_ids: List[str], search_type: str) -> str:
+        """Minified records of the candidate forms; sections and deductions only matter when comparing"""
+        detail_keys = {"sections", "deductions"} if search_type != "comparison" else set()
+        records = [
+            {key: value for key, value in self.form_records[form_id].items() if key not in detail_keys}
+            for form_id in form_ids
+        ]
+        return json.dumps(records, separators=(',', ':'), ensure_ascii=False)
+
+    def _retrieval_query(self, query: str, user_context: Optional[Dict[str, Any]]) -> str:
+        """The query plus the descriptive strings of the user context (ids and flags left out)"""
+        context_text = [
+            str(value) for key, value in (user_context or {}).items()
+            if key not in ("user_id", "user_authenticated") and isinstance(value, (str, int, float, list))
+        ]
+        return " ".join([query, *context_text])
+
     def _get_natural_language_search_prompt(self) -> str:
         """Get the prompt template for natural language form search"""
         return """
 You are an expert Indian tax advisor with deep knowledge of tax forms. A user is searching for tax forms using natural language.
 
-Available Tax Forms Knowledge Base:
+Candidate Tax Forms (pre-selected for this query, compact JSON):
 {knowledge_base}
 
 User Search Query: "{search_query}"
@@ -129,7 +247,7 @@ Sort results by confidence_score in descending order.
         return """
 You are an expert Indian tax advisor. A user is searching for tax forms based on specific features or requirements.
 
-Available Tax Forms Knowledge Base:
+Candidate Tax Forms (pre-selected for this query, compact JSON):
 {knowledge_base}
 
 User Feature Query: "{search_query}"
@@ -154,7 +272,7 @@ Respond in the same JSON format as natural language search, but prioritize exact
         return """
 You are an expert Indian tax advisor. A user wants to compare different tax forms.
 
-Available Tax Forms Knowledge Base:
+Candidate Tax Forms (pre-selected for this query, compact JSON):
 {knowledge_base}
 
 Comparison Query: "{search_query}"
@@ -185,7 +303,8 @@ Respond in JSON format:
 }}
 """
 
-    def search_forms(self, query: str, user_context: Dict[str, Any] = None, search_type: str = "natural_language") -> Dict[str, Any]:
+    async def search_forms(self, query: str, user_context: Dict[str, Any] = None, search_type: str = "natural_language",
+                           http_request: Optional[Request] = None) -> Dict[str, Any]:
         """
         Search tax forms using Gemini AI based on natural language query
         
@@ -193,6 +312,7 @@ Respond in JSON format:
             query: User's search query in natural language
             user_context: Additional context about the user (income, situation, etc.)
             search_type: Type of search ("natural_language", "specific_feature", "comparison")
+            http_request: Incoming request; the Gemini call is cancelled if its client disconnects
         
         Returns:
             Structured search results with confidence scores and explanations
@@ -204,37 +324,18 @@ Respond in JSON format:
             # Select the appropriate prompt template
             prompt_template = self.search_prompts.get(search_type, self.search_prompts["natural_language"])
             
-            # Format the prompt with user data
+            # Only the forms relevant to this query go into the prompt
+            candidates = self.retriever.retrieve(self._retrieval_query(query, user_context), search_type=search_type)
             formatted_prompt = prompt_template.format(
-                knowledge_base=self.form_knowledge_base,
+                knowledge_base=self._candidate_knowledge_base(candidates, search_type),
                 search_query=query,
-                user_context=json.dumps(user_context or {}, indent=2)
+                user_context=json.dumps(user_context or {}, separators=(',', ':'), default=str)
             )
             
-            # Generate response using Gemini
-            response = self.model.generate_content(formatted_prompt)
-
-            # --- Robust Gemini response text extraction patch ---
-            response_text = None
-            if hasattr(response, 'text') and isinstance(response.text, str):
-                response_text = response.text
-            elif hasattr(response, 'candidates') and response.candidates:
-                # Gemini 2.5 Flash: candidates[0].content.parts[0].text
-                try:
-                    candidate = response.candidates[0]
-                    if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                        part = candidate.content.parts[0]
-                        if isinstance(part, dict) and 'text' in part:
-                            response_text = part['text']
-                        elif hasattr(part, 'text'):
-                            response_text = part.text
-                except Exception as extract_err:
-                    logger.error(f"Error extracting text from Gemini candidates: {extract_err}")
-            if not response_text:
-                # Fallback: try str(response)
-                response_text = str(response)
-                logger.warning(f"Gemini response text extraction fallback. Raw response: {response}")
-            # --- End patch ---
+            # Generate response using Gemini (text extraction handles candidate-only responses)
+            started = time.perf_counter()
+            response_text = await llm_client.generate(self.model, formatted_prompt, request=http_request)
+            self._record_search(formatted_prompt, len(candidates), time.perf_counter() - started)
 
             # Extract JSON from response
             json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
@@ -257,7 +358,8 @@ Respond in JSON format:
             logger.error(f"Error in Gemini form search: {e}")
             return self._get_fallback_search_results(query)
     
-    def semantic_form_discovery(self, user_description: str, user_profile: Dict[str, Any] = None) -> Dict[str, Any]:
+    async def semantic_form_discovery(self, user_description: str, user_profile: Dict[str, Any] = None,
+                                      http_request: Optional[Request] = None) -> Dict[str, Any]:
         """
         Discover forms based on user's description of their tax situation
         
@@ -268,50 +370,10 @@ Respond in JSON format:
         Returns:
             Personalized form recommendations with detailed explanations
         """
-        discovery_prompt = f"""
-You are an expert Indian tax advisor. A user has described their tax situation, and you need to recommend the most suitable tax forms.
-
-Available Tax Forms Knowledge Base:
-{self.form_knowledge_base}
-
-User's Tax Situation Description:
-"{user_description}"
-
-User Profile Data:
-{json.dumps(user_profile or {}, indent=2)}
-
-Based on the user's description and profile, provide personalized form recommendations.
-
-Respond in JSON format:
-{{
-  "recommended_forms": [
-    {{
-      "form_id": "ITR-X",
-      "form_name": "Form name",
-      "suitability_score": 0.95,
-      "why_recommended": "Detailed explanation of why this form is perfect for the user",
-      "key_benefits": ["Benefit 1", "Benefit 2", "Benefit 3"],
-      "potential_concerns": ["Concern 1 if any"],
-      "preparation_tips": ["Tip 1", "Tip 2"],
-      "estimated_completion_time": 30
-    }}
-  ],
-  "situation_analysis": "Your analysis of the user's tax situation",
-  "next_steps": ["Step 1", "Step 2", "Step 3"],
-  "additional_considerations": "Any other important points to consider"
-}}
-
-Consider factors like:
-- Income complexity and sources
-- Time constraints and user experience level
-- Specific deductions and exemptions applicable
-- Compliance requirements and deadlines
-- Potential tax optimization opportunities
-"""
-        
-        return self.search_forms(user_description, user_profile, "natural_language")
+        return await self.search_forms(user_description, user_profile, "natural_language", http_request)
     
-    def find_forms_by_features(self, required_features: List[str], user_context: Dict[str, Any] = None) -> Dict[str, Any]:
+    async def find_forms_by_features(self, required_features: List[str], user_context: Dict[str, Any] = None,
+                                     http_request: Optional[Request] = None) -> Dict[str, Any]:
         """
         Find forms that support specific features or capabilities
         
@@ -323,11 +385,13 @@ Consider factors like:
             Forms that support the required features
         """
         features_query = f"I need tax forms that support: {', '.join(required_features)}"
-        return self.search_forms(features_query, user_context, "specific_feature")
+        return await self.search_forms(features_query, user_context, "specific_feature", http_request)
     
-    def compare_forms(self, form_ids: List[str], comparison_context: str = "") -> Dict[str, Any]:
+    async def compare_forms(self, form_ids: List[str], comparison_context: str = "",
+                            http_request: Optional[Request] = None) -> Dict[str, Any]:
         """
-        Compare specific tax forms using AI analysis
+        Compare specific tax forms using AI analysis. Comparisons are cached per set of
+        forms (in any order) and context.
         
         Args:
             form_ids: List of form IDs to compare
@@ -336,9 +400,38 @@ Consider factors like:
         Returns:
             Detailed comparison of the specified forms
         """
+        form_ids = sorted(form_id.strip().upper() for form_id in form_ids)
         comparison_query = f"Compare these tax forms: {', '.join(form_ids)}. {comparison_context}"
-        return self.search_forms(comparison_query, {}, "comparison")
+        key = llm_response_cache.make_key(self.model_name, "compare_forms", PROMPT_VERSION,
+                                          form_ids=form_ids, comparison_context=comparison_context)
+        return await llm_response_cache.get_or_generate(
+            key,
+            lambda: self.search_forms(comparison_query, {}, "comparison", http_request),
+            cacheable=lambda results: results.get("source") == "ai_generated"
+        )
     
+    def _record_search(self, prompt: str, candidates: int, seconds: float):
+        self.stats["searches"] += 1
+        self.stats["candidates_sent"] += candidates
+        self.stats["prompt_chars"] += len(prompt)
+        self.stats["prompt_tokens_estimated"] += estimate_tokens(prompt)
+        self.stats["llm_seconds"] += seconds
+
+    def prompt_stats(self) -> Dict[str, Any]:
+        """Per-search averages of prompt size, estimated input cost and Gemini latency"""
+        searches = self.stats["searches"]
+        if not searches:
+            return {"searches": 0}
+        avg_tokens = self.stats["prompt_tokens_estimated"] / searches
+        return {
+            "searches": searches,
+            "avg_candidates_sent": round(self.stats["candidates_sent"] / searches, 2),
+            "avg_prompt_chars": round(self.stats["prompt_chars"] / searches),
+            "avg_prompt_tokens_estimated": round(avg_tokens),
+            "avg_input_cost_usd": round(avg_tokens * INPUT_COST_PER_MILLION_TOKENS / 1e6, 8),
+            "avg_llm_seconds": round(self.stats["llm_seconds"] / searches, 3)
+        }
+
     def _get_fallback_search_results(self, query: str) -> Dict[str, Any]:
         """
         Fallback search results when AI is not available
@@ -403,3 +496,52 @@ Consider factors like:
 
 # Global instance
 gemini_form_search_service = GeminiFormSearchService()
+
+BENCHMARK_QUERIES = [
+    ("natural_language", "I have salary income and rent from one flat"),
+    ("natural_language", "I am a freelancer with presumptive income"),
+    ("natural_language", "I sold shares and mutual funds this year"),
+    ("natural_language", "I'm a first-time filer, what should I use?"),
+    ("specific_feature", "I need tax forms that support: capital_gains, foreign_assets"),
+    ("comparison", "Compare these tax forms: ITR-1, ITR-2. "),
+    ("comparison", "Compare these tax forms: 15G, 15H. Senior citizen"),
+]
+
+
+def benchmark_prompts(service: GeminiFormSearchService = gemini_form_search_service) -> List[Dict[str, Any]]:
+    """
+    Prompt size per benchmark query with every form pretty-printed into the prompt
+    versus only the retrieved candidates as minified records
+    """
+    full_knowledge_base = json.dumps(list(service.form_records.values()), indent=2, ensure_ascii=False)
+    rows = []
+    for search_type, query in BENCHMARK_QUERIES:
+        template = service.search_prompts[search_type]
+        candidates = service.retriever.retrieve(query, search_type=search_type)
+        before = template.format(knowledge_base=full_knowledge_base, search_query=query,
+                                 user_context=json.dumps({}, indent=2))
+        after = template.format(knowledge_base=service._candidate_knowledge_base(candidates, search_type),
+                                search_query=query, user_context=json.dumps({}, separators=(',', ':')))
+        rows.append({
+            "search_type": search_type,
+            "query": query,
+            "candidates": candidates,
+            "tokens_before": estimate_tokens(before),
+            "tokens_after": estimate_tokens(after),
+            "cost_before_usd": estimate_tokens(before) * INPUT_COST_PER_MILLION_TOKENS / 1e6,
+            "cost_after_usd": estimate_tokens(after) * INPUT_COST_PER_MILLION_TOKENS / 1e6
+        })
+    return rows
+
+
+if __name__ == '__main__':
+    # python -m tax_filing.gemini_form_search_service (from backend/)
+    results = benchmark_prompts()
+    for row in results:
+        print(f"{row['search_type']:<17} {row['tokens_before']:>5} -> {row['tokens_after']:>4} tokens  "
+              f"{', '.join(row['candidates']):<32} {row['query']}")
+    before = sum(row['tokens_before'] for row in results) / len(results)
+    after = sum(row['tokens_after'] for row in results) / len(results)
+    print(f"average prompt {before:.0f} -> {after:.0f} tokens ({1 - after / before:.0%} smaller), "
+          f"input cost per 1,000 searches ${before * INPUT_COST_PER_MILLION_TOKENS / 1e3:.4f} -> "
+          f"${after * INPUT_COST_PER_MILLION_TOKENS / 1e3:.4f}")
@@ -4,28 +4,45 @@ import logging
 from typing import Dict, List, Any, Optional
 
 import google.generativeai as genai
+from fastapi import Request
+
+from llm_cache import llm_response_cache
+from llm_client import llm_client
 
 logger = logging.getLogger(__name__)
 
+# Part of the response cache key: bump whenever the prompt below changes
+PROMPT_VERSION = 1
+
 class GeminiGlossaryService:
     """Service for generating detailed explanations for tax glossary terms using Google Gemini API."""
 
     def __init__(self):
         self.api_key = os.getenv('GEMINI_API_KEY')
+        self.model_name = 'gemini-1.5-flash'
         if not self.api_key:
             logger.warning("GEMINI_API_KEY not found for glossary service. AI explanations will be disabled.")
             self.enabled = False
         else:
             genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.model = genai.GenerativeModel(self.model_name)
             self.enabled = True
             logger.info("Gemini Glossary Service initialized successfully.")
 
-    def get_explanation(self, term: str) -> Dict[str, Any]:
+    async def get_explanation(self, term: str, http_request: Optional[Request] = None) -> Dict[str, Any]:
         """
         Generate a detailed and easy-to-understand explanation for a given tax term.
+        Explanations are cached per term (case and spacing ignored).
         Returns: { term: str, explanation: str, examples: List[str], related_terms: List[str] }
         """
+        key = llm_response_cache.make_key(self.model_name, "glossary_explanation", PROMPT_VERSION, term=term)
+        return await llm_response_cache.get_or_generate(
+            key,
+            lambda: self._generate_explanation(term, http_request),
+            cacheable=lambda result: result.get("success") is True
+        )
+
+    async def _generate_explanation(self, term: str, http_request: Optional[Request]) -> Dict[str, Any]:
         try:
             prompt = f"""
             You are an expert Indian tax advisor. Provide a detailed but easy-to-understand explanation for the Indian tax term: "{term}".
@@ -56,8 +73,7 @@ class GeminiGlossaryService:
             """
 
             if self.enabled:
-                response = self.model.generate_content(prompt)
-                response_text = response.text
+                response_text = await llm_client.generate(self.model, prompt, request=http_request)
                 # Extract JSON object from response
                 start_idx = response_text.find('{')
                 end_idx = response_text.rfind('}') + 1
@@ -1,9 +1,12 @@
 import os
 import json
-from typing import Dict, List, Optional, Any
+from typing import AsyncIterator, Dict, List, Optional, Any
 import google.generativeai as genai
+from fastapi import Request
 from pydantic import BaseModel
 import logging
+from llm_client import llm_client
+from llm_stream import Envelope, stream_json_events, stream_result
 from .field_definitions import tax_field_registry
 from .form_registry import tax_form_registry, FormType
 from datetime import datetime
@@ -32,7 +35,8 @@ class GeminiTaxService:
             self.enabled = True
             logger.info("Gemini Tax Service initialized successfully")
     
-    def get_field_assistance(self, form_id: str, field_id: str, user_query: str, current_form_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def get_field_assistance(self, form_id: str, field_id: str, user_query: str, current_form_data: Dict[str, Any],
+                                   http_request: Optional[Request] = None) -> Dict[str, Any]:
         """Provide detailed explanation for a specific tax form field"""
         if not self.enabled:
             return self._get_fallback_field_explanation(field_id)
@@ -41,8 +45,37 @@ class GeminiTaxService:
         if not field_def:
             return {"error": f"Unknown field: {field_id}"}
         
-        
-        prompt = f"""
+        prompt = self._build_field_prompt(form_id, field_id, field_def, user_query, current_form_data)
+        try:
+            response_text = await llm_client.generate(self.model, prompt, request=http_request)
+            return self._parse_field_assistance(response_text)
+            
+        except Exception as e:
+            logger.error(f"Error generating field explanation: {e}")
+            return self._get_fallback_field_explanation(field_id)
+    
+    def stream_field_assistance(self, form_id: str, field_id: str, user_query: str,
+                                current_form_data: Dict[str, Any], envelope: Envelope = None) -> AsyncIterator[str]:
+        """
+        Server-Sent Events for get_field_assistance: text deltas, completed sections, then
+        the assistance (as envelope(assistance) when given)
+        """
+        if not self.enabled:
+            return stream_result(self._get_fallback_field_explanation(field_id), envelope)
+        field_def = tax_field_registry.get_field(field_id)
+        if not field_def:
+            return stream_result({"error": f"Unknown field: {field_id}"}, envelope)
+        return stream_json_events(
+            self.model,
+            self._build_field_prompt(form_id, field_id, field_def, user_query, current_form_data),
+            finalize=self._parse_field_assistance,
+            fallback=lambda: self._get_fallback_field_explanation(field_id),
+            envelope=envelope
+        )
+    
+    def _build_field_prompt(self, form_id: str, field_id: str, field_def, user_query: str,
+                            current_form_data: Dict[str, Any]) -> str:
+        return f"""
         You are an expert Indian tax advisor. A user is asking for help with a field on a tax form.
 
         Form: {form_id}
@@ -73,23 +106,17 @@ class GeminiTaxService:
           ]
         }}
         """
+    
+    def _parse_field_assistance(self, response_text: str) -> Dict[str, Any]:
+        """Assistance JSON from the response text; raises ValueError when there is none"""
+        start_idx = response_text.find('{')
+        end_idx = response_text.rfind('}') + 1
+        json_content = response_text[start_idx:end_idx]
         
-        try:
-            response = self.model.generate_content(prompt)
-            # Parse JSON from response
-            response_text = response.text
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
-            json_content = response_text[start_idx:end_idx]
-            
-            explanation = json.loads(json_content)
-            explanation['source'] = 'ai_generated'
-            
-            return explanation
-            
-        except Exception as e:
-            logger.error(f"Error generating field explanation: {e}")
-            return self._get_fallback_field_explanation(field_id)
+        explanation = json.loads(json_content)
+        explanation['source'] = 'ai_generated'
+        
+        return explanation
     
     def _get_fallback_field_explanation(self, field_id: str) -> Dict[str, Any]:
         """Fallback explanation when AI is not available"""
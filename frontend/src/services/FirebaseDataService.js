@@ -18,6 +18,8 @@ import {
 } from 'firebase/firestore';
 import { auth, db } from '../firebase';
 
+const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
+
 export class FirebaseDataService {
   constructor() {
     this.userId = null;
@@ -59,6 +61,8 @@ export class FirebaseDataService {
         await this.incrementGoalSaved(transactionData.goalId, transactionData.amount);
       }
       
+      await this.syncTransactionRollups(docRef.id, null, transactionData);
+      
       console.log('✅ Transaction added with ID:', docRef.id);
       return { id: docRef.id, ...transactionData };
     } catch (error) {
@@ -80,6 +84,9 @@ export class FirebaseDataService {
         ...updateData,
         updatedAt: serverTimestamp()
       });
+      if (prev) {
+        await this.syncTransactionRollups(transactionId, prev, { ...prev, ...updateData });
+      }
       // Handle goal progress update
       if (prev) {
         // If goal changed, decrement old, increment new
@@ -110,6 +117,9 @@ export class FirebaseDataService {
       const prevSnap = await getDoc(docRef);
       const prev = prevSnap.exists() ? prevSnap.data() : null;
       await deleteDoc(docRef);
+      if (prev) {
+        await this.syncTransactionRollups(transactionId, prev, null);
+      }
       // If linked to a goal, decrement saved
       if (prev && prev.goalId && prev.amount > 0) {
         await this.decrementGoalSaved(prev.goalId, prev.amount);
@@ -121,6 +131,35 @@ export class FirebaseDataService {
     }
   }
 
+  // Anomaly scores and amount distributions are kept by the backend; tell it about
+  // writes made here. Best effort: a failed sync must not fail the write itself.
+  async syncTransactionRollups(transactionId, previous, current) {
+    const pick = (t) => t && {
+      amount: t.amount,
+      category: t.category,
+      date: t.date,
+      type: t.type,
+      description: t.description
+    };
+    try {
+      const token = await auth.currentUser.getIdToken();
+      await fetch(`${API_BASE_URL}/api/transactions/sync-rollups`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${token}`
+        },
+        body: JSON.stringify({
+          transaction_id: transactionId,
+          previous: pick(previous),
+          current: pick(current)
+        })
+      });
+    } catch (error) {
+      console.warn('⚠️ Could not sync transaction rollups:', error);
+    }
+  }
+
   async getTransactions(filters = {}) {
     try {
       const userId = this.getCurrentUserId();